@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of ``CAPPortalAutomator.automate_data_entry``.
+
+Starts the mock portal from ``mock_portal.py`` in-process, generates a kit
+of ``--specimens`` x ``--analytes`` values and runs the real automator
+against it in headless Chrome for each fill mode (or over plain HTTP with
+``CAPPortalHTTPClient`` for mode ``http``). For every run it reports:
+
+  * total seconds (browser start, login, fill, submit) and fill seconds
+  * specimens per second over the fill phase
+  * WebDriver commands (HTTP requests for ``http``) in all and per
+    specimen during the fill phase
+  * how many submitted cells the portal received with the expected value
+
+The browser modes need Chrome and selenium, like the automator itself.
+
+Usage::
+
+    python3 benchmarks/bench_automation.py [--specimens 100] [--analytes 20]
+        [--modes bulk,field,http] [--runs 3] [--latency 0] [--failure-rate 0]
+        [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CGI_DIR = os.path.join(os.path.dirname(BENCH_DIR), "cgi-bin")
+sys.path.insert(0, CGI_DIR)
+
+from cap_automation import CAPPortalAutomator, iter_specimen_data  # noqa: E402
+from cap_http import CAPPortalHTTPClient  # noqa: E402
+from mock_portal import MockPortal, generate_kit_data, start_portal  # noqa: E402
+
+
+class CountingAutomator(CAPPortalAutomator):
+    """Automator that counts WebDriver commands and times the fill phase."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = Counter()
+        self.fill_commands = 0
+        self.fill_seconds = 0.0
+
+    def setup_driver(self):
+        if not super().setup_driver():
+            return False
+        # Every WebDriver command, including WebElement ones, goes through
+        # the driver's execute()
+        execute = self.driver.execute
+
+        def counting_execute(driver_command, params=None):
+            self.commands[driver_command] += 1
+            return execute(driver_command, params)
+
+        self.driver.execute = counting_execute
+        return True
+
+    def fill_specimens(self, specimens, progress=None, on_filled=None):
+        before = sum(self.commands.values())
+        start = time.perf_counter()
+        try:
+            return super().fill_specimens(specimens, progress, on_filled)
+        finally:
+            self.fill_seconds = time.perf_counter() - start
+            self.fill_commands = sum(self.commands.values()) - before
+
+
+class CountingHTTPClient(CAPPortalHTTPClient):
+    """HTTP client that counts requests and times the fill phase."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = Counter()
+        self.fill_commands = 0
+        self.fill_seconds = 0.0
+
+    def _request(self, method, url, step, **kwargs):
+        self.commands[method] += 1
+        return super()._request(method, url, step, **kwargs)
+
+    def fill_specimens(self, specimens, progress=None, on_filled=None):
+        before = sum(self.commands.values())
+        start = time.perf_counter()
+        try:
+            return super().fill_specimens(specimens, progress, on_filled)
+        finally:
+            self.fill_seconds = time.perf_counter() - start
+            self.fill_commands = sum(self.commands.values()) - before
+
+
+def verify(portal, kit_number, data):
+    """Return ``(matching, expected)`` cell counts for a submitted kit."""
+    submitted = portal.submissions.get(kit_number, {})
+    expected = matching = 0
+    for specimen_id, analyte_data in iter_specimen_data(data):
+        for analyte, value in analyte_data.items():
+            expected += 1
+            matching += submitted.get((str(specimen_id), analyte)) == str(value)
+    return matching, expected
+
+
+def run_case(portal, url, data, mode, run):
+    """Run one kit through the automator and return its measurements."""
+    kit_number = f"BENCH-{mode}-{run}"
+    if mode == "http":
+        automator = CountingHTTPClient(url, "bench", "bench")
+    else:
+        automator = CountingAutomator(url, "bench", "bench", headless=True, fill_mode=mode)
+    start = time.perf_counter()
+    success, message = automator.automate_data_entry(kit_number, data)
+    seconds = time.perf_counter() - start
+    specimens = len(data["records"])
+    matching, expected = verify(portal, kit_number, data)
+    return {
+        "mode": mode,
+        "run": run,
+        "success": success,
+        "message": message,
+        "specimens": specimens,
+        "seconds": round(seconds, 3),
+        "fill_seconds": round(automator.fill_seconds, 3),
+        "specimens_per_sec": round(specimens / automator.fill_seconds, 1)
+        if automator.fill_seconds else None,
+        "webdriver_calls": sum(automator.commands.values()),
+        "fill_calls": automator.fill_commands,
+        "calls_per_specimen": round(automator.fill_commands / specimens, 2),
+        "cells_verified": matching,
+        "cells_expected": expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CAP automator against the mock portal.")
+    parser.add_argument("--specimens", type=int, default=100)
+    parser.add_argument("--analytes", type=int, default=20)
+    parser.add_argument("--modes", default="bulk,field",
+                        help="comma-separated fill modes to compare (bulk, field, http)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every portal request")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of portal page loads that fail")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    portal = MockPortal(args.specimens, args.analytes, args.latency, args.failure_rate, seed=0)
+    server, url = start_portal(portal)
+    data = generate_kit_data(args.specimens, args.analytes)
+
+    results = []
+    print(f"{args.specimens} specimens x {args.analytes} analytes, latency {args.latency}s, "
+          f"failure rate {args.failure_rate}")
+    print(f"{'mode':<6} {'run':>3} {'total s':>8} {'fill s':>8} {'spec/s':>8} "
+          f"{'calls':>7} {'calls/spec':>10} {'verified':>12}  result")
+    try:
+        for mode in args.modes.split(","):
+            for run in range(1, args.runs + 1):
+                result = run_case(portal, url, data, mode.strip(), run)
+                results.append(result)
+                print(f"{result['mode']:<6} {run:>3} {result['seconds']:>8.2f} "
+                      f"{result['fill_seconds']:>8.2f} {result['specimens_per_sec'] or 0:>8.1f} "
+                      f"{result['webdriver_calls']:>7} {result['calls_per_specimen']:>10.2f} "
+                      f"{result['cells_verified']:>5}/{result['cells_expected']:<6}  "
+                      f"{result['message']}")
+    finally:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "specimens": args.specimens,
+                "analytes": args.analytes,
+                "latency": args.latency,
+                "failure_rate": args.failure_rate,
+                "portal_requests": portal.requests,
+                "portal_failures": portal.failures,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the upload pipeline: parse -> analyze -> store -> load.
+
+Generates synthetic workbooks of increasing size and times each stage of
+``cgi-bin/upload.py`` on them:
+
+  * ``parse``   -- ``parse_excel`` on the workbook bytes
+  * ``analyze`` -- ``analyze_data``
+  * ``store``   -- ``store_temp_data`` (into a scratch store directory)
+  * ``load``    -- ``load_temp_data`` plus reading every specimen the way
+                   the automator does (``iter_specimen_data``)
+
+Each workbook has a specimen id column and ``analytes`` value columns, and
+optionally a units and a qualifier column per analyte (clutter the column
+inference has to skip). Cells are blank, non-numeric or duplicated at the
+requested rates.
+
+Every stage is run ``--repeat`` times and the fastest time kept; a separate
+run under ``tracemalloc`` records its peak Python memory. Results are saved
+as JSON (default ``benchmarks/results/pipeline-<timestamp>.json``), and
+``--compare`` prints the change against an earlier results file, flagging
+stages that got slower by more than ``--threshold``.
+
+Usage::
+
+    python3 benchmarks/bench_pipeline.py [--sizes 1000x10,10000x20,50000x40]
+        [--clutter] [--missing-rate 0.02] [--non-numeric-rate 0.01]
+        [--duplicate-rate 0.01] [--repeat 3] [--compare old.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CGI_DIR = os.path.join(os.path.dirname(BENCH_DIR), "cgi-bin")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# The store reads its settings at import time, so point it at a scratch
+# directory (and lift the size cap) before importing upload.
+SCRATCH_STORE = tempfile.mkdtemp(prefix="cap_bench_store_")
+os.environ["CAP_STORE_DIR"] = SCRATCH_STORE
+os.environ["CAP_STORE_MAX_MB"] = "100000"
+sys.path.insert(0, CGI_DIR)
+
+from portal_automation import iter_specimen_data  # noqa: E402
+from upload import (  # noqa: E402
+    HAVE_CALAMINE,
+    analyze_data,
+    load_temp_data,
+    parse_excel,
+    store_temp_data,
+)
+
+STAGES = ("parse", "analyze", "store", "load")
+
+
+def generate_workbook(rows, analytes, clutter=False, missing_rate=0.0,
+                      non_numeric_rate=0.0, duplicate_rate=0.0, seed=0):
+    """Return ``.xlsx`` bytes for a synthetic specimen x analyte sheet."""
+    rng = np.random.default_rng(seed)
+    specimens = np.array([f"S{n:06d}" for n in range(1, rows + 1)], dtype=object)
+    # Duplicates reuse the id of an earlier row
+    duplicate = np.flatnonzero(rng.random(rows) < duplicate_rate)
+    duplicate = duplicate[duplicate > 0]
+    specimens[duplicate] = specimens[rng.integers(0, duplicate)]
+    columns = {"Specimen ID": specimens}
+    for n in range(1, analytes + 1):
+        name = f"Analyte {n:02d}"
+        values = np.round(rng.uniform(1, 500, rows), 1).astype(object)
+        roll = rng.random(rows)
+        values[roll < missing_rate] = None
+        values[(roll >= missing_rate) & (roll < missing_rate + non_numeric_rate)] = "<5.0"
+        columns[name] = values
+        if clutter:
+            columns[f"{name} Units"] = np.full(rows, "mg/dL", dtype=object)
+            columns[f"{name} Qualifier"] = np.where(rng.random(rows) < 0.05, "H", None)
+    buffer = BytesIO()
+    pd.DataFrame(columns).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def run_pipeline(workbook):
+    """Run every stage once; return ``({stage: seconds}, counts)``."""
+    timings = {}
+    start = time.perf_counter()
+    df = parse_excel(workbook)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summary, issues, sample_col, analyte_cols, results = analyze_data(df)
+    timings["analyze"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    key = store_temp_data(df, sample_col, analyte_cols, summary, issues, results=results)
+    timings["store"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    specimens = sum(1 for _ in iter_specimen_data(load_temp_data(key)))
+    timings["load"] = time.perf_counter() - start
+    return timings, {"records": len(df), "issues": len(issues),
+                     "analytes": len(analyte_cols), "results": len(results),
+                     "specimens": specimens}
+
+
+def profile_memory(workbook):
+    """Return each stage's peak traced memory in bytes."""
+    peaks = {}
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        df = parse_excel(workbook)
+        peaks["parse"] = tracemalloc.get_traced_memory()[1]
+
+        tracemalloc.reset_peak()
+        summary, issues, sample_col, analyte_cols, results = analyze_data(df)
+        peaks["analyze"] = tracemalloc.get_traced_memory()[1]
+
+        tracemalloc.reset_peak()
+        key = store_temp_data(df, sample_col, analyte_cols, summary, issues, results=results)
+        peaks["store"] = tracemalloc.get_traced_memory()[1]
+
+        del df
+        tracemalloc.reset_peak()
+        for _ in iter_specimen_data(load_temp_data(key)):
+            pass
+        peaks["load"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def bench_size(rows, analytes, args):
+    workbook = generate_workbook(
+        rows, analytes, args.clutter, args.missing_rate,
+        args.non_numeric_rate, args.duplicate_rate,
+    )
+    best = {}
+    for _ in range(args.repeat):
+        timings, counts = run_pipeline(workbook)
+        for stage, seconds in timings.items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+    return {
+        "name": f"{rows}x{analytes}",
+        "rows": rows,
+        "analytes": analytes,
+        "workbook_bytes": len(workbook),
+        **counts,
+        "seconds": {stage: round(best[stage], 4) for stage in STAGES},
+        "peak_bytes": profile_memory(workbook),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print per-stage time ratios against ``baseline``; return regressions."""
+    previous = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    print(f"\nCompared with {baseline.get('created', 'baseline')}:")
+    for case in results["cases"]:
+        old = previous.get(case["name"])
+        if old is None:
+            continue
+        parts = []
+        for stage in STAGES:
+            ratio = case["seconds"][stage] / old["seconds"][stage] if old["seconds"][stage] else 1.0
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = " !"
+                regressions.append((case["name"], stage, ratio))
+            parts.append(f"{stage} x{ratio:.2f}{flag}")
+        print(f"  {case['name']:<12} " + "  ".join(parts))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse -> analyze -> store -> load.")
+    parser.add_argument("--sizes", default="1000x10,10000x20,50000x40",
+                        help="comma-separated ROWSxANALYTES workbook sizes")
+    parser.add_argument("--clutter", action="store_true",
+                        help="add a units and a qualifier column per analyte")
+    parser.add_argument("--missing-rate", type=float, default=0.02)
+    parser.add_argument("--non-numeric-rate", type=float, default=0.01)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per size; the fastest is kept")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/pipeline-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown fraction reported as a regression")
+    args = parser.parse_args()
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "calamine": HAVE_CALAMINE,
+        "options": {
+            "clutter": args.clutter,
+            "missing_rate": args.missing_rate,
+            "non_numeric_rate": args.non_numeric_rate,
+            "duplicate_rate": args.duplicate_rate,
+            "repeat": args.repeat,
+        },
+        "cases": [],
+    }
+    print(f"{'size':<12} {'records':>8} {'issues':>7} "
+          + " ".join(f"{stage + ' s':>9}" for stage in STAGES)
+          + " " + " ".join(f"{stage + ' MB':>10}" for stage in STAGES))
+    for size in args.sizes.split(","):
+        rows, analytes = (int(part) for part in size.lower().split("x"))
+        try:
+            case = bench_size(rows, analytes, args)
+        finally:
+            shutil.rmtree(SCRATCH_STORE, ignore_errors=True)
+            os.makedirs(SCRATCH_STORE)
+        results["cases"].append(case)
+        print(f"{case['name']:<12} {case['records']:>8} {case['issues']:>7} "
+              + " ".join(f"{case['seconds'][stage]:>9.3f}" for stage in STAGES)
+              + " " + " ".join(f"{case['peak_bytes'][stage] / 2**20:>10.1f}" for stage in STAGES))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    shutil.rmtree(SCRATCH_STORE, ignore_errors=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the CAP portal, for exercising ``CAPPortalAutomator``.
+
+The pages carry exactly the DOM hooks the automator relies on:
+
+  * ``/``        -- login form (``username``, ``password``, ``Login``) or,
+                    once logged in, a ``.dashboard`` with the ``kit_search``
+                    box and ``Search Kit`` button
+  * ``/kit``     -- ``#kit-data-form`` for the searched kit: one
+                    ``tr[data-specimen-id]`` per generated specimen holding
+                    one ``input[data-analyte]`` per generated analyte, and a
+                    ``Submit Data`` button
+  * ``/submit``  -- records the posted values and shows ``.success-message``
+
+The login and kit forms carry a one-time ``csrf_token`` hidden field, and
+posts without a valid one are refused with a 403, as a real portal would.
+
+Every kit number gets the same generated form (``specimens`` x ``analytes``,
+ids from ``specimen_ids`` and ``analyte_names``), and
+``generate_kit_data`` builds matching upload data. Submitted values are kept
+in ``MockPortal.submissions`` so a run can be checked cell by cell.
+
+To shake out the automator's waits and retries, each request can be delayed
+by ``latency`` seconds, a ``failure_rate`` fraction of page loads (GETs) can
+fail with a 503 page, and logins can expire after ``session_ttl`` seconds.
+
+Usage::
+
+    python3 benchmarks/mock_portal.py [--port 8765] [--specimens 100] [--analytes 20]
+        [--latency 0.05] [--failure-rate 0.02] [--session-ttl 300]
+"""
+
+import argparse
+import html
+import random
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+COOKIE = "mock_cap_session"
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="UTF-8"><title>Mock CAP Portal</title></head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+LOGIN_BODY = """
+<h1>Mock CAP Portal</h1>
+<form method="post" action="/login">
+    <input type="hidden" name="csrf_token" value="{csrf}">
+    <input type="text" name="username">
+    <input type="password" name="password">
+    <input type="submit" value="Login">
+</form>
+"""
+
+DASHBOARD_BODY = """
+<div class="dashboard">
+    <h1>Dashboard</h1>
+    <form method="get" action="/kit">
+        <input type="text" name="kit_search">
+        <input type="submit" value="Search Kit">
+    </form>
+</div>
+"""
+
+KIT_BODY = """
+<h1>Kit {kit}</h1>
+<form id="kit-data-form" method="post" action="/submit">
+    <input type="hidden" name="kit" value="{kit}">
+    <input type="hidden" name="csrf_token" value="{csrf}">
+    <table>
+        <tr><th>Specimen</th>{header}</tr>
+        {rows}
+    </table>
+    <input type="submit" value="Submit Data">
+</form>
+"""
+
+
+def specimen_ids(count):
+    """Return the specimen ids the mock portal renders."""
+    return [f"S{n:04d}" for n in range(1, count + 1)]
+
+
+def analyte_names(count):
+    """Return the analyte names the mock portal renders."""
+    return [f"Analyte{n:02d}" for n in range(1, count + 1)]
+
+
+def generate_kit_data(specimens, analytes, seed=0):
+    """Return upload data (``records`` form) matching the portal's kit form."""
+    rng = random.Random(seed)
+    names = analyte_names(analytes)
+    records = []
+    for specimen in specimen_ids(specimens):
+        record = {"Specimen ID": specimen}
+        record.update((name, f"{rng.uniform(1, 500):.1f}") for name in names)
+        records.append(record)
+    return {
+        "sample_column": "Specimen ID",
+        "analyte_columns": names,
+        "records": records,
+    }
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class MockPortal:
+    """WSGI application serving the mock portal pages."""
+
+    def __init__(self, specimens=100, analytes=20, latency=0.0, failure_rate=0.0,
+                 session_ttl=None, seed=None):
+        self.specimens = specimen_ids(specimens)
+        self.analytes = analyte_names(analytes)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.session_ttl = session_ttl
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._csrf_tokens = set()
+        self.submissions = {}
+        self.requests = 0
+        self.failures = 0
+        self._kit_body = None
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.requests += 1
+            fail = (environ["REQUEST_METHOD"] == "GET"
+                    and self._random.random() < self.failure_rate)
+            if fail:
+                self.failures += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return self._page(start_response, "<h1>Service Unavailable</h1>",
+                              "503 Service Unavailable")
+
+        path = environ.get("PATH_INFO", "/")
+        logged_in = self._logged_in(environ)
+        if path == "/login" and environ["REQUEST_METHOD"] == "POST":
+            return self._login(environ, start_response)
+        if not logged_in:
+            return self._page(start_response, LOGIN_BODY.format(csrf=self._issue_csrf()))
+        if path == "/kit":
+            query = parse_qs(environ.get("QUERY_STRING", ""))
+            kit = query.get("kit_search", [""])[0].strip()
+            return self._page(start_response, self._render_kit(kit))
+        if path == "/submit" and environ["REQUEST_METHOD"] == "POST":
+            return self._submit(environ, start_response)
+        return self._page(start_response, DASHBOARD_BODY)
+
+    def _page(self, start_response, body, status="200 OK", headers=()):
+        payload = PAGE.format(body=body).encode("utf-8")
+        start_response(status, [
+            ("Content-Type", "text/html; charset=utf-8"),
+            ("Content-Length", str(len(payload))),
+            *headers,
+        ])
+        return [payload]
+
+    def _form(self, environ):
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(length).decode("utf-8")
+        return parse_qs(body, keep_blank_values=True)
+
+    def _issue_csrf(self):
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._csrf_tokens.add(token)
+        return token
+
+    def _check_csrf(self, form):
+        token = form.get("csrf_token", [""])[0]
+        with self._lock:
+            if token in self._csrf_tokens:
+                self._csrf_tokens.discard(token)
+                return True
+        return False
+
+    def _forbidden(self, start_response):
+        return self._page(start_response, "<h1>Invalid CSRF token</h1>", "403 Forbidden")
+
+    def _logged_in(self, environ):
+        cookie = SimpleCookie(environ.get("HTTP_COOKIE", ""))
+        token = cookie[COOKIE].value if COOKIE in cookie else None
+        with self._lock:
+            created = self._sessions.get(token)
+            if created is None:
+                return False
+            if self.session_ttl is not None and time.time() - created > self.session_ttl:
+                del self._sessions[token]
+                return False
+        return True
+
+    def _login(self, environ, start_response):
+        form = self._form(environ)
+        if not self._check_csrf(form):
+            return self._forbidden(start_response)
+        if not (form.get("username", [""])[0] and form.get("password", [""])[0]):
+            return self._page(start_response, LOGIN_BODY.format(csrf=self._issue_csrf()))
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._sessions[token] = time.time()
+        start_response("303 See Other", [
+            ("Location", "/"),
+            ("Set-Cookie", f"{COOKIE}={token}; Path=/; HttpOnly"),
+            ("Content-Length", "0"),
+        ])
+        return [b""]
+
+    def _render_kit(self, kit):
+        if self._kit_body is None:
+            header = "".join(f"<th>{name}</th>" for name in self.analytes)
+            rows = "\n".join(
+                f'<tr data-specimen-id="{specimen}"><td>{specimen}</td>'
+                + "".join(
+                    f'<td><input type="text" name="v|{specimen}|{name}" data-analyte="{name}"></td>'
+                    for name in self.analytes
+                )
+                + "</tr>"
+                for specimen in self.specimens
+            )
+            self._kit_body = (header, rows)
+        header, rows = self._kit_body
+        return KIT_BODY.format(kit=html.escape(kit), csrf=self._issue_csrf(),
+                               header=header, rows=rows)
+
+    def _submit(self, environ, start_response):
+        form = self._form(environ)
+        if not self._check_csrf(form):
+            return self._forbidden(start_response)
+        kit = form.get("kit", [""])[0]
+        values = {}
+        for name, value in form.items():
+            if name.startswith("v|") and value[0] != "":
+                _, specimen, analyte = name.split("|", 2)
+                values[(specimen, analyte)] = value[0]
+        with self._lock:
+            self.submissions[kit] = values
+        return self._page(
+            start_response,
+            f'<div class="success-message">Submitted {len(values)} values for kit {html.escape(kit)}</div>',
+        )
+
+
+def start_portal(portal, host="127.0.0.1", port=0):
+    """Serve ``portal`` from a daemon thread; return ``(server, base_url)``."""
+    server = make_server(host, port, portal, server_class=_ThreadingWSGIServer,
+                         handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name="mock-cap-portal", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock CAP portal.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--specimens", type=int, default=100)
+    parser.add_argument("--analytes", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of page loads answered with a 503")
+    parser.add_argument("--session-ttl", type=float, default=None,
+                        help="seconds before a login expires")
+    args = parser.parse_args()
+
+    portal = MockPortal(args.specimens, args.analytes, args.latency,
+                        args.failure_rate, args.session_ttl)
+    server = make_server(args.host, args.port, portal, server_class=_ThreadingWSGIServer)
+    print(f"Mock CAP portal on http://{args.host}:{args.port}/ "
+          f"({args.specimens} specimens x {args.analytes} analytes)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Mapping of spreadsheet analyte names to the portal's analyte codes.
+
+The kit form identifies each input by its analyte code (``data-analyte``),
+while workbooks name the same analyte in many ways: ``Glucose (mg/dL)``,
+``GLU``, ``glucose``. A name is resolved to a code by trying, in order:
+
+  * ``exact``      -- the name is a code on the form
+  * ``normalized`` -- equal after normalization: case-folded, units and
+                      bracketed annotations removed (``(mg/dL)``, ``[U/L]``,
+                      a trailing ``mmol/L``) and punctuation ignored, then
+                      compared ignoring either word order or spacing
+  * ``synonym``    -- in the same synonym group as a code
+                      (``DEFAULT_SYNONYMS`` plus ``analyte_synonyms`` from
+                      ``cap_config.json``)
+  * ``fuzzy``      -- the closest code by ``difflib`` similarity, if at
+                      least ``cutoff``
+
+Names that resolve to nothing keep their own name, so the automator's
+pre-flight reports them, and come with up to three close candidates to
+suggest. A mapping is computed once per (names, codes, synonyms)
+combination and cached, so every kit of a layout reuses it.
+"""
+
+import difflib
+import json
+import re
+from functools import lru_cache
+
+# Minimum difflib ratio for a fuzzy match to be used
+FUZZY_CUTOFF = 0.85
+# Minimum ratio for a code to be suggested for an unmatched name
+CANDIDATE_CUTOFF = 0.6
+
+_BRACKETS_RE = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+_UNIT_SUFFIX_RE = re.compile(
+    r"(?:^|[\s,])(?:in\s+)?(?:mg/dl|mg/l|g/dl|g/l|mmol/l|umol/l|µmol/l|meq/l|"
+    r"u/l|iu/l|miu/ml|uiu/ml|ng/ml|ng/dl|pg/ml|%)\s*$"
+)
+_WORD_RE = re.compile(r"[0-9a-z]+")
+
+# Common clinical chemistry names, each group listing names of one analyte
+DEFAULT_SYNONYMS = {
+    "glucose": ["glu", "blood glucose", "glucose serum"],
+    "cholesterol": ["chol", "total cholesterol", "tc"],
+    "triglycerides": ["trig", "trigs", "tg", "triglyceride"],
+    "hdl cholesterol": ["hdl", "hdl c", "hdlc"],
+    "ldl cholesterol": ["ldl", "ldl c", "ldlc"],
+    "sodium": ["na"],
+    "potassium": ["k"],
+    "chloride": ["cl"],
+    "bicarbonate": ["co2", "total co2", "hco3"],
+    "urea nitrogen": ["bun", "blood urea nitrogen"],
+    "creatinine": ["crea", "creat", "cre"],
+    "calcium": ["ca"],
+    "magnesium": ["mg"],
+    "phosphorus": ["phos", "phosphate"],
+    "albumin": ["alb"],
+    "total protein": ["tp"],
+    "alanine aminotransferase": ["alt", "sgpt"],
+    "aspartate aminotransferase": ["ast", "sgot"],
+    "alkaline phosphatase": ["alp", "alk phos"],
+    "total bilirubin": ["tbil", "t bili"],
+    "hemoglobin a1c": ["hba1c", "a1c", "glycated hemoglobin"],
+    "uric acid": ["urate"],
+}
+
+
+def analyte_words(name):
+    """Return the words of an analyte name after normalization."""
+    text = str(name).casefold()
+    text = _BRACKETS_RE.sub(" ", text)
+    text = _UNIT_SUFFIX_RE.sub(" ", text.strip())
+    return _WORD_RE.findall(text)
+
+
+def analyte_key(name):
+    """Return the normalized comparison key of an analyte name.
+
+    ``Glucose (mg/dL)``, ``glucose`` and ``GLUCOSE`` share a key, as do
+    ``Cholesterol, Total`` and ``Total Cholesterol``.
+    """
+    return " ".join(sorted(analyte_words(name)))
+
+
+def compact_key(name):
+    """Return the normalized name with its words run together (``Analyte 01`` -> ``analyte01``)."""
+    return "".join(analyte_words(name))
+
+
+def synonym_groups(synonyms=None):
+    """Return ``{analyte_key: group}`` for the default and given synonyms.
+
+    ``synonyms`` maps a name to its aliases, like ``DEFAULT_SYNONYMS``; a
+    name already in a default group extends that group.
+    """
+    groups = {}
+    for group, (name, aliases) in enumerate(DEFAULT_SYNONYMS.items()):
+        for alias in (name, *aliases):
+            groups[analyte_key(alias)] = group
+    extra = len(DEFAULT_SYNONYMS)
+    for name, aliases in (synonyms or {}).items():
+        if isinstance(aliases, str):
+            aliases = [aliases]
+        keys = [analyte_key(alias) for alias in (name, *aliases)]
+        group = next((groups[key] for key in keys if key in groups), None)
+        if group is None:
+            group, extra = extra, extra + 1
+        for key in keys:
+            groups[key] = group
+    return groups
+
+
+class AnalyteMapping:
+    """Resolution of a set of analyte names against the portal's codes."""
+
+    def __init__(self):
+        self.codes = {}       # name -> code
+        self.methods = {}     # name -> how it was resolved
+        self.unmatched = {}   # name -> candidate codes
+
+    @property
+    def fuzzy(self):
+        """Names resolved by similarity alone, as ``{name: code}``."""
+        return {name: self.codes[name] for name, method in self.methods.items()
+                if method == "fuzzy"}
+
+    @property
+    def renamed(self):
+        """Names resolved to a different code, as ``{name: code}``."""
+        return {name: code for name, code in self.codes.items() if name != code}
+
+    def apply(self, analyte_data):
+        """Return ``analyte_data`` keyed by portal code where one was found."""
+        codes = self.codes
+        return {codes.get(name, name): value for name, value in analyte_data.items()}
+
+    def describe(self):
+        """Return a one-line summary for logs and pages."""
+        parts = [f"{len(self.codes)} analytes mapped"]
+        if self.renamed:
+            parts.append(f"{len(self.renamed)} renamed")
+        if self.fuzzy:
+            parts.append(f"{len(self.fuzzy)} by fuzzy match")
+        if self.unmatched:
+            parts.append(f"{len(self.unmatched)} unmatched")
+        return ", ".join(parts)
+
+
+class AnalyteIndex:
+    """Lookup structure over the portal's analyte codes (see module docstring)."""
+
+    def __init__(self, portal_codes, synonyms=None, cutoff=FUZZY_CUTOFF):
+        self.cutoff = cutoff
+        self._codes = set(portal_codes)
+        self._groups = synonym_groups(synonyms)
+        self._by_key = {}
+        self._by_compact = {}
+        self._by_group = {}
+        for code in sorted(self._codes, key=str):
+            key = analyte_key(code)
+            self._by_key.setdefault(key, code)
+            self._by_compact.setdefault(compact_key(code), code)
+            group = self._groups.get(key)
+            if group is not None:
+                self._by_group.setdefault(group, code)
+        self._keys = list(self._by_key)
+
+    def resolve(self, name):
+        """Return ``(code, method, candidates)``; code is None if unresolved."""
+        if name in self._codes:
+            return name, "exact", []
+        key = analyte_key(name)
+        code = self._by_key.get(key) or self._by_compact.get(compact_key(name))
+        if code is not None:
+            return code, "normalized", []
+        group = self._groups.get(key)
+        if group is not None and group in self._by_group:
+            return self._by_group[group], "synonym", []
+        close = difflib.get_close_matches(key, self._keys, n=3, cutoff=CANDIDATE_CUTOFF)
+        candidates = [self._by_key[k] for k in close]
+        if close and difflib.SequenceMatcher(None, key, close[0]).ratio() >= self.cutoff:
+            return candidates[0], "fuzzy", candidates
+        return None, None, candidates
+
+    def map(self, names):
+        """Resolve ``names``; a code claimed by an earlier name is not reused."""
+        mapping = AnalyteMapping()
+        claimed = {}
+        for name in names:
+            code, method, candidates = self.resolve(name)
+            if code is None or code in claimed:
+                mapping.unmatched[name] = candidates or ([code] if code else [])
+                continue
+            claimed[code] = name
+            mapping.codes[name] = code
+            mapping.methods[name] = method
+        return mapping
+
+
+@lru_cache(maxsize=64)
+def _cached_mapping(names, portal_codes, synonyms_json, cutoff):
+    index = AnalyteIndex(portal_codes, json.loads(synonyms_json), cutoff)
+    return index.map(names)
+
+
+def map_analytes(names, portal_codes, synonyms=None, cutoff=FUZZY_CUTOFF):
+    """Return the ``AnalyteMapping`` of ``names`` onto ``portal_codes``.
+
+    Results are cached per combination of arguments and shared, so they
+    must not be modified.
+    """
+    return _cached_mapping(
+        tuple(names), tuple(sorted(set(portal_codes), key=str)),
+        json.dumps(synonyms or {}, sort_keys=True), cutoff,
+    )
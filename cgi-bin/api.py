@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Machine-readable counterpart of the upload pages, for LIMS integrations.
+
+  * ``POST /api/analyze`` -- multipart upload with one or more
+    ``excel_file`` parts. Each workbook is parsed, analysed and stored as in
+    the HTML flow; the response is the analysis as JSON (summary, detected
+    columns, issue counts per type and analyte, and the ``data_key`` for the
+    automation step). With several files the response is NDJSON, one line
+    per file in upload order, each written as soon as that file is done.
+  * ``GET /api/issues?data_key=...`` -- the upload's full issue list as
+    NDJSON, one issue per line, optionally filtered by ``type`` and
+    ``analyte``. It is read from the stored analysis and written in chunks
+    of ``CHUNK_SIZE`` issues, so the list is never built up in memory.
+
+Errors are JSON objects with an ``error`` field and a 4xx status. Under the
+long-lived server both routes are served by ``server.py``; as a CGI script
+this module answers a POST as ``/api/analyze`` and a GET as ``/api/issues``.
+"""
+import cgitb
+import json
+import os
+import sys
+
+from intake import UploadFieldStorage, UploadTooLarge, upload_size
+from issue_report import group_issues, issues_at, matching_rows
+from upload import WorkbookError, load_temp_issues, process_upload
+
+NDJSON = "application/x-ndjson"
+JSON = "application/json"
+
+# Issues serialised per write of the NDJSON stream
+CHUNK_SIZE = 1000
+
+
+def _json_default(value):
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _dumps(payload):
+    return json.dumps(payload, default=_json_default)
+
+
+def error_response(status, message):
+    """Return a JSON error response as ``(status, content_type, chunks)``."""
+    return status, JSON, [_dumps({"error": message}).encode("utf-8")]
+
+
+def analysis_payload(analysis, key, filename=None):
+    """Return the JSON form of an analysed upload."""
+    summary = analysis.summary
+    groups = group_issues(analysis.issues, sample_size=0)
+    totals = {}
+    for group in groups:
+        totals[group["type"]] = totals.get(group["type"], 0) + group["count"]
+    return {
+        "filename": filename,
+        "data_key": key,
+        "summary": {
+            "total_records": summary["total_records"],
+            "analytes_found": summary["analytes_found"],
+            "specimens": summary["specimens"],
+            "results": len(analysis.results),
+        },
+        "sample_column": analysis.sample_col,
+        "column_profile": summary.get("column_profile"),
+        "analyte_columns": analysis.analyte_cols,
+        "columns": [str(column) for column in analysis.df.columns],
+        "issue_totals": totals,
+        "issue_groups": [
+            {"type": group["type"], "analyte": group["analyte"], "count": group["count"]}
+            for group in groups
+        ],
+        "issues_url": f"/api/issues?data_key={key}",
+    }
+
+
+def _analyze_file(file_item):
+    """Analyse one uploaded part; return its payload, or an ``error`` entry."""
+    filename = file_item.filename
+    if not file_item.file or not upload_size(file_item.file):
+        return {"filename": filename, "error": "No file uploaded"}
+    try:
+        analysis, key = process_upload(file_item.file)
+    except WorkbookError as exc:
+        return {"filename": filename, "error": f"Error reading Excel file: {exc}"}
+    return analysis_payload(analysis, key, filename)
+
+
+def analyze_response(form):
+    """Handle ``POST /api/analyze``; return ``(status, content_type, chunks)``."""
+    if form.list is None or "excel_file" not in form:
+        return error_response("400 Bad Request", "Send the workbook as an excel_file form field")
+    parts = form["excel_file"]
+    if not isinstance(parts, list):
+        payload = _analyze_file(parts)
+        status = "422 Unprocessable Entity" if "error" in payload else "200 OK"
+        return status, JSON, [_dumps(payload).encode("utf-8")]
+
+    def lines():
+        for part in parts:
+            yield (_dumps(_analyze_file(part)) + "\n").encode("utf-8")
+
+    return "200 OK", NDJSON, lines()
+
+
+def issues_response(form):
+    """Handle ``GET /api/issues``; return ``(status, content_type, chunks)``."""
+    data_key = form.getfirst("data_key", "").strip()
+    if not data_key:
+        return error_response("400 Bad Request", "Missing data_key")
+    try:
+        columns = load_temp_issues(data_key)
+    except FileNotFoundError as exc:
+        return error_response("404 Not Found", str(exc))
+    rows = matching_rows(
+        columns,
+        issue_type=form.getfirst("type", "").strip() or None,
+        analyte=form.getfirst("analyte", "").strip() or None,
+    )
+
+    def lines():
+        for start in range(0, len(rows), CHUNK_SIZE):
+            chunk = issues_at(columns, rows[start:start + CHUNK_SIZE])
+            yield "".join(_dumps(issue) + "\n" for issue in chunk).encode("utf-8")
+
+    return "200 OK", NDJSON, lines()
+
+
+def main():
+    cgitb.enable(format="text")
+    try:
+        form = UploadFieldStorage()
+    except UploadTooLarge as exc:
+        status, content_type, chunks = error_response("413 Payload Too Large", str(exc))
+    else:
+        if os.environ.get("REQUEST_METHOD", "GET") == "POST":
+            status, content_type, chunks = analyze_response(form)
+        else:
+            status, content_type, chunks = issues_response(form)
+    sys.stdout.write(f"Status: {status}\nContent-type: {content_type}\n\n")
+    sys.stdout.flush()
+    for chunk in chunks:
+        sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+
+
+if __name__ == "__main__":
+    main()
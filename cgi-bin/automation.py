@@ -1,51 +1,39 @@
 #!/usr/bin/env python3
 """
-Placeholder automation script invoked after the user enters the kit number.
-
-This script retrieves the previously uploaded and analysed data using the
-temporary key passed from the analysis page. It then reads the kit number
-provided by the user. In a complete implementation this step would
-instantiate a Playwright browser, log into the CAP site, locate the
-appropriate result form using the kit number, and fill in values for
-specimens and analytes according to the data provided. Due to limitations
-in the execution environment (missing dependencies and headless browser
-drivers), this script simply displays a confirmation page showing
-the kit number and basic information about the data. It illustrates
-where automation would normally occur.
+Automation script invoked after the user enters the kit number.
+
+This script checks the previously uploaded and analysed data using the
+temporary key passed from the analysis page, then queues an automation
+job for the kit number provided by the user (see ``jobs``). The job is run
+by the separate worker process (``worker.py``), which logs into the CAP
+portal, locates the result form for the kit and fills in values for the
+specimens and analytes. The request returns immediately with a
+confirmation page linking to the job status page, instead of staying open
+for the whole browser session.
+
+Before the job is queued, the upload's analyte names are mapped onto the
+portal's analyte codes (see ``analyte_map``) -- those listed in
+``portal_analytes`` in ``cap_config.json`` plus those the worker has seen
+on earlier kit forms -- and the confirmation page lists any that were
+renamed, matched only by similarity or not matched at all.
 """
 import cgi
 import html
 import cgitb
 import json
+import logging
 import os
 import sys
 import tempfile
 
-from upload import load_temp_data
+from analyte_map import FUZZY_CUTOFF, map_analytes
+from checkpoints import CheckpointStore
+from jobs import JobQueue
+from portal_automation import AutomationConfig
+from upload import load_temp_summary
 
-cgitb.enable()
 
-def main():
-    form = cgi.FieldStorage()
-    kit_number = form.getfirst("kit_number", "").strip()
-    data_key = form.getfirst("data_key", "").strip()
-    if not kit_number or not data_key:
-        print("Content-type: text/html\n")
-        print("<h1>Missing parameters</h1>")
-        return
-    # Load previously stored data
-    try:
-        data = load_temp_data(data_key)
-    except Exception as exc:
-        print("Content-type: text/html\n")
-        print(f"<h1>Error loading data</h1><p>{str(exc)}</p>")
-        return
-    specimen_count = len({row[data["sample_column"]] for row in data["records"]})
-    analyte_count = len(data["analyte_columns"])
-    record_count = len(data["records"])
-    # Display confirmation page
-    print("Content-type: text/html\n")
-    print(f"""
+CONFIRMATION_PAGE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -58,6 +46,10 @@ def main():
     main {{ max-width: 800px; margin: 0 auto; padding: 30px; }}
     .card {{ background: #fff; padding: 20px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }}
     .card h2 {{ margin-top: 0; }}
+    .mapping {{ margin-top: 15px; }}
+    .mapping td, .mapping th {{ text-align: left; padding: 4px 8px; border-bottom: 1px solid #e5e7eb; }}
+    .mapping .unmatched {{ color: #991b1b; }}
+    .mapping .fuzzy {{ color: #92400e; }}
     .btn {{ display: inline-block; padding: 10px 20px; background-color: #2563eb; color: #fff; border-radius: 4px; text-decoration: none; margin-top: 20px; }}
 </style>
 </head>
@@ -68,22 +60,106 @@ def main():
 <main>
     <div class="card">
         <h2>Kit Number: {kit}</h2>
-        <p>The system would now log into the CAP portal and populate the result form for kit number <strong>{kit}</strong>.</p>
+        <p>Automation for kit number <strong>{kit}</strong> has been queued. A background worker will log into the CAP portal and populate the result form.</p>
+        <p><strong>Job:</strong> {job_id}</p>
         <p><strong>Specimens:</strong> {specimens}</p>
         <p><strong>Analytes:</strong> {analytes}</p>
         <p><strong>Total Records:</strong> {records}</p>
-        <p>Due to environment limitations the automated data entry is not executed in this demonstration.</p>
+        {mapping}
+        <a class="btn" href="/cgi-bin/job_status.py?job_id={job_id}">View Progress</a>
         <a class="btn" href="/">Return to Home</a>
     </div>
 </main>
 </body>
 </html>
-""".format(
+"""
+
+
+def analyte_mapping(summary, config):
+    """Map the upload's analyte names onto the portal's known analyte codes.
+
+    Returns None when no codes are known yet (nothing configured and no
+    kit form seen), since every name would then look unmatched.
+    """
+    codes = set(config.get("portal_analytes") or [])
+    if config.get("checkpoints", True):
+        portal_url = config.get("portal_url", "https://cap.org/portal")
+        codes |= CheckpointStore().portal_analytes(portal_url)
+    if not codes:
+        return None
+    names = summary.get("analyte_names") or {}
+    return map_analytes(
+        [names.get(column, column) for column in summary["analyte_columns"]],
+        codes,
+        config.get("analyte_synonyms"),
+        float(config.get("analyte_match_cutoff", FUZZY_CUTOFF)),
+    )
+
+
+def render_analyte_mapping(mapping):
+    """Render the renamed, fuzzy and unmatched analytes of a mapping."""
+    if mapping is None or not (mapping.renamed or mapping.unmatched):
+        return ""
+    rows = []
+    for name, code in mapping.renamed.items():
+        method = mapping.methods[name]
+        rows.append(
+            f'<tr class="{method}"><td>{html.escape(str(name))}</td><td>{html.escape(str(code))}</td>'
+            f'<td>{"similar name only, please check" if method == "fuzzy" else method}</td></tr>'
+        )
+    for name, candidates in mapping.unmatched.items():
+        closest = ", ".join(html.escape(str(c)) for c in candidates)
+        rows.append(
+            f'<tr class="unmatched"><td>{html.escape(str(name))}</td><td>none</td>'
+            f'<td>no field on the portal form{f" (closest: {closest})" if closest else ""}; '
+            f'these values will not be entered</td></tr>'
+        )
+    return (f'<div class="mapping"><h3>Analyte mapping</h3><p>{html.escape(mapping.describe())}.</p>'
+            f'<table><tr><th>Spreadsheet</th><th>Portal</th><th></th></tr>{"".join(rows)}</table></div>')
+
+
+def handle_request(form):
+    """Process the kit number form and return the HTML response body.
+
+    This is shared by the CGI entry point below and the long-lived server
+    in ``server.py``, so it must not write to stdout itself.
+    """
+    kit_number = form.getfirst("kit_number", "").strip()
+    data_key = form.getfirst("data_key", "").strip()
+    if not kit_number or not data_key:
+        return "<h1>Missing parameters</h1>"
+    # Load the summary index of the previously stored data; the records
+    # themselves are not read
+    try:
+        summary = load_temp_summary(data_key)
+    except Exception as exc:
+        return f"<h1>Error loading data</h1><p>{html.escape(str(exc))}</p>"
+    try:
+        mapping = analyte_mapping(summary, AutomationConfig().config)
+    except Exception as exc:
+        # The report is advisory; the worker maps the analytes again
+        logging.warning(f"Could not map analytes for {data_key}: {exc}")
+        mapping = None
+    # Progress counts specimens with results; older uploads only know their rows
+    total = summary.get("result_specimen_count") or summary["record_count"]
+    job_id = JobQueue().submit(kit_number, data_key, total=total)
+    # Display confirmation page
+    return CONFIRMATION_PAGE.format(
         kit=html.escape(kit_number),
-        specimens=specimen_count,
-        analytes=analyte_count,
-        records=record_count,
-    ))
+        job_id=job_id,
+        specimens=summary["specimen_count"],
+        analytes=summary["analyte_count"],
+        records=summary["record_count"],
+        mapping=render_analyte_mapping(mapping),
+    )
+
+
+def main():
+    cgitb.enable()
+    form = cgi.FieldStorage()
+    body = handle_request(form)
+    print("Content-type: text/html\n")
+    print(body)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,816 @@
+#!/usr/bin/env python3
+"""
+Enhanced CAP Portal Automation Module
+
+This module adds actual automation capabilities to interact with the CAP portal
+and perform automated data entry after Excel file analysis.
+"""
+
+import atexit
+import threading
+import time
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import (
+    ElementNotInteractableException,
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+from analyte_map import FUZZY_CUTOFF
+from checkpoints import CheckpointStore
+from jobs import SLOT_LEASE_SECONDS, JobQueue
+from portal_automation import (  # noqa: F401 -- re-exported
+    AutomationConfig,
+    FormIndex,
+    PortalAutomator,
+    iter_specimen_data,
+    specimen_results,
+)
+from timing import stage
+
+
+# Fills a batch of specimens in one WebDriver round trip. arguments[0] maps
+# specimen id -> {analyte: value}. Values go through the native value setter
+# and fire input/change events so the portal's own listeners see them.
+# Returns the specimen ids with no row and the [specimen, analyte] pairs
+# with no input.
+BULK_FILL_SCRIPT = """
+const data = arguments[0];
+const setValue = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+const rows = new Map();
+for (const row of document.querySelectorAll('tr[data-specimen-id]')) {
+    if (!rows.has(row.dataset.specimenId)) rows.set(row.dataset.specimenId, row);
+}
+const report = {filled: 0, missing_specimens: [], missing_fields: []};
+for (const [specimen, values] of Object.entries(data)) {
+    const row = rows.get(specimen);
+    if (!row) { report.missing_specimens.push(specimen); continue; }
+    const inputs = new Map();
+    for (const input of row.querySelectorAll('input[data-analyte]')) {
+        if (!inputs.has(input.dataset.analyte)) inputs.set(input.dataset.analyte, input);
+    }
+    for (const [analyte, value] of Object.entries(values)) {
+        const input = inputs.get(analyte);
+        if (!input) { report.missing_fields.push([specimen, analyte]); continue; }
+        setValue.call(input, value);
+        input.dispatchEvent(new Event('input', {bubbles: true}));
+        input.dispatchEvent(new Event('change', {bubbles: true}));
+        report.filled += 1;
+    }
+}
+return report;
+"""
+
+
+# Errors worth retrying: the page was still loading or re-rendering
+TRANSIENT_ERRORS = (
+    StaleElementReferenceException,
+    TimeoutException,
+    ElementNotInteractableException,
+)
+
+# True once the page has loaded and no jQuery request is in flight
+PAGE_READY_SCRIPT = (
+    "return document.readyState === 'complete'"
+    " && !(window.jQuery && window.jQuery.active);"
+)
+
+# Indexes the loaded kit form in one pass: specimen id -> {row, inputs},
+# where inputs maps analyte -> input element. With arguments[0] false only
+# the names are returned (inputs map to true and there is no row handle).
+# The first row/input in document order wins, as with find_element.
+INDEX_FORM_SCRIPT = """
+const withHandles = arguments[0];
+const index = {};
+for (const row of document.querySelectorAll('tr[data-specimen-id]')) {
+    const specimen = row.dataset.specimenId;
+    if (specimen in index) continue;
+    const inputs = {};
+    for (const input of row.querySelectorAll('input[data-analyte]')) {
+        if (!(input.dataset.analyte in inputs)) inputs[input.dataset.analyte] = withHandles ? input : true;
+    }
+    index[specimen] = withHandles ? {row: row, inputs: inputs} : {inputs: inputs};
+}
+return index;
+"""
+
+
+# Reads the current value of every analyte input in the rows of the
+# specimen ids in arguments[0]: specimen id -> {analyte: value}.
+READ_VALUES_SCRIPT = """
+const wanted = new Set(arguments[0]);
+const values = {};
+for (const row of document.querySelectorAll('tr[data-specimen-id]')) {
+    const specimen = row.dataset.specimenId;
+    if (!wanted.has(specimen) || specimen in values) continue;
+    const fields = {};
+    for (const input of row.querySelectorAll('input[data-analyte]')) {
+        if (!(input.dataset.analyte in fields)) fields[input.dataset.analyte] = input.value;
+    }
+    values[specimen] = fields;
+}
+return values;
+"""
+
+
+class CAPPortalAutomator(PortalAutomator):
+    """Handles automated interaction with CAP portal for data entry.
+    
+    Drives Chrome through Selenium; the workflow itself (retries,
+    checkpoints, differential entry, analyte mapping) is
+    ``portal_automation.PortalAutomator``. In ``'bulk'`` fill mode each
+    chunk is filled with one script call, in ``'field'`` mode each input
+    is typed into in turn.
+    """
+    
+    # Errors with_retries retries
+    transient_errors = TRANSIENT_ERRORS
+    timeout_errors = (TimeoutException,)
+    
+    def __init__(self, portal_url, username, password, headless=False, **options):
+        super().__init__(portal_url, username, password, headless, **options)
+        self.driver = None
+        self.wait = None
+    
+    @stage("automation.setup_driver")
+    def setup_driver(self):
+        """Initialize the web driver with appropriate options."""
+        chrome_options = Options()
+        if self.headless:
+            chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--window-size=1920,1080")
+        
+        try:
+            self.driver = webdriver.Chrome(options=chrome_options)
+            self.driver.set_page_load_timeout(self.step_timeouts.get('page', self.timeout))
+            self.wait = self.wait_for()
+            self.logger.info("WebDriver initialized successfully")
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to initialize WebDriver: {e}")
+            return False
+    
+    def wait_for(self, step=None):
+        """Return a ``WebDriverWait`` using the timeout configured for ``step``."""
+        return WebDriverWait(
+            self.driver,
+            self.step_timeouts.get(step, self.timeout),
+            ignored_exceptions=(StaleElementReferenceException,)
+        )
+    
+    def wait_until_ready(self, step='page'):
+        """Wait for the page to finish loading and any AJAX to settle."""
+        self.wait_for(step).until(lambda driver: driver.execute_script(PAGE_READY_SCRIPT))
+    
+    def _login(self):
+        wait = self.wait_for('login')
+        self.driver.get(self.portal_url)
+        self.logger.info(f"Navigating to CAP portal: {self.portal_url}")
+        
+        # Wait for and fill username
+        username_field = wait.until(
+            EC.presence_of_element_located((By.NAME, "username"))
+        )
+        username_field.clear()
+        username_field.send_keys(self.username)
+        
+        # Fill password
+        password_field = self.driver.find_element(By.NAME, "password")
+        password_field.clear()
+        password_field.send_keys(self.password)
+        
+        # Click login button
+        wait.until(
+            EC.element_to_be_clickable((By.XPATH, "//input[@type='submit' and @value='Login']"))
+        ).click()
+        
+        # Wait for dashboard or main page to load
+        wait.until(
+            EC.presence_of_element_located((By.CLASS_NAME, "dashboard"))
+        )
+        
+        self.logger.info("Successfully logged into CAP portal")
+        return True
+    
+    def retry_kit_search(self, error):
+        # A failed search can leave the browser on an error page, so each
+        # retry starts again from the dashboard
+        self.driver.get(self.portal_url)
+    
+    def _find_kit_form(self, kit_number):
+        wait = self.wait_for('kit_form')
+        # Look for kit search or navigation
+        search_box = wait.until(
+            EC.presence_of_element_located((By.NAME, "kit_search"))
+        )
+        search_box.clear()
+        search_box.send_keys(kit_number)
+        
+        # Click search button
+        wait.until(
+            EC.element_to_be_clickable((By.XPATH, "//input[@value='Search Kit']"))
+        ).click()
+        
+        # Wait for kit form to load
+        wait.until(
+            EC.presence_of_element_located((By.ID, "kit-data-form"))
+        )
+        self.wait_until_ready('kit_form')
+        
+        self.logger.info(f"Found kit form for {kit_number}")
+        return True
+    
+    @stage("automation.index_form")
+    def index_kit_form(self, handles=True):
+        """Index the loaded kit form's rows and inputs with one script call."""
+        self.form_index = FormIndex(self.driver.execute_script(INDEX_FORM_SCRIPT, handles))
+        self.logger.info(f"Indexed {len(self.form_index)} specimen rows on the kit form")
+        return self.form_index
+    
+    def _find_row(self, specimen_id):
+        """Return the specimen's row; None if the index has no such row."""
+        if self.form_index is not None:
+            return self.form_index.row(specimen_id)
+        return self.driver.find_element(
+            By.XPATH, f"//tr[@data-specimen-id='{specimen_id}']"
+        )
+    
+    def _find_input(self, specimen_section, specimen_id, analyte_name):
+        """Return the analyte's input; None if the index has no such input."""
+        if self.form_index is not None:
+            return self.form_index.input(specimen_id, analyte_name)
+        return specimen_section.find_element(
+            By.XPATH, f".//input[@data-analyte='{analyte_name}']"
+        )
+    
+    @stage("automation.fill_specimen")
+    def populate_specimen_data(self, specimen_id, analyte_data):
+        """Fill in data for a specific specimen.
+        
+        Rows and inputs come from ``form_index`` when the form has been
+        indexed, otherwise from an XPath search per element. Transient
+        failures retry the whole specimen, re-indexing the form first if
+        its elements went stale.
+        """
+        def reindex(error):
+            if isinstance(error, StaleElementReferenceException) and self.form_index is not None:
+                self.index_kit_form(handles=True)
+        
+        try:
+            return self.with_retries(
+                f"Specimen {specimen_id}", self._populate_specimen,
+                specimen_id, analyte_data, on_retry=reindex
+            )
+        except Exception as e:
+            self.logger.error(f"Error populating specimen {specimen_id}: {e}")
+            return False
+    
+    def _populate_specimen(self, specimen_id, analyte_data):
+        # Find the specimen row or section
+        specimen_section = self._find_row(specimen_id)
+        if specimen_section is None:
+            self.logger.error(f"Error populating specimen {specimen_id}: row not found")
+            return False
+        
+        # Populate each analyte value
+        for analyte_name, value in analyte_data.items():
+            try:
+                # Look for input field for this analyte
+                analyte_input = self._find_input(specimen_section, specimen_id, analyte_name)
+                if analyte_input is None:
+                    raise NoSuchElementException()
+                analyte_input.clear()
+                analyte_input.send_keys(str(value))
+                
+                self.logger.debug(f"Set {analyte_name} = {value} for specimen {specimen_id}")
+                
+            except NoSuchElementException:
+                self.logger.warning(f"Could not find input for analyte {analyte_name}")
+                continue
+        
+        # Let any handlers the inputs triggered finish before moving on
+        self.wait_until_ready()
+        return True
+    
+    @stage("automation.fill_chunk")
+    def bulk_fill(self, specimens):
+        """Fill ``[(specimen_id, analyte_data), ...]`` with one script call.
+        
+        Returns the page's report (see ``BULK_FILL_SCRIPT``).
+        """
+        data = {
+            str(specimen_id): {analyte: str(value) for analyte, value in analyte_data.items()}
+            for specimen_id, analyte_data in specimens
+        }
+        report = self.driver.execute_script(BULK_FILL_SCRIPT, data)
+        for specimen_id in report['missing_specimens']:
+            self.logger.error(f"Error populating specimen {specimen_id}: row not found")
+        for specimen_id, analyte_name in report['missing_fields']:
+            self.logger.warning(f"Could not find input for analyte {analyte_name} (specimen {specimen_id})")
+        return report
+    
+    @stage("automation.read_back")
+    def read_form_values(self, specimen_ids):
+        """Return the kit form's current values for ``specimen_ids``.
+        
+        One script call; the result maps specimen id -> {analyte: value}.
+        """
+        return self.driver.execute_script(READ_VALUES_SCRIPT, [str(s) for s in specimen_ids])
+    
+    def is_alive(self):
+        """Check that the browser is still running and responsive."""
+        if self.driver is None:
+            return False
+        try:
+            self.driver.execute_script("return document.readyState")
+            return True
+        except WebDriverException:
+            return False
+    
+    def session_expired(self):
+        """True if the portal has sent the browser back to its login form."""
+        return bool(self.driver.find_elements(By.NAME, "username"))
+    
+    def ensure_logged_in(self):
+        """Return to the portal dashboard, logging in again if the session expired."""
+        try:
+            self.driver.get(self.portal_url)
+            if self.driver.find_elements(By.CLASS_NAME, "dashboard"):
+                return True
+        except WebDriverException as e:
+            self.logger.warning(f"Could not reach CAP portal: {e}")
+            return False
+        self.logger.info("CAP portal session expired, logging in again")
+        return self.login()
+    
+    def close(self):
+        """Quit the browser, ignoring errors from one that already died."""
+        if self.driver:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+    
+    @stage("automation.submit")
+    def submit_data(self):
+        """Submit the completed form."""
+        self.submit_attempted = True
+        try:
+            wait = self.wait_for('submit')
+            # Find and click submit button
+            wait.until(
+                EC.element_to_be_clickable((By.XPATH, "//input[@type='submit' and @value='Submit Data']"))
+            ).click()
+            
+            # Wait for confirmation
+            confirmation = wait.until(
+                EC.presence_of_element_located((By.CLASS_NAME, "success-message"))
+            )
+            
+            self.logger.info("Data submitted successfully")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"Error submitting data: {e}")
+            return False
+
+
+class SessionUnavailable(RuntimeError):
+    """A pooled browser session could not be started or logged in."""
+
+
+class SessionPool:
+    """Pool of launched, logged-in automators for one portal account.
+    
+    Starting Chrome and logging in costs far more than entering a typical
+    kit, so a long-lived process (the automation worker) keeps up to
+    ``size`` browsers open and hands them out one kit at a time. Each
+    checkout verifies the browser still responds and that the portal
+    session has not expired (logging in again if it has). Browsers older
+    than ``max_age`` seconds, or that fail either check, are replaced.
+    """
+    
+    def __init__(self, portal_url, username, password, headless=True, size=2, max_age=3600,
+                 automator_class=None, **automator_options):
+        self.portal_url = portal_url
+        self.username = username
+        self.password = password
+        self.headless = headless
+        self.size = size
+        self.max_age = max_age
+        self.automator_class = automator_class or CAPPortalAutomator
+        self.automator_options = automator_options
+        self.logger = logging.getLogger(__name__)
+        self._cond = threading.Condition()
+        self._idle = []      # (automator, launched) pairs, most recently used last
+        self._open = 0       # idle plus checked-out sessions
+    
+    def _launch(self):
+        automator = self.automator_class(
+            portal_url=self.portal_url,
+            username=self.username,
+            password=self.password,
+            headless=self.headless,
+            **self.automator_options
+        )
+        if not automator.setup_driver():
+            raise SessionUnavailable("Failed to initialize web driver")
+        if not automator.login():
+            automator.close()
+            raise SessionUnavailable("Failed to login to CAP portal")
+        return automator, time.time()
+    
+    def _check(self, automator, launched):
+        """Return a usable session, replacing this one if it is stale or broken."""
+        if time.time() - launched > self.max_age:
+            self.logger.info("Recycling browser session older than %ss", self.max_age)
+        elif automator.is_alive() and automator.ensure_logged_in():
+            return automator, launched
+        else:
+            self.logger.warning("Discarding unhealthy browser session")
+        automator.close()
+        return self._launch()
+    
+    def acquire(self, timeout=None):
+        """Check out a logged-in session as ``(automator, launched)``."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise SessionUnavailable("No browser session became free in time")
+                self._cond.wait(remaining)
+            if self._idle:
+                automator, launched = self._idle.pop()
+            else:
+                automator, launched = None, None
+                self._open += 1
+        try:
+            if automator is None:
+                return self._launch()
+            return self._check(automator, launched)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+    
+    def release(self, session, discard=False):
+        """Return a checked-out session, or close it if ``discard``."""
+        automator, launched = session
+        with self._cond:
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append(session)
+            self._cond.notify()
+        if discard:
+            automator.close()
+    
+    @contextmanager
+    def session(self, timeout=None):
+        """Context manager yielding a logged-in ``CAPPortalAutomator``."""
+        session = self.acquire(timeout)
+        try:
+            yield session[0]
+        except BaseException:
+            self.release(session, discard=True)
+            raise
+        self.release(session)
+    
+    def warm(self, count=None):
+        """Launch and log in sessions up front so the first kits start warm."""
+        sessions = []
+        try:
+            for _ in range(self.size if count is None else count):
+                sessions.append(self.acquire())
+        finally:
+            for session in sessions:
+                self.release(session)
+        return len(sessions)
+    
+    def close(self):
+        """Quit every idle browser; checked-out ones close when released."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for automator, _ in idle:
+            automator.close()
+
+
+_session_pools = {}
+_session_pools_lock = threading.Lock()
+_account_slots = {}
+
+# How often a kit waiting for a free account slot checks again
+SLOT_POLL_SECONDS = 1.0
+
+
+def _account_key(config):
+    return (config.get('portal_url', 'https://cap.org/portal'),
+            config.get('username'), config.get('headless', True))
+
+
+def automator_options(config):
+    """Return the ``CAPPortalAutomator`` keyword options set in ``config``."""
+    return {
+        'fill_mode': config.get('fill_mode', 'bulk'),
+        'bulk_chunk_size': int(config.get('bulk_chunk_size', 100)),
+        'timeout': float(config.get('timeout', 30)),
+        'retry_attempts': int(config.get('retry_attempts', 3)),
+        'retry_backoff': float(config.get('retry_backoff', 0.5)),
+        'step_timeouts': config.get('step_timeouts'),
+        'checkpoint_store': CheckpointStore() if config.get('checkpoints', True) else None,
+        'differential': bool(config.get('differential', True)),
+        'diff_read_back': bool(config.get('diff_read_back', True)),
+        'analyte_synonyms': config.get('analyte_synonyms'),
+        'analyte_match_cutoff': float(config.get('analyte_match_cutoff', FUZZY_CUTOFF)),
+    }
+
+
+def automator_class(backend):
+    """Return the automator class for a ``backend`` config value.
+    
+    ``'selenium'`` drives Chrome; ``'http'`` posts the portal's forms
+    directly with ``requests`` (see ``cap_http``).
+    """
+    if backend == 'http':
+        from cap_http import CAPPortalHTTPClient
+        return CAPPortalHTTPClient
+    return CAPPortalAutomator
+
+
+def get_session_pool(config, backend='selenium'):
+    """Return the process-wide session pool for the account in ``config``."""
+    key = _account_key(config) + (backend,)
+    with _session_pools_lock:
+        pool = _session_pools.get(key)
+        if pool is None:
+            pool = SessionPool(
+                portal_url=key[0],
+                username=key[1],
+                password=config.get('password'),
+                headless=key[2],
+                size=int(config.get('session_pool_size', 2)),
+                max_age=float(config.get('session_max_age', 3600)),
+                automator_class=automator_class(backend),
+                **automator_options(config)
+            )
+            _session_pools[key] = pool
+        return pool
+
+
+def account_slots(config):
+    """Return the semaphore limiting concurrent kits in this process for ``config``'s account."""
+    key = _account_key(config)[:2]
+    with _session_pools_lock:
+        slots = _account_slots.get(key)
+        if slots is None:
+            slots = threading.BoundedSemaphore(int(config.get('max_kits_per_account', 2)))
+            _account_slots[key] = slots
+        return slots
+
+
+@contextmanager
+def account_slot(config):
+    """Hold one of the ``max_kits_per_account`` slots of ``config``'s account.
+    
+    At most that many kits (default 2) are entered at once for one portal
+    login, however many threads or worker processes ask: threads first
+    wait on ``account_slots``, then take a slot lease in the job database
+    (see ``JobQueue.acquire_slot``), polling until one is free. The lease
+    is renewed while the block runs.
+    """
+    portal_url, username = _account_key(config)[:2]
+    account = f'{portal_url} {username}'
+    limit = int(config.get('max_kits_per_account', 2))
+    logger = logging.getLogger(__name__)
+    with account_slots(config):
+        queue = JobQueue()
+        holder = uuid.uuid4().hex
+        slot = queue.acquire_slot(account, limit, holder)
+        while slot is None:
+            time.sleep(SLOT_POLL_SECONDS)
+            slot = queue.acquire_slot(account, limit, holder)
+        stop = threading.Event()
+        
+        def renew():
+            while not stop.wait(SLOT_LEASE_SECONDS / 3):
+                if not queue.renew_slot(account, slot, holder):
+                    logger.warning(f"Lost kit slot {slot} for {username}; its lease expired")
+                    return
+        
+        thread = threading.Thread(target=renew, name=f'cap-slot-{slot}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            queue.release_slot(account, slot, holder)
+
+
+@atexit.register
+def close_session_pools():
+    """Quit all pooled browsers (run automatically at interpreter exit)."""
+    with _session_pools_lock:
+        pools = list(_session_pools.values())
+        _session_pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def execute_automation(kit_number, processed_data, config, progress=None, data_key=None):
+    """Execute the automation process with the provided data.
+    
+    Runs in a pooled, already logged-in browser unless
+    ``session_pool_size`` is 0, in which case a browser is started and
+    quit for this kit alone. Runs with a ``data_key`` are checkpointed
+    unless ``checkpoints`` is false.
+    
+    With ``backend`` set to ``'http'`` the kit is entered over plain HTTP,
+    falling back to the browser (unless ``http_fallback`` is false) if
+    that fails before anything was submitted.
+    """
+    
+    # Extract configuration
+    username = config.get('username')
+    password = config.get('password')
+    
+    if not username or not password:
+        return False, "CAP portal credentials not configured"
+    
+    backend = config.get('backend', 'selenium')
+    with account_slot(config):
+        success, message, submit_attempted = _run_backend(
+            backend, kit_number, processed_data, config, progress, data_key
+        )
+        if (not success and backend == 'http' and not submit_attempted
+                and config.get('http_fallback', True)):
+            logging.getLogger(__name__).warning(
+                f"HTTP backend failed for kit {kit_number} ({message}); falling back to the browser"
+            )
+            success, message, _ = _run_backend(
+                'selenium', kit_number, processed_data, config, progress, data_key
+            )
+        return success, message
+
+
+def _run_backend(backend, kit_number, processed_data, config, progress, data_key):
+    """Enter one kit with ``backend``; return ``(success, message, submit_attempted)``."""
+    if int(config.get('session_pool_size', 2)) > 0:
+        try:
+            with get_session_pool(config, backend).session() as automator:
+                success, message = automator.enter_kit_data(
+                    kit_number, processed_data, progress, data_key
+                )
+                return success, message, automator.submit_attempted
+        except SessionUnavailable as e:
+            return False, str(e), False
+    
+    # Initialize automator
+    automator = automator_class(backend)(
+        portal_url=config.get('portal_url', 'https://cap.org/portal'),
+        username=config.get('username'),
+        password=config.get('password'),
+        headless=config.get('headless', True),
+        **automator_options(config)
+    )
+    
+    # Execute automation
+    success, message = automator.automate_data_entry(kit_number, processed_data, progress, data_key)
+    return success, message, automator.submit_attempted
+
+
+def run_kits(kits, config, workers=None, progress=None):
+    """Enter several kits concurrently, each in its own browser.
+    
+    ``kits`` is a list of ``(kit_number, processed_data)`` or
+    ``(kit_number, processed_data, data_key)``. Kits are spread
+    over ``workers`` threads (default ``max_kits_per_account``); the
+    per-account limit from ``account_slot`` still applies. ``progress``,
+    if given, is called as ``progress(kit_number, done, errors)``.
+    
+    Returns the aggregate report from ``summarize_kit_results``.
+    """
+    workers = workers or int(config.get('max_kits_per_account', 2))
+    
+    def run(kit_number, processed_data, data_key=None):
+        kit_progress = None
+        if progress:
+            kit_progress = lambda done, errors: progress(kit_number, done, errors)
+        start = time.monotonic()
+        try:
+            success, message = execute_automation(
+                kit_number, processed_data, config, kit_progress, data_key
+            )
+        except Exception as e:
+            logging.getLogger(__name__).exception(f"Kit {kit_number} failed")
+            success, message = False, f"Automation failed: {str(e)}"
+        return {
+            'kit_number': kit_number,
+            'success': success,
+            'message': message,
+            'seconds': round(time.monotonic() - start, 2),
+        }
+    
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='cap-kit') as executor:
+        futures = [executor.submit(run, *kit) for kit in kits]
+        results = [future.result() for future in futures]
+    return summarize_kit_results(results, time.monotonic() - start)
+
+
+def summarize_kit_results(results, elapsed=None):
+    """Aggregate per-kit result dicts into one report.
+    
+    ``seconds`` is the wall-clock time ``elapsed`` when given, and
+    ``kit_seconds`` the time summed over kits.
+    """
+    succeeded = sum(1 for result in results if result['success'])
+    kit_seconds = round(sum(result['seconds'] for result in results), 2)
+    return {
+        'kits': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'seconds': round(elapsed, 2) if elapsed is not None else kit_seconds,
+        'kit_seconds': kit_seconds,
+        'results': results,
+    }
+
+
+# Updated main function integration
+def perform_cap_automation(kit_number, processed_data, progress=None, data_key=None):
+    """
+    Main function to perform CAP portal automation.
+    This replaces the placeholder message in your original script.
+    """
+    
+    # Load configuration
+    config_manager = AutomationConfig()
+    
+    if not config_manager.is_configured():
+        return False, "Automation not configured. Please set up CAP portal credentials."
+    
+    # Execute automation
+    success, message = execute_automation(
+        kit_number, processed_data, config_manager.config, progress, data_key
+    )
+    
+    return success, message
+
+
+def perform_cap_automation_batch(kits, progress=None):
+    """Run several ``(kit_number, processed_data[, data_key])`` kits concurrently.
+    
+    Returns the aggregate report from ``run_kits``.
+    """
+    config_manager = AutomationConfig()
+    
+    if not config_manager.is_configured():
+        message = "Automation not configured. Please set up CAP portal credentials."
+        return summarize_kit_results([
+            {'kit_number': kit_number, 'success': False, 'message': message, 'seconds': 0}
+            for kit_number, *_ in kits
+        ])
+    
+    return run_kits(kits, config_manager.config, progress=progress)
+
+
+# Example usage for testing
+if __name__ == "__main__":
+    # Test configuration (benchmarks/mock_portal.py serves a local stand-in
+    # portal at http://127.0.0.1:8765/ for its generated S0001.. specimens)
+    test_config = {
+        'portal_url': 'https://cap.org/portal',
+        'username': 'test_user',
+        'password': 'test_pass',
+        'headless': True
+    }
+    
+    # Test data
+    test_data = {
+        'sample_column': 'Specimen_ID',
+        'analyte_columns': ['Glucose', 'Cholesterol', 'Triglycerides'],
+        'records': [
+            {'Specimen_ID': 'S001', 'Glucose': '95', 'Cholesterol': '180', 'Triglycerides': '120'},
+            {'Specimen_ID': 'S002', 'Glucose': '110', 'Cholesterol': '200', 'Triglycerides': '150'}
+        ]
+    }
+    
+    success, message = execute_automation('TEST-KIT-001', test_data, test_config)
+    print(f"Automation result: {success}")
+    print(f"Message: {message}")
@@ -0,0 +1,358 @@
+"""
+Browser-free CAP portal backend.
+
+``CAPPortalHTTPClient`` enters a kit the way the browser would, but by
+posting the portal's own HTML forms with a ``requests.Session``:
+
+  * login         -- GET the portal, fill ``username``/``password`` into its
+                     login form (keeping hidden fields such as CSRF tokens)
+                     and post it; the session cookie is kept for later pages
+  * kit lookup    -- submit the dashboard's ``kit_search`` form and parse
+                     ``#kit-data-form`` into specimen rows and analyte inputs
+  * data entry    -- values are set on an in-memory copy of the form's fields
+  * submission    -- post every field of the kit form, as the browser would on
+                     ``Submit Data``, and look for ``.success-message``
+
+The session keeps its connections alive between requests, so a pooled
+client (see ``SessionPool``) enters kit after kit without reconnecting or
+logging in again. It shares ``PortalAutomator``'s workflow with the
+browser backend, including checkpoints and differential entry, and is
+chosen with ``"backend": "http"`` in ``cap_config.json``. Pages that need JavaScript to
+render or submit are out of its reach; ``execute_automation`` then falls
+back to the browser.
+"""
+
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from portal_automation import FormIndex, PortalAutomator
+from timing import stage
+
+# Meta tags some frameworks use to hand the CSRF token to scripts; it is
+# sent back in a header on every form post
+CSRF_META_NAMES = ('csrf-token', 'csrf_token', '_csrf')
+CSRF_HEADER = 'X-CSRF-Token'
+
+# Input types that are never posted, or only when clicked/checked
+_BUTTON_TYPES = ('submit', 'button', 'image', 'reset')
+_CHECKED_TYPES = ('checkbox', 'radio')
+
+
+class PortalUnavailable(requests.RequestException):
+    """The portal answered with a server error (5xx)."""
+
+
+class PageError(Exception):
+    """A portal page did not contain what the workflow expected."""
+
+
+class PortalForm:
+    """An HTML form: its target and fields, in document order."""
+
+    def __init__(self, page_url, attrs):
+        self.action = urljoin(page_url, attrs.get('action') or page_url)
+        self.method = (attrs.get('method') or 'get').lower()
+        self.id = attrs.get('id')
+        self.fields = []
+
+    def field_names(self):
+        return {field['name'] for field in self.fields}
+
+    def has_button(self, value):
+        return any(field['type'] in _BUTTON_TYPES and field['value'] == value
+                   for field in self.fields)
+
+    def payload(self, values=None, button=None):
+        """Return the ``(name, value)`` pairs the browser would post.
+
+        ``values`` overrides field values by name; ``button`` is the value
+        of the submit button clicked.
+        """
+        values = values or {}
+        pairs = []
+        for field in self.fields:
+            name, kind = field['name'], field['type']
+            if not name or kind == 'file':
+                continue
+            if kind in _BUTTON_TYPES:
+                if button is not None and field['value'] == button:
+                    pairs.append((name, field['value']))
+                continue
+            if kind in _CHECKED_TYPES and not field['checked']:
+                continue
+            pairs.append((name, values.get(name, field['value'])))
+        return pairs
+
+
+class PortalPage(HTMLParser):
+    """The parts of a portal page the HTTP client works with.
+
+    Collects every form with its fields (inputs, buttons, selects and
+    textareas, noting the ``data-analyte`` of each and the
+    ``data-specimen-id`` of its table row), the class names and ids
+    present, and a CSRF token published in a ``<meta>`` tag.
+    """
+
+    def __init__(self, url, text):
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.forms = []
+        self.classes = set()
+        self.ids = set()
+        self.csrf_token = None
+        self._form = None
+        self._specimen = None
+        self._select = None
+        self._textarea = None
+        self.feed(text)
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value or '' for name, value in attrs}
+        self.classes.update(attrs.get('class', '').split())
+        if attrs.get('id'):
+            self.ids.add(attrs['id'])
+
+        if tag == 'meta' and attrs.get('name', '').lower() in CSRF_META_NAMES:
+            self.csrf_token = attrs.get('content')
+        elif tag == 'form':
+            self._form = PortalForm(self.url, attrs)
+            self.forms.append(self._form)
+        elif tag == 'tr':
+            self._specimen = attrs.get('data-specimen-id')
+        elif self._form is None:
+            return
+        elif tag in ('input', 'button'):
+            self._form.fields.append({
+                'name': attrs.get('name', ''),
+                'type': attrs.get('type', 'submit' if tag == 'button' else 'text').lower(),
+                'value': attrs.get('value', ''),
+                'checked': 'checked' in attrs,
+                'analyte': attrs.get('data-analyte'),
+                'specimen': self._specimen,
+            })
+        elif tag == 'select':
+            self._select = {'name': attrs.get('name', ''), 'type': 'select', 'value': None,
+                            'checked': False, 'analyte': attrs.get('data-analyte'),
+                            'specimen': self._specimen}
+            self._form.fields.append(self._select)
+        elif tag == 'textarea':
+            self._textarea = {'name': attrs.get('name', ''), 'type': 'textarea', 'value': '',
+                              'checked': False, 'analyte': attrs.get('data-analyte'),
+                              'specimen': self._specimen}
+            self._form.fields.append(self._textarea)
+        elif tag == 'option' and self._select is not None:
+            if self._select['value'] is None or 'selected' in attrs:
+                self._select['value'] = attrs.get('value', '')
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self._form = None
+        elif tag == 'tr':
+            self._specimen = None
+        elif tag == 'select' and self._select is not None:
+            if self._select['value'] is None:
+                self._select['value'] = ''
+            self._select = None
+        elif tag == 'textarea' and self._textarea is not None:
+            # As in the browser, one newline right after <textarea> is dropped
+            value = self._textarea['value']
+            self._textarea['value'] = value[1:] if value.startswith('\n') else value
+            self._textarea = None
+
+    def handle_data(self, data):
+        if self._textarea is not None:
+            self._textarea['value'] += data
+
+    def find_form(self, form_id=None, field=None, button=None):
+        """Return the first form matching every criterion given, or None."""
+        for form in self.forms:
+            if form_id is not None and form.id != form_id:
+                continue
+            if field is not None and field not in form.field_names():
+                continue
+            if button is not None and not form.has_button(button):
+                continue
+            return form
+        return None
+
+
+class CAPPortalHTTPClient(PortalAutomator):
+    """``PortalAutomator`` that posts the portal's forms without a browser.
+
+    Always fills in ``'bulk'`` mode: setting a value is a dictionary
+    update, so there is nothing to gain from going field by field.
+    ``headless`` is accepted for interface compatibility and ignored.
+    """
+
+    # Connection failures, timeouts and 5xx pages are worth retrying
+    transient_errors = (requests.ConnectionError, requests.Timeout, PortalUnavailable)
+
+    def __init__(self, portal_url, username, password, headless=True, **options):
+        options['fill_mode'] = 'bulk'
+        super().__init__(portal_url, username, password, headless, **options)
+        self.session = None
+        self.page = None
+        self.kit_form = None
+        self.values = {}
+        self._fields = {}
+
+    @stage("automation.setup_driver")
+    def setup_driver(self):
+        """Start an HTTP session with keep-alive connections and a cookie jar."""
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.logger.info("HTTP session initialized successfully")
+        return True
+
+    def _request(self, method, url, step, **kwargs):
+        """Fetch a page and make it the current one."""
+        response = self.session.request(
+            method, url, timeout=self.step_timeouts.get(step, self.timeout), **kwargs
+        )
+        if response.status_code >= 500:
+            raise PortalUnavailable(f"{response.status_code} from {url}", response=response)
+        response.raise_for_status()
+        self.page = PortalPage(response.url, response.text)
+        return self.page
+
+    def _submit_form(self, form, pairs, step):
+        """Submit ``form`` with ``pairs`` the way the browser would."""
+        headers = {CSRF_HEADER: self.page.csrf_token} if self.page.csrf_token else {}
+        if form.method == 'post':
+            return self._request('POST', form.action, step, data=pairs, headers=headers)
+        return self._request('GET', form.action, step, params=pairs, headers=headers)
+
+    def _login(self):
+        page = self._request('GET', self.portal_url, 'login')
+        self.logger.info(f"Navigating to CAP portal: {self.portal_url}")
+        if 'dashboard' in page.classes:
+            # The session cookie is already valid, e.g. a retried login
+            # whose POST succeeded before the following page failed
+            self.logger.info("Already logged into CAP portal")
+            return True
+        form = page.find_form(field='username')
+        if form is None:
+            raise PageError("No login form on the portal page")
+        page = self._submit_form(
+            form,
+            form.payload({'username': self.username, 'password': self.password}, button='Login'),
+            'login',
+        )
+        if 'dashboard' not in page.classes:
+            raise PageError("Portal did not show the dashboard after login")
+        self.logger.info("Successfully logged into CAP portal")
+        return True
+
+    def _find_kit_form(self, kit_number):
+        # Search from the current page if it is the dashboard, else load it
+        form = self.page.find_form(field='kit_search') if self.page else None
+        if form is None:
+            form = self._request('GET', self.portal_url, 'kit_form').find_form(field='kit_search')
+            if form is None:
+                raise PageError("No kit search form on the portal page")
+        page = self._submit_form(
+            form, form.payload({'kit_search': kit_number}, button='Search Kit'), 'kit_form'
+        )
+        self.kit_form = page.find_form(form_id='kit-data-form')
+        if self.kit_form is None:
+            raise PageError(f"No kit data form for {kit_number}")
+        self.values = {field['name']: field['value'] for field in self.kit_form.fields}
+        self.logger.info(f"Found kit form for {kit_number}")
+        return True
+
+    @stage("automation.index_form")
+    def index_kit_form(self, handles=True):
+        """Index the parsed kit form's analyte inputs by specimen."""
+        self._fields = {}
+        for field in self.kit_form.fields:
+            if field['specimen'] and field['analyte'] and field['name']:
+                self._fields.setdefault(field['specimen'], {})[field['analyte']] = field['name']
+        self.form_index = FormIndex({
+            specimen: {'inputs': inputs} for specimen, inputs in self._fields.items()
+        })
+        self.logger.info(f"Indexed {len(self.form_index)} specimen rows on the kit form")
+        return self.form_index
+
+    @stage("automation.fill_chunk")
+    def bulk_fill(self, specimens):
+        """Set ``[(specimen_id, analyte_data), ...]`` on the form's fields."""
+        report = {'filled': 0, 'missing_specimens': [], 'missing_fields': []}
+        for specimen_id, analyte_data in specimens:
+            inputs = self._fields.get(str(specimen_id))
+            if inputs is None:
+                report['missing_specimens'].append(str(specimen_id))
+                self.logger.error(f"Error populating specimen {specimen_id}: row not found")
+                continue
+            for analyte, value in analyte_data.items():
+                name = inputs.get(analyte)
+                if name is None:
+                    report['missing_fields'].append((str(specimen_id), analyte))
+                    self.logger.warning(
+                        f"Could not find input for analyte {analyte} (specimen {specimen_id})"
+                    )
+                    continue
+                self.values[name] = str(value)
+                report['filled'] += 1
+        return report
+
+    @stage("automation.read_back")
+    def read_form_values(self, specimen_ids):
+        """Return the form's current values for ``specimen_ids``."""
+        shown = {}
+        for specimen_id in specimen_ids:
+            inputs = self._fields.get(str(specimen_id))
+            if inputs is not None:
+                shown[str(specimen_id)] = {
+                    analyte: self.values.get(name, '') for analyte, name in inputs.items()
+                }
+        return shown
+
+    @stage("automation.submit")
+    def submit_data(self):
+        """Post the kit form with the entered values."""
+        self.submit_attempted = True
+        try:
+            # Not retried: a post that timed out may still have been accepted
+            page = self._submit_form(
+                self.kit_form, self.kit_form.payload(self.values, button='Submit Data'), 'submit'
+            )
+            if 'success-message' not in page.classes:
+                raise PageError("Portal did not confirm the submission")
+            self.logger.info("Data submitted successfully")
+            return True
+        except Exception as e:
+            self.logger.error(f"Error submitting data: {e}")
+            return False
+
+    def is_alive(self):
+        """True while the HTTP session is open."""
+        return self.session is not None
+
+    def session_expired(self):
+        """True if the portal answered the last request with its login form."""
+        return self.page is not None and self.page.find_form(field='username') is not None
+
+    def ensure_logged_in(self):
+        """Load the dashboard, logging in again if the session expired."""
+        try:
+            if 'dashboard' in self._request('GET', self.portal_url, 'page').classes:
+                return True
+        except requests.RequestException as e:
+            self.logger.warning(f"Could not reach CAP portal: {e}")
+            return False
+        self.logger.info("CAP portal session expired, logging in again")
+        return self.login()
+
+    def close(self):
+        """Close the session and its connections."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.page = None
+        self.kit_form = None
@@ -0,0 +1,173 @@
+"""
+Durable per-specimen progress of CAP automation runs.
+
+Entering a large kit can fail late -- on specimen 180 of 200, or at
+submission -- and a plain rerun would type every specimen again. The
+automator records each specimen it has filled here, keyed by kit number
+and data key (the stored upload), and marks the run once the portal has
+confirmed the submission. A rerun for the same kit and data then:
+
+  * does nothing if that upload was already submitted for the kit
+  * reads back the checkpointed specimens' fields from the kit form in one
+    pass and skips those still showing the expected values, so only
+    specimens the portal did not keep are entered again
+
+It also keeps, per kit, the values last submitted for every specimen and
+analyte, so a corrected re-upload can be entered as a diff against them,
+and, per portal, the analyte codes seen on its kit forms, so spreadsheet
+analyte names can be checked against them before a job is queued.
+
+The database location is set with ``CAP_CHECKPOINT_DB``.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+CHECKPOINT_DB = os.environ.get(
+    "CAP_CHECKPOINT_DB", os.path.join(tempfile.gettempdir(), "cap_checkpoints.sqlite3")
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS specimens (
+    kit_number TEXT NOT NULL,
+    data_key TEXT NOT NULL,
+    specimen_id TEXT NOT NULL,
+    entered REAL NOT NULL,
+    PRIMARY KEY (kit_number, data_key, specimen_id)
+);
+CREATE TABLE IF NOT EXISTS submitted_values (
+    kit_number TEXT NOT NULL,
+    specimen_id TEXT NOT NULL,
+    analyte TEXT NOT NULL,
+    value TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    PRIMARY KEY (kit_number, specimen_id, analyte)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    kit_number TEXT NOT NULL,
+    data_key TEXT NOT NULL,
+    submitted REAL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (kit_number, data_key)
+);
+CREATE TABLE IF NOT EXISTS portal_analytes (
+    portal_url TEXT NOT NULL,
+    analyte TEXT NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (portal_url, analyte)
+);
+"""
+
+
+class CheckpointStore:
+    """Checkpoints stored in a SQLite database shared by all workers."""
+
+    def __init__(self, path=CHECKPOINT_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def entered(self, kit_number, data_key):
+        """Return the set of specimen ids already filled for this run."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT specimen_id FROM specimens WHERE kit_number = ? AND data_key = ?",
+                (kit_number, data_key),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_entered(self, kit_number, data_key, specimen_ids):
+        """Record that ``specimen_ids`` have been filled on the kit form."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO specimens (kit_number, data_key, specimen_id, entered)"
+                " VALUES (?, ?, ?, ?)",
+                [(kit_number, data_key, str(specimen_id), now) for specimen_id in specimen_ids],
+            )
+            conn.execute(
+                "INSERT INTO runs (kit_number, data_key, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT (kit_number, data_key) DO UPDATE SET updated = excluded.updated",
+                (kit_number, data_key, now),
+            )
+            conn.execute("COMMIT")
+
+    def mark_submitted(self, kit_number, data_key):
+        """Record that the portal confirmed submission of this run."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO runs (kit_number, data_key, submitted, updated) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (kit_number, data_key)"
+                " DO UPDATE SET submitted = excluded.submitted, updated = excluded.updated",
+                (kit_number, data_key, now, now),
+            )
+
+    def is_submitted(self, kit_number, data_key):
+        """True if this upload has already been submitted for the kit."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT submitted FROM runs WHERE kit_number = ? AND data_key = ?",
+                (kit_number, data_key),
+            ).fetchone()
+        return row is not None and row[0] is not None
+
+    def record_submission(self, kit_number, specimens):
+        """Remember the values just submitted for a kit.
+
+        ``specimens`` is ``[(specimen_id, {analyte: value}), ...]``.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO submitted_values"
+                " (kit_number, specimen_id, analyte, value, submitted) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (kit_number, str(specimen_id), analyte, str(value), now)
+                    for specimen_id, analyte_data in specimens
+                    for analyte, value in analyte_data.items()
+                ],
+            )
+            conn.execute("COMMIT")
+
+    def last_submitted(self, kit_number):
+        """Return ``{(specimen_id, analyte): value}`` last submitted for a kit."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT specimen_id, analyte, value FROM submitted_values WHERE kit_number = ?",
+                (kit_number,),
+            ).fetchall()
+        return {(specimen_id, analyte): value for specimen_id, analyte, value in rows}
+
+    def record_portal_analytes(self, portal_url, codes):
+        """Remember the analyte codes found on a kit form of this portal."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO portal_analytes (portal_url, analyte, seen) VALUES (?, ?, ?)",
+                [(portal_url, str(code), now) for code in codes],
+            )
+            conn.execute("COMMIT")
+
+    def portal_analytes(self, portal_url):
+        """Return the set of analyte codes seen on this portal's kit forms."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT analyte FROM portal_analytes WHERE portal_url = ?", (portal_url,)
+            ).fetchall()
+        return {row[0] for row in rows}
@@ -0,0 +1,345 @@
+"""
+Columnar on-disk store for data handed from the upload step to automation.
+
+Each entry is a directory named by its key, holding:
+
+  * ``meta.json``    -- the array names plus any extra fields (kit number,
+                        sample and analyte columns, ...), written last so a
+                        half-written entry is never visible
+  * ``summary.json`` -- optional small index (counts, column names, issue
+                        totals, content hash) that status and confirmation
+                        pages read without touching the columns
+  * ``res_<n>.npy``  -- the specimen/analyte/value results to enter, one
+                        array per ``ResultSet`` field (see ``results``)
+  * ``issue_<n>.npy`` -- optional data quality issue list, one array per
+                        field (type, specimen, analyte, ...), paged through
+                        without loading the data columns
+
+The workbook's own columns are not kept: the automator only needs the
+results. Numeric, boolean and datetime issue fields keep their NumPy
+dtype; anything else is stored as fixed-width unicode with missing cells
+as ``""``. No array needs pickling, so every array can be memory-mapped
+and readers only touch the ones they actually use.
+
+``TempDataStore`` manages the entries: each one expires ``TTL_SECONDS``
+after it was written, and once the store grows past ``MAX_STORE_BYTES`` the
+least recently read entries are evicted. Sweeps run after every write and,
+in the long-lived server, from a background thread. Settings come from the
+environment (``CAP_STORE_DIR``, ``CAP_STORE_TTL_HOURS``, ``CAP_STORE_MAX_MB``
+and ``CAP_STORE_SWEEP_SECONDS``).
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+
+import numpy as np
+
+from results import ResultSet
+
+STORE_DIR = os.environ.get(
+    "CAP_STORE_DIR", os.path.join(tempfile.gettempdir(), "cap_store")
+)
+TTL_SECONDS = float(os.environ.get("CAP_STORE_TTL_HOURS", "24")) * 3600
+MAX_STORE_BYTES = int(float(os.environ.get("CAP_STORE_MAX_MB", "1024")) * 1024 * 1024)
+SWEEP_SECONDS = float(os.environ.get("CAP_STORE_SWEEP_SECONDS", "60"))
+KEY_PREFIX = "cap_data_"
+META_FILE = "meta.json"
+SUMMARY_FILE = "summary.json"
+
+# Keys are directory names created by mkdtemp; anything else is rejected so a
+# key can never point outside the store.
+_KEY_RE = re.compile(r"^" + KEY_PREFIX + r"[A-Za-z0-9_]+$")
+
+logger = logging.getLogger(__name__)
+
+
+def _column_array(series):
+    """Convert a DataFrame column to an array that needs no pickling."""
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufmM":
+        return series.to_numpy()
+    return series.where(series.notna(), "").astype(str).to_numpy(dtype=str)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def entry_path(key, store_dir=STORE_DIR):
+    """Return the directory of the entry for ``key``."""
+    if not _KEY_RE.match(key):
+        raise FileNotFoundError(f"Data key {key} not found")
+    return os.path.join(store_dir, key)
+
+
+def _write_arrays(arrays, path, prefix):
+    for i, array in enumerate(arrays.values()):
+        np.save(os.path.join(path, f"{prefix}{i}.npy"), array, allow_pickle=False)
+    return list(arrays)
+
+
+def _write_columns(df, path, prefix):
+    return _write_arrays({name: _column_array(df[name]) for name in df.columns}, path, prefix)
+
+
+def write_entry(meta, results, store_dir=STORE_DIR, summary=None, issues=None):
+    """Write the ``results`` set plus ``meta``; return the new key.
+
+    ``results`` go to the entry's ``res_<n>.npy`` arrays, ``summary`` to
+    its ``summary.json`` sidecar and the ``issues`` DataFrame to its
+    ``issue_<n>.npy`` arrays.
+    """
+    path = tempfile.mkdtemp(prefix=KEY_PREFIX, dir=store_dir)
+    meta = dict(meta, result_fields=_write_arrays(results.arrays(), path, "res_"),
+                result_count=len(results))
+    if issues is not None:
+        meta = dict(meta, issue_columns=_write_columns(issues, path, "issue_"),
+                    issue_count=len(issues))
+    if summary is not None:
+        with open(os.path.join(path, SUMMARY_FILE), "w", encoding="utf-8") as f:
+            json.dump(summary, f, default=_json_default)
+    meta = dict(meta, created=time.time())
+    with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, default=_json_default)
+    return os.path.basename(path)
+
+
+def read_meta(key, store_dir=STORE_DIR):
+    """Return the ``meta.json`` contents of an entry."""
+    meta_path = os.path.join(entry_path(key, store_dir), META_FILE)
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"Data key {key} not found")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_summary(key, store_dir=STORE_DIR):
+    """Return the ``summary.json`` sidecar of an entry."""
+    path = entry_path(key, store_dir)
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        raise FileNotFoundError(f"Data key {key} not found")
+    try:
+        with open(os.path.join(path, SUMMARY_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Data key {key} has no summary") from None
+
+
+class ColumnReader(Mapping):
+    """Read-only mapping of array name to array, loaded on first access.
+
+    The arrays are an entry's files starting with ``prefix``. They are
+    memory-mapped, so only the pages a caller actually reads are brought
+    into memory.
+    """
+
+    def __init__(self, path, columns, prefix, mmap=True):
+        self._path = path
+        self._prefix = prefix
+        self._index = {name: i for i, name in enumerate(columns)}
+        self._mmap_mode = "r" if mmap else None
+        self._loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            i = self._index[name]
+            self._loaded[name] = np.load(
+                os.path.join(self._path, f"{self._prefix}{i}.npy"),
+                mmap_mode=self._mmap_mode,
+                allow_pickle=False,
+            )
+        return self._loaded[name]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def read_entry(key, store_dir=STORE_DIR, mmap=True):
+    """Return an entry's metadata with its ``results`` set added.
+
+    The set is read from the memory-mapped ``res_<n>.npy`` arrays.
+    """
+    meta = read_meta(key, store_dir)
+    meta["results"] = ResultSet.from_arrays(
+        ColumnReader(entry_path(key, store_dir), meta["result_fields"], "res_", mmap)
+    )
+    return meta
+
+
+def read_issues(key, store_dir=STORE_DIR):
+    """Return a lazy reader of an entry's issue list, one array per field."""
+    meta = read_meta(key, store_dir)
+    if "issue_columns" not in meta:
+        raise FileNotFoundError(f"Data key {key} has no issue list")
+    return ColumnReader(entry_path(key, store_dir), meta["issue_columns"], "issue_")
+
+
+def _entry_size(path):
+    return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+
+
+class TempDataStore:
+    """Store of upload entries with per-entry TTL and a total size cap.
+
+    Entries are evicted least-recently-read first (reading an entry touches
+    its ``meta.json``). Hit, miss, expiry and eviction counts are kept per
+    process and reported by ``stats()``.
+    """
+
+    def __init__(self, store_dir=STORE_DIR, ttl=TTL_SECONDS, max_bytes=MAX_STORE_BYTES):
+        self.store_dir = store_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def put(self, meta, results, summary=None, issues=None):
+        """Write a new entry, sweep the store, and return the entry key."""
+        key = write_entry(meta, results, self.store_dir, summary, issues)
+        self.sweep(keep=key)
+        return key
+
+    def get(self, key):
+        """Return an entry as ``read_entry`` does, counting hits and misses."""
+        return self._read(key, read_entry)
+
+    def get_summary(self, key):
+        """Return only an entry's summary sidecar; no columns are opened."""
+        return self._read(key, read_summary)
+
+    def get_issues(self, key):
+        """Return an entry's issue list as ``read_issues`` does."""
+        return self._read(key, read_issues)
+
+    def _read(self, key, reader):
+        try:
+            created = read_meta(key, self.store_dir)["created"]
+            result = reader(key, self.store_dir)
+        except FileNotFoundError:
+            self._count("misses")
+            raise
+        path = entry_path(key, self.store_dir)
+        if time.time() - created > self.ttl:
+            self._remove(path)
+            self._count("misses")
+            self._count("expired")
+            raise FileNotFoundError(f"Data key {key} has expired")
+        # Reading marks the entry as recently used for eviction
+        os.utime(os.path.join(path, META_FILE))
+        self._count("hits")
+        return result
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def _remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _scan(self):
+        """Yield ``(path, created, last_used, size)`` for every entry.
+
+        ``last_used`` is None for entries without a readable ``meta.json``:
+        still being written, or left behind by a crashed writer.
+        """
+        for e in os.scandir(self.store_dir):
+            if not (e.is_dir() and e.name.startswith(KEY_PREFIX)):
+                continue
+            meta_path = os.path.join(e.path, META_FILE)
+            try:
+                size = _entry_size(e.path)
+                try:
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        created = json.load(f)["created"]
+                    last_used = os.stat(meta_path).st_mtime
+                except (OSError, ValueError, KeyError):
+                    created, last_used = e.stat().st_mtime, None
+            except OSError:
+                # Removed by a concurrent sweep
+                continue
+            yield e.path, created, last_used, size
+
+    def sweep(self, keep=None):
+        """Drop expired entries, then evict LRU entries over the size cap.
+
+        ``keep`` names an entry (normally the one just written) that is
+        never evicted for capacity.
+        """
+        now = time.time()
+        live = []
+        expired = evicted = 0
+        for path, created, last_used, size in self._scan():
+            if now - created > self.ttl:
+                self._remove(path)
+                expired += 1
+            else:
+                live.append((last_used, path, size))
+        total = sum(size for _, _, size in live)
+        # Incomplete entries are only ever removed by the TTL
+        evictable = sorted(
+            entry for entry in live
+            if entry[0] is not None and os.path.basename(entry[1]) != keep
+        )
+        for last_used, path, size in evictable:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            evicted += 1
+        if expired or evicted:
+            logger.info("Store sweep removed %d expired and %d evicted entries",
+                        expired, evicted)
+        self._count("expired", expired)
+        self._count("evictions", evicted)
+        return expired, evicted
+
+    def start_sweeper(self, interval=SWEEP_SECONDS):
+        """Sweep from a daemon thread every ``interval`` seconds."""
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception("Store sweep failed")
+
+        self._sweeper = threading.Thread(target=run, name="cap-store-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stats(self):
+        """Return counters plus the current number and size of entries."""
+        entries = list(self._scan())
+        with self._lock:
+            return {
+                "entries": len(entries),
+                "bytes": sum(size for *_, size in entries),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+# Shared by every request handled in this process
+store = TempDataStore()
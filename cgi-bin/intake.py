@@ -0,0 +1,82 @@
+"""
+Size-bounded, streaming intake for multipart uploads.
+
+``cgi.FieldStorage`` already writes file parts to a temporary file as it
+reads them, but it accepts a body of any size and callers then tend to
+``.read()`` the whole part back into memory. ``UploadFieldStorage`` spools
+file parts to a ``SpooledTemporaryFile`` (in memory for small sheets, on
+disk beyond ``SPOOL_MEMORY_BYTES``) and enforces ``MAX_UPLOAD_BYTES``:
+
+  * up front, from the declared Content-Length, before the body is read
+  * while streaming, for bodies whose length is not declared
+
+The spooled file is left positioned at the start so it can be handed
+straight to the Excel parser without another in-memory copy.
+"""
+
+import cgi
+import os
+import tempfile
+
+# Limits are configurable through the environment, in megabytes.
+MAX_UPLOAD_BYTES = int(float(os.environ.get("CAP_MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+SPOOL_MEMORY_BYTES = int(float(os.environ.get("CAP_SPOOL_MEMORY_MB", "1")) * 1024 * 1024)
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds ``MAX_UPLOAD_BYTES``."""
+
+    def __init__(self, max_bytes):
+        super().__init__(
+            f"Upload exceeds the maximum allowed size of {max_bytes // (1024 * 1024)} MB"
+        )
+        self.max_bytes = max_bytes
+
+
+class _BoundedSpool(tempfile.SpooledTemporaryFile):
+    """SpooledTemporaryFile that refuses to grow past ``max_bytes``."""
+
+    def __init__(self, max_bytes, **kwargs):
+        super().__init__(**kwargs)
+        self.max_bytes = max_bytes
+
+    def write(self, data):
+        if self.tell() + len(data) > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        return super().write(data)
+
+
+class UploadFieldStorage(cgi.FieldStorage):
+    """FieldStorage that spools file parts and enforces an upload size cap.
+
+    Multipart sub-parts are created with ``self.__class__``, so the limits
+    apply to every nested part as well as to the request as a whole.
+    """
+
+    max_bytes = MAX_UPLOAD_BYTES
+    spool_bytes = SPOOL_MEMORY_BYTES
+
+    def __init__(self, fp=None, headers=None, outerboundary=b"",
+                 environ=os.environ, *args, **kwargs):
+        length = environ.get("CONTENT_LENGTH")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        super().__init__(fp, headers, outerboundary, environ, *args, **kwargs)
+
+    def make_file(self):
+        if not self._binary_file:
+            return super().make_file()
+        return _BoundedSpool(
+            self.max_bytes,
+            max_size=self.spool_bytes,
+            mode="w+b",
+            prefix="cap_upload_",
+        )
+
+
+def upload_size(file_obj):
+    """Return the size in bytes of a spooled upload, leaving it rewound."""
+    file_obj.seek(0, os.SEEK_END)
+    size = file_obj.tell()
+    file_obj.seek(0)
+    return size
@@ -0,0 +1,156 @@
+"""
+Grouped data quality issue reporting.
+
+A sheet with many blank cells can yield tens of thousands of issues, far
+too many to put on one page. The results pages therefore show issues
+grouped by type and analyte: each group gives its count and only the first
+``ISSUE_SAMPLE_SIZE`` issues, with a link to the rest. The full list is
+stored column by column with the upload (see ``datastore``) and served a
+page at a time by ``issues.py``.
+"""
+
+import html
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+
+# Issues shown per group on the results page
+ISSUE_SAMPLE_SIZE = 5
+
+# Issues per page of the full list
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+ISSUE_FIELDS = ("type", "specimen", "analyte", "value", "count")
+
+
+def _value_text(value):
+    # Blank cells are reported with None or NaN as their value
+    return "" if value is None or value != value else str(value)
+
+
+def issues_frame(issues):
+    """Return the issue list as a DataFrame with one column per field.
+
+    ``value`` is blank for duplicates and ``count`` is 0 for cell issues,
+    so every column has a single storable type.
+    """
+    return pd.DataFrame({
+        "type": [issue["type"] for issue in issues],
+        "specimen": [str(issue.get("specimen", "")) for issue in issues],
+        "analyte": [str(issue.get("analyte", "")) for issue in issues],
+        "value": [_value_text(issue.get("value")) for issue in issues],
+        "count": np.array([issue.get("count", 0) for issue in issues], dtype=np.int64),
+    }, columns=list(ISSUE_FIELDS))
+
+
+def group_issues(issues, sample_size=ISSUE_SAMPLE_SIZE):
+    """Group issues by ``(type, analyte)`` in order of first appearance.
+
+    Returns ``[{"type", "analyte", "count", "sample"}, ...]`` where
+    ``sample`` holds the group's first ``sample_size`` issues.
+    """
+    groups = {}
+    for issue in issues:
+        key = (issue["type"], issue.get("analyte"))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"type": key[0], "analyte": key[1], "count": 0, "sample": []}
+        group["count"] += 1
+        if len(group["sample"]) < sample_size:
+            group["sample"].append(issue)
+    return list(groups.values())
+
+
+def describe_issue(issue):
+    """Return the one-line HTML description of an issue."""
+    if "message" in issue:
+        return html.escape(str(issue["message"]))
+    text = (f'Specimen {html.escape(str(issue.get("specimen", "N/A")))}, '
+            f'Analyte {html.escape(str(issue.get("analyte", "N/A")))}')
+    if "value" in issue:
+        text += f', Value: {html.escape(str(issue["value"]))}'
+    if "count" in issue:
+        text += f', Count: {issue["count"]}'
+    return text
+
+
+def issues_url(data_key, issue_type=None, analyte=None, page=None):
+    """Return the link to (a filtered page of) the full issue list."""
+    params = {"data_key": data_key}
+    if issue_type:
+        params["type"] = issue_type
+    if analyte:
+        params["analyte"] = analyte
+    if page:
+        params["page"] = page
+    return "/cgi-bin/issues.py?" + urlencode(params)
+
+
+def render_issue_groups(groups, data_key=None):
+    """Render grouped issues as HTML; its size depends only on the group count."""
+    if not groups:
+        return '<p>No issues detected.</p>'
+    parts = []
+    for group in groups:
+        title = group["type"].replace("_", " ").title()
+        analyte = html.escape(str(group["analyte"] or "N/A"))
+        items = "".join(
+            f'<div class="issue {group["type"]}">{describe_issue(issue)}</div>'
+            for issue in group["sample"]
+        )
+        more = group["count"] - len(group["sample"])
+        if more > 0:
+            link = (f' <a href="{html.escape(issues_url(data_key, group["type"], group["analyte"]))}">'
+                    'View all</a>' if data_key else '')
+            items += f'<p class="issue-more">and {more} more.{link}</p>'
+        parts.append(
+            f'<details class="issue-group {group["type"]}"><summary><strong>{title}</strong>: '
+            f'Analyte {analyte} ({group["count"]})</summary>{items}</details>'
+        )
+    if data_key:
+        parts.append(f'<p><a href="{html.escape(issues_url(data_key))}">View the full issue list</a></p>')
+    return "".join(parts)
+
+
+def matching_rows(columns, issue_type=None, analyte=None):
+    """Return the row numbers of stored issues matching the filters."""
+    mask = None
+    if issue_type:
+        mask = np.asarray(columns["type"]) == issue_type
+    if analyte:
+        matches = np.asarray(columns["analyte"]) == analyte
+        mask = matches if mask is None else mask & matches
+    return np.arange(len(columns["type"])) if mask is None else np.flatnonzero(mask)
+
+
+def issues_at(columns, rows):
+    """Return the stored issues at ``rows`` as dicts, in ``analyze_data`` form."""
+    fields = {name: np.asarray(columns[name])[rows].tolist() for name in ISSUE_FIELDS}
+    issues = []
+    for issue_type, specimen, analyte, value, count in zip(*(fields[name] for name in ISSUE_FIELDS)):
+        issue = {"type": issue_type, "specimen": specimen, "analyte": analyte}
+        if issue_type == "duplicate":
+            issue["count"] = count
+        else:
+            issue["value"] = value
+        issues.append(issue)
+    return issues
+
+
+def issue_page(columns, issue_type=None, analyte=None, page=1, per_page=PAGE_SIZE):
+    """Return one page of a stored issue list, optionally filtered.
+
+    ``columns`` maps each of ``ISSUE_FIELDS`` to an array, as returned by
+    ``upload.load_temp_issues``. Filtering runs on whole arrays; only the
+    issues on the page are turned into dicts.
+    """
+    per_page = min(max(1, per_page), MAX_PAGE_SIZE)
+    rows = matching_rows(columns, issue_type, analyte)
+    total = len(rows)
+    pages = max(1, -(-total // per_page))
+    page = min(max(1, page), pages)
+    rows = rows[(page - 1) * per_page:page * per_page]
+    return {"total": total, "page": page, "per_page": per_page, "pages": pages,
+            "issues": issues_at(columns, rows)}
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Full data quality issue list of an upload, one page at a time.
+
+The results page only shows a few issues per type and analyte; this page
+lists all of them from the stored analysis, ``PAGE_SIZE`` per page,
+optionally filtered with ``type`` (``missing``, ``non_numeric`` or
+``duplicate``) and ``analyte``. Machine clients can read the same pages as
+JSON from ``/status/issues?data_key=...`` on the long-lived server.
+"""
+import cgi
+import html
+import cgitb
+
+from issue_report import PAGE_SIZE, describe_issue, issue_page, issues_url
+from upload import load_temp_issues
+
+ISSUES_PAGE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Data Quality Issues</title>
+<style>
+    body {{ font-family: Arial, sans-serif; background-color: #f5f9fc; margin: 0; padding: 0; }}
+    header {{ background-color: #2f59a6; color: #fff; padding: 20px; }}
+    main {{ max-width: 900px; margin: 0 auto; padding: 30px; }}
+    .issue {{ background: #fff; border-left: 4px solid #f59e0b; padding: 10px 15px; margin-bottom: 8px; border-radius: 4px; }}
+    .issue.non_numeric {{ border-left-color: #ef4444; }}
+    .issue.duplicate {{ border-left-color: #6b7280; }}
+    .pager a {{ margin-right: 15px; }}
+</style>
+</head>
+<body>
+<header>
+    <h1>Data Quality Issues</h1>
+</header>
+<main>
+    <p>{heading}</p>
+    {issues_html}
+    <p class="pager">{pager}</p>
+</main>
+</body>
+</html>
+"""
+
+
+def _int(text, default):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return default
+
+
+def issues_payload(params):
+    """Return one page of an upload's issues for the JSON status route.
+
+    ``params`` is a parsed query string; raises FileNotFoundError for an
+    unknown or expired ``data_key``.
+    """
+    def first(name, default=""):
+        return params.get(name, [default])[0]
+
+    data_key = first("data_key")
+    result = issue_page(
+        load_temp_issues(data_key),
+        issue_type=first("type") or None,
+        analyte=first("analyte") or None,
+        page=_int(first("page"), 1),
+        per_page=_int(first("per_page"), PAGE_SIZE),
+    )
+    return dict(result, data_key=data_key)
+
+
+def handle_request(form):
+    """Render one page of the issue list for the ``data_key`` in the query string."""
+    data_key = form.getfirst("data_key", "").strip()
+    if not data_key:
+        return "<h1>Missing parameters</h1>"
+    issue_type = form.getfirst("type", "").strip() or None
+    analyte = form.getfirst("analyte", "").strip() or None
+    try:
+        result = issue_page(
+            load_temp_issues(data_key),
+            issue_type=issue_type,
+            analyte=analyte,
+            page=_int(form.getfirst("page"), 1),
+        )
+    except FileNotFoundError as exc:
+        return f"<h1>Issues not available</h1><p>{html.escape(str(exc))}</p>"
+
+    heading = f"{result['total']} issues"
+    if issue_type:
+        heading += f" of type {html.escape(issue_type.replace('_', ' '))}"
+    if analyte:
+        heading += f" for analyte {html.escape(analyte)}"
+    heading += f" (page {result['page']} of {result['pages']})"
+
+    pager = []
+    if result["page"] > 1:
+        url = issues_url(data_key, issue_type, analyte, result["page"] - 1)
+        pager.append(f'<a href="{html.escape(url)}">Previous</a>')
+    if result["page"] < result["pages"]:
+        url = issues_url(data_key, issue_type, analyte, result["page"] + 1)
+        pager.append(f'<a href="{html.escape(url)}">Next</a>')
+
+    return ISSUES_PAGE.format(
+        heading=heading,
+        issues_html="".join(
+            f'<div class="issue {issue["type"]}"><strong>{issue["type"].replace("_", " ").title()}</strong>: '
+            f'{describe_issue(issue)}</div>'
+            for issue in result["issues"]
+        ) or '<p>No issues detected.</p>',
+        pager="".join(pager),
+    )
+
+
+def main():
+    cgitb.enable()
+    form = cgi.FieldStorage()
+    body = handle_request(form)
+    print("Content-type: text/html\n")
+    print(body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Status page for a queued CAP automation job.
+
+Shows the job state, specimens done out of the total, the error count and
+the automator's final message. While the job is queued or running the page
+refreshes itself every few seconds. Machine clients can poll the same data
+as JSON from ``/status/job?job_id=...`` on the long-lived server.
+"""
+import cgi
+import html
+import cgitb
+
+from jobs import FAILED, QUEUED, RUNNING, JobQueue
+
+REFRESH_SECONDS = 3
+
+STATUS_PAGE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+{refresh}
+<title>Automation Status</title>
+<style>
+    body {{ font-family: Arial, sans-serif; background-color: #f5f9fc; margin: 0; padding: 0; }}
+    header {{ background-color: #2f59a6; color: #fff; padding: 20px; }}
+    main {{ max-width: 800px; margin: 0 auto; padding: 30px; }}
+    .card {{ background: #fff; padding: 20px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }}
+    .card h2 {{ margin-top: 0; }}
+    .status {{ display: inline-block; padding: 4px 10px; border-radius: 6px; background: #e5e7eb; font-weight: bold; }}
+    .status.succeeded {{ background: #d1fae5; color: #065f46; }}
+    .status.failed {{ background: #fee2e2; color: #991b1b; }}
+    progress {{ width: 100%; height: 18px; }}
+    .btn {{ display: inline-block; padding: 10px 20px; background-color: #2563eb; color: #fff; border-radius: 4px; text-decoration: none; margin-top: 20px; }}
+</style>
+</head>
+<body>
+<header>
+    <h1>Automation Status</h1>
+</header>
+<main>
+    <div class="card">
+        <h2>Kit Number: {kit}</h2>
+        <p><span class="status {status}">{status_label}</span></p>
+        <progress value="{done}" max="{total}"></progress>
+        <p><strong>Specimens done:</strong> {done} of {total}</p>
+        <p><strong>Errors:</strong> {errors}</p>
+        {message}
+        <a class="btn" href="/">Return to Home</a>
+    </div>
+</main>
+</body>
+</html>
+"""
+
+
+def job_payload(job_id):
+    """Return the public fields of a job, raising FileNotFoundError if unknown."""
+    job = JobQueue().get(job_id)
+    if job is None:
+        raise FileNotFoundError(f"Job {job_id} not found")
+    return {
+        "job_id": job["id"],
+        "kit_number": job["kit_number"],
+        "status": job["status"],
+        "total": job["total"],
+        "done": job["done"],
+        "errors": job["errors"],
+        "message": job["message"],
+    }
+
+
+def handle_request(form):
+    """Render the status page for the ``job_id`` in the query string."""
+    job_id = form.getfirst("job_id", "").strip()
+    if not job_id:
+        return "<h1>Missing parameters</h1>"
+    try:
+        job = job_payload(job_id)
+    except FileNotFoundError as exc:
+        return f"<h1>Unknown job</h1><p>{html.escape(str(exc))}</p>"
+    in_progress = job["status"] in (QUEUED, RUNNING)
+    message = ""
+    if job["message"]:
+        label = "Error" if job["status"] == FAILED else "Result"
+        message = f"<p><strong>{label}:</strong> {html.escape(job['message'])}</p>"
+    return STATUS_PAGE.format(
+        refresh=(f'<meta http-equiv="refresh" content="{REFRESH_SECONDS}">'
+                 if in_progress else ""),
+        kit=html.escape(job["kit_number"]),
+        status=job["status"],
+        status_label=job["status"].title(),
+        done=job["done"],
+        total=job["total"] or 0,
+        errors=job["errors"],
+        message=message,
+    )
+
+
+def main():
+    cgitb.enable()
+    form = cgi.FieldStorage()
+    body = handle_request(form)
+    print("Content-type: text/html\n")
+    print(body)
+
+
+if __name__ == "__main__":
+    main()
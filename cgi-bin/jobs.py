@@ -0,0 +1,228 @@
+"""
+Durable, SQLite-backed queue of CAP automation jobs.
+
+Running the automator inline kept the browser request open through Chrome
+startup, login and every specimen, so large kits routinely timed out. The
+web step now only submits a job and returns its id; a separate worker
+process (``worker.py`` in the project root) claims queued jobs, runs the
+automation and records progress, which the job status page polls.
+
+Job states are ``queued`` -> ``running`` -> ``succeeded`` / ``failed``.
+While a job runs, its worker sends a heartbeat every ``HEARTBEAT_SECONDS``
+(Chrome startup, login and the kit search report no progress of their
+own); a job with neither heartbeat nor progress for ``STALE_SECONDS`` is
+put back in the queue. Every update after the claim names the worker and
+only applies while that worker still holds the job, so a worker whose job
+was requeued and claimed elsewhere cannot overwrite the new run. The
+database location is set with ``CAP_JOB_DB``.
+
+The same database holds the per-account kit slots (``acquire_slot``), so
+the ``max_kits_per_account`` limit holds across every worker process, not
+just the threads of one. A slot is a lease its holder renews; the slot of
+a process that died is free again after ``SLOT_LEASE_SECONDS``.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+QUEUE_DB = os.environ.get(
+    "CAP_JOB_DB", os.path.join(tempfile.gettempdir(), "cap_jobs.sqlite3")
+)
+STALE_SECONDS = float(os.environ.get("CAP_JOB_STALE_SECONDS", "900"))
+HEARTBEAT_SECONDS = float(
+    os.environ.get("CAP_JOB_HEARTBEAT_SECONDS", str(min(60.0, STALE_SECONDS / 3)))
+)
+SLOT_LEASE_SECONDS = float(os.environ.get("CAP_SLOT_LEASE_SECONDS", "120"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kit_number TEXT NOT NULL,
+    data_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER,
+    done INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS account_slots (
+    account TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (account, slot)
+);
+"""
+
+
+class JobQueue:
+    """Job queue stored in a SQLite database shared by web and worker."""
+
+    def __init__(self, path=QUEUE_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit; claim() opens its own write transaction
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, kit_number, data_key, total=None):
+        """Queue automation of ``data_key`` for ``kit_number``; return the job id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kit_number, data_key, status, total, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kit_number, data_key, QUEUED, total, now, now),
+            )
+        return job_id
+
+    def claim(self, worker):
+        """Atomically take the oldest queued job for ``worker``, or None."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                    (QUEUED,),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, started = ?, updated = ?"
+                    " WHERE id = ?",
+                    (RUNNING, worker, now, now, row["id"]),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(row, status=RUNNING, worker=worker, started=now)
+
+    def _update_running(self, job_id, worker, assignments, params):
+        """Apply ``assignments`` if ``worker`` still holds the running job.
+
+        Returns False when the job was requeued (and perhaps claimed by
+        another worker) or has already finished.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND worker = ? AND status = ?",
+                (*params, job_id, worker, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id, worker):
+        """Mark ``worker``'s running job as alive; False if it no longer holds it."""
+        return self._update_running(job_id, worker, "updated = ?", (time.time(),))
+
+    def update_progress(self, job_id, worker, done, errors):
+        """Record specimens done and errors so far for ``worker``'s running job.
+
+        Returns False if the worker no longer holds the job.
+        """
+        return self._update_running(
+            job_id, worker, "done = ?, errors = ?, updated = ?", (done, errors, time.time())
+        )
+
+    def finish(self, job_id, worker, success, message):
+        """Mark ``worker``'s job as finished with the automator's result.
+
+        Returns False, leaving the job alone, if the worker no longer holds it.
+        """
+        now = time.time()
+        return self._update_running(
+            job_id, worker, "status = ?, message = ?, finished = ?, updated = ?",
+            (SUCCEEDED if success else FAILED, message, now, now),
+        )
+
+    def get(self, job_id):
+        """Return a job as a dict, or None if it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def requeue_stale(self, max_age=STALE_SECONDS):
+        """Put running jobs with no heartbeat or progress for ``max_age`` seconds back in the queue."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, updated = ?"
+                " WHERE status = ? AND updated < ?",
+                (QUEUED, time.time(), RUNNING, time.time() - max_age),
+            )
+        return cursor.rowcount
+
+    def acquire_slot(self, account, limit, holder, lease=SLOT_LEASE_SECONDS):
+        """Take a free one of ``account``'s ``limit`` slots for ``holder``.
+
+        Returns the slot number, or None if all are held. Expired leases
+        are dropped first.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                conn.execute(
+                    "DELETE FROM account_slots WHERE account = ? AND expires < ?",
+                    (account, now),
+                )
+                held = {
+                    row["slot"] for row in conn.execute(
+                        "SELECT slot FROM account_slots WHERE account = ?", (account,)
+                    )
+                }
+                slot = next((slot for slot in range(limit) if slot not in held), None)
+                if slot is not None:
+                    conn.execute(
+                        "INSERT INTO account_slots (account, slot, holder, expires)"
+                        " VALUES (?, ?, ?, ?)",
+                        (account, slot, holder, now + lease),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return slot
+
+    def renew_slot(self, account, slot, holder, lease=SLOT_LEASE_SECONDS):
+        """Extend ``holder``'s lease on a slot; False if it has lost the slot."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE account_slots SET expires = ? WHERE account = ? AND slot = ? AND holder = ?",
+                (time.time() + lease, account, slot, holder),
+            )
+        return cursor.rowcount == 1
+
+    def release_slot(self, account, slot, holder):
+        """Give back a slot taken with ``acquire_slot``."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM account_slots WHERE account = ? AND slot = ? AND holder = ?",
+                (account, slot, holder),
+            )
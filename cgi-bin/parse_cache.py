@@ -0,0 +1,108 @@
+"""
+Content-addressed cache of parsed and analysed workbooks.
+
+Technicians often upload the same file several times (after a failed
+automation, a browser refresh, or for a second kit). Entries are keyed by
+the SHA-256 of the uploaded bytes plus the generation of the column-mapping
+profiles (see ``profiles``) and hold the parsed DataFrame, the inferred
+columns and the ``analyze_data`` result, so a repeat upload skips parsing
+and analysis entirely until a profile is saved or deleted.
+
+The cache lives in process memory, bounded by ``MAX_CACHE_BYTES`` with
+least-recently-used eviction. It only pays off in the long-lived server
+(``server.py``); under CGI every request starts with an empty cache.
+Cached objects are shared between requests and must not be modified.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+MAX_CACHE_BYTES = int(float(os.environ.get("CAP_PARSE_CACHE_MB", "256")) * 1024 * 1024)
+
+# Rough per-issue footprint (dict plus its keys and values)
+ISSUE_BYTES = 400
+
+CachedAnalysis = namedtuple(
+    "CachedAnalysis", ["df", "summary", "issues", "sample_col", "analyte_cols", "results"],
+    defaults=[None],
+)
+
+
+def content_hash(file_obj, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a seekable binary file, rewound."""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def _entry_size(entry):
+    size = int(entry.df.memory_usage(deep=True).sum()) + ISSUE_BYTES * len(entry.issues)
+    if entry.results is not None:
+        size += entry.results.nbytes
+    return size
+
+
+class ParseCache:
+    """Thread-safe, size-bounded LRU cache of ``CachedAnalysis`` entries."""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, digest):
+        """Return the cached entry for ``digest``, or None."""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry
+
+    def put(self, digest, df, summary, issues, sample_col, analyte_cols, results=None):
+        """Cache an analysed workbook and return the stored entry."""
+        entry = CachedAnalysis(df, summary, issues, sample_col, analyte_cols, results)
+        size = _entry_size(entry)
+        if size > self.max_bytes:
+            # Never worth evicting everything else for one huge workbook
+            return entry
+        with self._lock:
+            if digest in self._entries:
+                self._total -= self._sizes.pop(digest)
+                del self._entries[digest]
+            self._entries[digest] = entry
+            self._sizes[digest] = size
+            self._total += size
+            while self._total > self.max_bytes:
+                old_digest, _ = self._entries.popitem(last=False)
+                self._total -= self._sizes.pop(old_digest)
+                self.evictions += 1
+        return entry
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current occupancy."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Shared by every request handled in this process
+parse_cache = ParseCache()
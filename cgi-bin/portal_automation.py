@@ -0,0 +1,581 @@
+"""
+Backend-independent CAP portal automation.
+
+``PortalAutomator`` holds the kit entry workflow both backends share --
+retries, analyte mapping, pre-flight, checkpointed and differential
+planning, filling and submission -- on top of a few page operations each
+backend implements:
+
+  * ``setup_driver`` and ``close``: start and stop the browser or session
+  * ``_login`` and ``_find_kit_form``: one attempt at logging in and at
+    loading a kit's form
+  * ``index_kit_form``: build the ``FormIndex`` of the loaded form
+  * ``bulk_fill`` (and ``populate_specimen_data`` for ``'field'`` mode)
+    and ``read_form_values``: set and read back analyte values
+  * ``submit_data``: submit the form
+  * ``is_alive``, ``session_expired`` and ``ensure_logged_in``: session
+    checks for pooled sessions
+
+``cap_automation.CAPPortalAutomator`` drives Chrome with Selenium and
+``cap_http.CAPPortalHTTPClient`` posts the portal's forms with
+``requests``. Nothing here imports either, so the HTTP backend -- and
+the pages that only need ``AutomationConfig`` -- run on hosts without a
+browser stack.
+"""
+
+import json
+import logging
+import os
+import time
+
+from analyte_map import FUZZY_CUTOFF, map_analytes
+from results import ResultSet
+from timing import stage
+
+
+def specimen_results(processed_data):
+    """Return the ``ResultSet`` of the values to enter from ``processed_data``.
+
+    ``processed_data`` is what ``upload.load_temp_data`` returns (with its
+    stored ``results``) or a dict with a ``records`` list. Analytes are keyed by their
+    portal name where ``analyte_names`` (from a saved column-mapping
+    profile) gives one, else by column name.
+    """
+    if processed_data.get('results') is not None:
+        return processed_data['results']
+    sample_col = processed_data.get('sample_column')
+    analyte_cols = processed_data.get('analyte_columns', [])
+    analyte_names = processed_data.get('analyte_names') or {}
+    return ResultSet.from_records(processed_data.get('records', []), sample_col, analyte_cols,
+                                  analyte_names)
+
+
+def iter_specimen_data(processed_data):
+    """Yield ``(specimen_id, analyte_data)`` for each specimen with values.
+
+    Ids and values are the text to enter; rows without a specimen id and
+    blank values are skipped, and rows of the same specimen are merged
+    (see ``results``).
+    """
+    return specimen_results(processed_data).iter_specimens()
+
+
+class FormIndex:
+    """Specimen rows and analyte inputs of one loaded kit form.
+
+    Built by ``index_kit_form``; the Selenium backend's element handles are
+    only valid until the form is reloaded.
+    """
+
+    def __init__(self, index):
+        self._rows = {specimen: entry.get('row') for specimen, entry in index.items()}
+        self._inputs = {specimen: entry['inputs'] for specimen, entry in index.items()}
+
+    def __len__(self):
+        return len(self._inputs)
+
+    def row(self, specimen_id):
+        """Return the row element for a specimen, or None."""
+        return self._rows.get(str(specimen_id))
+
+    def input(self, specimen_id, analyte_name):
+        """Return the input element for a specimen's analyte, or None."""
+        return self._inputs.get(str(specimen_id), {}).get(analyte_name)
+
+    def analytes(self):
+        """Return the set of analyte codes with an input on the form."""
+        codes = set()
+        for inputs in self._inputs.values():
+            codes.update(inputs)
+        return codes
+
+    def preflight(self, specimens):
+        """Report which specimens and ``(specimen, analyte)`` fields are not on the form."""
+        missing_specimens = []
+        missing_fields = []
+        for specimen_id, analyte_data in specimens:
+            inputs = self._inputs.get(str(specimen_id))
+            if inputs is None:
+                missing_specimens.append(specimen_id)
+                continue
+            missing_fields.extend(
+                (specimen_id, analyte) for analyte in analyte_data if analyte not in inputs
+            )
+        return {'missing_specimens': missing_specimens, 'missing_fields': missing_fields}
+
+
+class PortalAutomator:
+    """The kit entry workflow, independent of how the portal is reached.
+
+    ``fill_mode`` is ``'bulk'`` (fill ``bulk_chunk_size`` specimens per
+    ``bulk_fill`` call) or ``'field'`` (``populate_specimen_data`` one
+    specimen at a time).
+
+    Waits give up after ``timeout`` seconds, or the value for the step
+    (``'login'``, ``'kit_form'``, ``'page'``, ``'submit'``) in
+    ``step_timeouts``. Transient failures are retried up to
+    ``retry_attempts`` tries in all, sleeping ``retry_backoff`` seconds
+    and doubling before each retry.
+
+    With a ``checkpoint_store``, runs given a ``data_key`` record each
+    filled specimen and their submission, and a rerun resumes where the
+    last one stopped (see ``checkpoints``). With ``differential`` as well,
+    only cells whose value differs from what the form already shows
+    (``diff_read_back``) or, failing that, from the kit's last submission
+    are typed, and the changes since that submission are reported.
+
+    Analyte names from the spreadsheet are mapped onto the form's analyte
+    codes before pre-flight (see ``analyte_map``), using the built-in
+    synonyms plus ``analyte_synonyms``; a name only similar to a code is
+    mapped when the similarity is at least ``analyte_match_cutoff``.
+
+    Subclasses implement the page operations listed in the module
+    docstring.
+    """
+
+    # Errors with_retries retries
+    transient_errors = ()
+    # Errors reported as a timeout when login or the kit search gives up
+    timeout_errors = ()
+
+    def __init__(self, portal_url, username, password, headless=False,
+                 fill_mode='bulk', bulk_chunk_size=100, timeout=30,
+                 retry_attempts=3, retry_backoff=0.5, step_timeouts=None,
+                 checkpoint_store=None, differential=True, diff_read_back=True,
+                 analyte_synonyms=None, analyte_match_cutoff=FUZZY_CUTOFF):
+        self.portal_url = portal_url
+        self.username = username
+        self.password = password
+        self.headless = headless
+        self.fill_mode = fill_mode
+        self.bulk_chunk_size = bulk_chunk_size
+        self.timeout = timeout
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_backoff = retry_backoff
+        self.step_timeouts = step_timeouts or {}
+        self.checkpoint_store = checkpoint_store
+        self.differential = differential and checkpoint_store is not None
+        self.diff_read_back = diff_read_back
+        self.last_diff = None
+        self.analyte_synonyms = analyte_synonyms or {}
+        self.analyte_match_cutoff = analyte_match_cutoff
+        self.last_mapping = None
+        self.submit_attempted = False
+        self.form_index = None
+
+        # Setup logging
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger(__name__)
+
+    def setup_driver(self):
+        """Start the browser or session; return True on success."""
+        raise NotImplementedError
+
+    def _login(self):
+        """Log in once; raise on failure."""
+        raise NotImplementedError
+
+    def _find_kit_form(self, kit_number):
+        """Load the kit's form once; raise on failure."""
+        raise NotImplementedError
+
+    def index_kit_form(self, handles=True):
+        """Index the loaded kit form into ``form_index`` and return it."""
+        raise NotImplementedError
+
+    def populate_specimen_data(self, specimen_id, analyte_data):
+        """Fill one specimen field by field; return True on success."""
+        raise NotImplementedError
+
+    def bulk_fill(self, specimens):
+        """Fill ``[(specimen_id, analyte_data), ...]``; return a report dict.
+
+        The report has ``filled`` (a count), ``missing_specimens`` and
+        ``missing_fields``.
+        """
+        raise NotImplementedError
+
+    def read_form_values(self, specimen_ids):
+        """Return ``{specimen_id: {analyte: value}}`` as the form shows them."""
+        raise NotImplementedError
+
+    def submit_data(self):
+        """Submit the completed form; return True on success."""
+        raise NotImplementedError
+
+    def is_alive(self):
+        """True while the browser or session can still be used."""
+        raise NotImplementedError
+
+    def session_expired(self):
+        """True if the portal has sent the session back to its login form."""
+        raise NotImplementedError
+
+    def ensure_logged_in(self):
+        """Return to the portal dashboard, logging in again if the session expired."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the browser or session."""
+        raise NotImplementedError
+
+    def with_retries(self, description, func, *args, on_retry=None):
+        """Call ``func(*args)``, retrying ``transient_errors`` with backoff.
+
+        ``on_retry(error)`` runs before each retry. The error from the last
+        attempt is re-raised.
+        """
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                return func(*args)
+            except self.transient_errors as e:
+                if attempt == self.retry_attempts:
+                    raise
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                self.logger.warning(
+                    f"{description}: {type(e).__name__}, retrying in {delay:.1f}s "
+                    f"(attempt {attempt} of {self.retry_attempts})"
+                )
+                time.sleep(delay)
+                if on_retry:
+                    on_retry(e)
+
+    @stage("automation.login")
+    def login(self):
+        """Authenticate with the CAP portal."""
+        try:
+            return self.with_retries("Login", self._login)
+        except self.timeout_errors:
+            self.logger.error("Login timeout - check portal URL and credentials")
+            return False
+        except Exception as e:
+            self.logger.error(f"Login failed: {e}")
+            return False
+
+    def retry_kit_search(self, error):
+        """Called before the kit search is retried; backends may reset the page."""
+
+    @stage("automation.find_kit_form")
+    def find_kit_form(self, kit_number):
+        """Navigate to and locate the specific kit form."""
+        try:
+            return self.with_retries(
+                f"Kit form {kit_number}", self._find_kit_form, kit_number,
+                on_retry=self.retry_kit_search
+            )
+        except self.timeout_errors:
+            self.logger.error(f"Could not find kit form for {kit_number}")
+            return False
+        except Exception as e:
+            self.logger.error(f"Could not find kit form for {kit_number}: {e}")
+            return False
+
+    def map_analytes(self, specimens):
+        """Return ``specimens`` with analytes keyed by the form's analyte codes.
+
+        Codes already on the form are kept as they are; other names are
+        resolved once through ``analyte_map`` and the result is logged, so
+        fuzzy matches and names with no code are visible before anything
+        is typed. The mapping is kept in ``last_mapping``.
+        """
+        names = {}
+        for _, analyte_data in specimens:
+            names.update(dict.fromkeys(analyte_data))
+        codes = self.form_index.analytes()
+        if self.checkpoint_store is not None and codes:
+            self.checkpoint_store.record_portal_analytes(self.portal_url, codes)
+        mapping = self.last_mapping = map_analytes(
+            names, codes, self.analyte_synonyms, self.analyte_match_cutoff
+        )
+        if not mapping.renamed and not mapping.unmatched:
+            return specimens
+        self.logger.info(f"Analyte mapping: {mapping.describe()}")
+        for name, code in mapping.fuzzy.items():
+            self.logger.warning(f"Analyte {name!r} matched to {code!r} by similarity only")
+        for name, candidates in mapping.unmatched.items():
+            self.logger.warning(
+                f"Analyte {name!r} has no field on the kit form"
+                + (f" (closest: {', '.join(candidates)})" if candidates else "")
+            )
+        return [(specimen_id, mapping.apply(analyte_data)) for specimen_id, analyte_data in specimens]
+
+    def preflight(self, specimens):
+        """Check ``specimens`` against the form index before anything is typed.
+
+        Logs and returns the unmatched specimens and fields.
+        """
+        report = self.form_index.preflight(specimens)
+        missing_specimens = report['missing_specimens']
+        missing_fields = report['missing_fields']
+        if missing_specimens:
+            self.logger.warning(
+                f"Pre-flight: {len(missing_specimens)} of {len(specimens)} specimens not on the kit form: "
+                + ", ".join(str(s) for s in missing_specimens[:20])
+                + (" ..." if len(missing_specimens) > 20 else "")
+            )
+        if missing_fields:
+            self.logger.warning(
+                f"Pre-flight: {len(missing_fields)} analyte fields not on the kit form: "
+                + ", ".join(f"{s}/{a}" for s, a in missing_fields[:20])
+                + (" ..." if len(missing_fields) > 20 else "")
+            )
+        return report
+
+    def fill_specimens(self, specimens, progress=None, on_filled=None):
+        """Fill every specimen; return ``(success_count, error_count)``.
+
+        ``on_filled``, if given, is called with the ids of each batch of
+        specimens as soon as they have been filled.
+        """
+        success_count = 0
+        error_count = 0
+        if self.fill_mode == 'bulk':
+            for start in range(0, len(specimens), self.bulk_chunk_size):
+                chunk = specimens[start:start + self.bulk_chunk_size]
+                try:
+                    report = self.with_retries(
+                        f"Specimens {start + 1}-{start + len(chunk)}", self.bulk_fill, chunk
+                    )
+                    missing = set(report['missing_specimens'])
+                except Exception as e:
+                    self.logger.error(f"Error populating specimens {start + 1}-{start + len(chunk)}: {e}")
+                    missing = {str(specimen_id) for specimen_id, _ in chunk}
+                filled = [specimen_id for specimen_id, _ in chunk if str(specimen_id) not in missing]
+                if filled and on_filled:
+                    on_filled(filled)
+                success_count += len(filled)
+                error_count += len(chunk) - len(filled)
+                if progress:
+                    progress(success_count, error_count)
+            return success_count, error_count
+
+        for specimen_id, analyte_data in specimens:
+            # Populate the specimen data
+            if self.populate_specimen_data(specimen_id, analyte_data):
+                success_count += 1
+                if on_filled:
+                    on_filled([specimen_id])
+            else:
+                error_count += 1
+            if progress:
+                progress(success_count, error_count)
+        return success_count, error_count
+
+    def plan_fill(self, kit_number, data_key, specimens):
+        """Work out which cells still need typing; return ``(to_fill, skipped)``.
+
+        A cell is left alone when the form already shows its value. The
+        form is read back in one pass: all of it in differential mode,
+        otherwise only the specimens checkpointed for ``data_key`` (the
+        portal may not have kept them). In differential mode without
+        read-back, the kit's last submitted values stand in for the form.
+        ``to_fill`` keeps only the cells to type; ``skipped`` counts
+        specimens with nothing left to type.
+        """
+        read_all = self.differential and self.diff_read_back
+        previous = self.checkpoint_store.last_submitted(kit_number) if self.differential else {}
+        if read_all:
+            shown = self.read_form_values(specimen_id for specimen_id, _ in specimens)
+        elif self.checkpoint_store is not None and data_key:
+            entered = self.checkpoint_store.entered(kit_number, data_key)
+            shown = self.read_form_values(
+                specimen_id for specimen_id, _ in specimens if str(specimen_id) in entered
+            ) if entered else {}
+        else:
+            shown = {}
+
+        to_fill = []
+        for specimen_id, analyte_data in specimens:
+            fields = shown.get(str(specimen_id))
+            changed = {}
+            for analyte, value in analyte_data.items():
+                value = str(value)
+                if fields is not None:
+                    # Fields missing from the form are reported by the pre-flight
+                    current = fields.get(analyte, value)
+                elif self.differential and not self.diff_read_back:
+                    current = previous.get((str(specimen_id), analyte))
+                else:
+                    current = None
+                if current != value:
+                    changed[analyte] = value
+            if changed:
+                to_fill.append((specimen_id, changed))
+        skipped = len(specimens) - len(to_fill)
+        if skipped:
+            self.logger.info(
+                f"Kit {kit_number}: {skipped} of {len(specimens)} specimens already up to date on the form"
+            )
+        return to_fill, skipped
+
+    def diff_submission(self, kit_number, specimens):
+        """Compare ``specimens`` with the kit's last submission.
+
+        Returns ``{'changed': [(specimen, analyte, old, new), ...],
+        'added': [(specimen, analyte, new), ...], 'unchanged': n}``, or
+        None if nothing was submitted for the kit before.
+        """
+        previous = self.checkpoint_store.last_submitted(kit_number)
+        if not previous:
+            return None
+        diff = {'changed': [], 'added': [], 'unchanged': 0}
+        for specimen_id, analyte_data in specimens:
+            for analyte, value in analyte_data.items():
+                old = previous.get((str(specimen_id), analyte))
+                new = str(value)
+                if old is None:
+                    diff['added'].append((specimen_id, analyte, new))
+                elif old != new:
+                    diff['changed'].append((specimen_id, analyte, old, new))
+                else:
+                    diff['unchanged'] += 1
+        for specimen_id, analyte, old, new in diff['changed'][:20]:
+            self.logger.info(f"Kit {kit_number}: {specimen_id}/{analyte} {old} -> {new}")
+        self.logger.info(
+            f"Kit {kit_number}: {len(diff['changed'])} values changed, {len(diff['added'])} added, "
+            f"{diff['unchanged']} unchanged since the last submission"
+        )
+        return diff
+
+    def automate_data_entry(self, kit_number, processed_data, progress=None, data_key=None):
+        """Main automation workflow, in a browser or session started for this run only.
+
+        ``progress``, if given, is called as ``progress(done, errors)``
+        after each specimen. ``data_key`` identifies the stored upload for
+        checkpointing.
+        """
+        try:
+            # Setup and login
+            if not self.setup_driver():
+                return False, "Failed to initialize web driver"
+
+            if not self.login():
+                return False, "Failed to login to CAP portal"
+
+            return self.enter_kit_data(kit_number, processed_data, progress, data_key)
+
+        finally:
+            self.close()
+
+    @stage("automation.kit")
+    def enter_kit_data(self, kit_number, processed_data, progress=None, data_key=None):
+        """Enter and submit one kit in an already logged-in browser or session."""
+        checkpoints = self.checkpoint_store if data_key else None
+        self.submit_attempted = False
+        if checkpoints and checkpoints.is_submitted(kit_number, data_key):
+            return True, f"Kit {kit_number} was already submitted from this upload"
+        try:
+            # Find the kit form, logging in again once if the session expired
+            if not self.find_kit_form(kit_number):
+                if not (self.session_expired() and self.login()
+                        and self.find_kit_form(kit_number)):
+                    return False, f"Could not locate kit form for {kit_number}"
+
+            # Index the form once and report unmatched specimens up front
+            specimens = list(iter_specimen_data(processed_data))
+            self.index_kit_form(handles=self.fill_mode != 'bulk')
+            specimens = self.map_analytes(specimens)
+            report = self.preflight(specimens)
+            if specimens and len(report['missing_specimens']) == len(specimens):
+                return False, f"None of the {len(specimens)} specimens were found on the kit form for {kit_number}"
+
+            # Only type what the form does not already show
+            all_specimens = specimens
+            skipped = 0
+            on_filled = None
+            self.last_diff = self.diff_submission(kit_number, specimens) if self.differential else None
+            if checkpoints or self.differential:
+                specimens, skipped = self.plan_fill(kit_number, data_key, specimens)
+            if checkpoints:
+                on_filled = lambda ids: checkpoints.mark_entered(kit_number, data_key, ids)
+            if skipped and progress:
+                report_progress = progress
+                progress = lambda done, errors: report_progress(skipped + done, errors)
+
+            # Process each specimen
+            success_count, error_count = self.fill_specimens(specimens, progress, on_filled)
+            success_count += skipped
+
+            # Submit the form
+            if success_count > 0:
+                if self.submit_data():
+                    if checkpoints:
+                        checkpoints.mark_submitted(kit_number, data_key)
+                    if self.checkpoint_store is not None:
+                        self.checkpoint_store.record_submission(kit_number, all_specimens)
+                    message = f"Successfully processed {success_count} specimens, {error_count} errors"
+                    if skipped:
+                        message += f" ({skipped} already up to date on the form)"
+                    if self.last_diff:
+                        message += (f"; {len(self.last_diff['changed'])} values changed and "
+                                    f"{len(self.last_diff['added'])} added since the last submission")
+                    if report['missing_fields']:
+                        message += f", {len(report['missing_fields'])} analyte fields not on the form"
+                    return True, message
+                else:
+                    return False, "Data entry completed but submission failed"
+            else:
+                return False, "No valid data to submit"
+
+        except Exception as e:
+            self.logger.error(f"Automation workflow failed: {e}")
+            return False, f"Automation failed: {str(e)}"
+
+        finally:
+            # Element handles die with the form
+            self.form_index = None
+
+
+# Configuration management
+class AutomationConfig:
+    """Manages automation configuration and credentials."""
+
+    def __init__(self, config_file='cap_config.json'):
+        self.config_file = config_file
+        self.config = self.load_config()
+
+    def load_config(self):
+        """Load configuration from file."""
+        try:
+            if os.path.exists(self.config_file):
+                with open(self.config_file, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.warning(f"Could not load config file: {e}")
+
+        # Return default config
+        return {
+            'portal_url': 'https://cap.org/portal',
+            'username': '',
+            'password': '',
+            'headless': True,
+            'timeout': 30,
+            'retry_attempts': 3,
+            'session_pool_size': 2,
+            'session_max_age': 3600,
+            'fill_mode': 'bulk',
+            'bulk_chunk_size': 100,
+            'retry_backoff': 0.5,
+            'max_kits_per_account': 2,
+            'checkpoints': True,
+            'differential': True,
+            'diff_read_back': True,
+            'backend': 'selenium',
+            'http_fallback': True
+        }
+
+    def save_config(self, config):
+        """Save configuration to file."""
+        try:
+            with open(self.config_file, 'w') as f:
+                json.dump(config, f, indent=2)
+            return True
+        except Exception as e:
+            logging.error(f"Could not save config: {e}")
+            return False
+
+    def is_configured(self):
+        """Check if automation is properly configured."""
+        return (self.config.get('username') and 
+                self.config.get('password') and 
+                self.config.get('portal_url'))
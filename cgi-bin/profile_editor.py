@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Review and save the column mapping of an uploaded workbook as a profile.
+
+``?data_key=...`` shows every column of the upload's header row with the
+sample column and analyte columns currently chosen (from a saved profile,
+or inferred) and lets the technician correct them, give analytes their
+portal names, and save the result as the profile for that layout (see
+``profiles``). Without a ``data_key`` the page lists the saved profiles,
+each of which can be deleted.
+
+Saving only affects later uploads; the workbook has to be uploaded again
+for the new mapping to apply to it.
+"""
+import cgi
+import html
+import cgitb
+
+from profiles import ProfileStore
+from upload import load_temp_summary
+
+EDITOR_PAGE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Column Mapping Profiles</title>
+<style>
+    body {{ font-family: Arial, sans-serif; background-color: #f5f9fc; margin: 0; padding: 0; }}
+    header {{ background-color: #2f59a6; color: #fff; padding: 20px; }}
+    main {{ max-width: 900px; margin: 0 auto; padding: 30px; }}
+    .card {{ background: #fff; padding: 20px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); margin-bottom: 20px; }}
+    table {{ width: 100%; border-collapse: collapse; }}
+    th, td {{ text-align: left; padding: 6px 8px; border-bottom: 1px solid #e5e7eb; }}
+    input[type="text"] {{ width: 100%; padding: 6px; border-radius: 4px; border: 1px solid #d1d5db; }}
+    button {{ margin-top: 15px; padding: 10px 20px; background-color: #2563eb; color: #fff; border: none; border-radius: 4px; cursor: pointer; }}
+    .notice {{ background: #d1fae5; color: #065f46; padding: 10px 15px; border-radius: 4px; }}
+    .error {{ background: #fee2e2; color: #991b1b; padding: 10px 15px; border-radius: 4px; }}
+</style>
+</head>
+<body>
+<header>
+    <h1>Column Mapping Profiles</h1>
+</header>
+<main>
+    {notice}
+    {body}
+    <a href="/">Return to Home</a>
+</main>
+</body>
+</html>
+"""
+
+
+def _render(body, notice="", error=False):
+    if notice:
+        notice = f'<p class="{"error" if error else "notice"}">{html.escape(notice)}</p>'
+    return EDITOR_PAGE.format(notice=notice, body=body)
+
+
+def render_editor(data_key, summary, profile):
+    """Render the mapping form for an upload's header row."""
+    headers = summary["headers"]
+    analytes = set(summary["analyte_columns"])
+    names = profile["analyte_names"] if profile else {}
+    rows = []
+    for i, column in enumerate(headers):
+        sample_checked = " checked" if column == summary["sample_column"] else ""
+        analyte_checked = " checked" if column in analytes else ""
+        rows.append(
+            f'<tr><td>{html.escape(column)}</td>'
+            f'<td><input type="radio" name="sample_column" value="{i}"{sample_checked}></td>'
+            f'<td><input type="checkbox" name="analyte" value="{i}"{analyte_checked}></td>'
+            f'<td><input type="text" name="name_{i}" value="{html.escape(names.get(column, ""))}"'
+            f' placeholder="{html.escape(column)}"></td></tr>'
+        )
+    source = (f'the saved profile <strong>{html.escape(profile["name"])}</strong>'
+              if profile else 'inference from the header row')
+    return f"""
+    <form class="card" method="post" action="/cgi-bin/profile_editor.py">
+        <h2>Workbook layout</h2>
+        <p>Current mapping comes from {source}.</p>
+        <label>Profile name
+            <input type="text" name="name" required value="{html.escape(profile["name"] if profile else "")}">
+        </label>
+        <table>
+            <tr><th>Column</th><th>Sample ID</th><th>Analyte</th><th>Portal analyte name (optional)</th></tr>
+            {"".join(rows)}
+        </table>
+        <input type="hidden" name="action" value="save">
+        <input type="hidden" name="data_key" value="{html.escape(data_key)}">
+        <button type="submit">Save Profile</button>
+    </form>
+    """
+
+
+def render_profile_list(profiles):
+    """Render the saved profiles, each with a delete button."""
+    if not profiles:
+        return '<div class="card"><p>No profiles saved yet. Upload a workbook and follow the link under its analytes to save its layout.</p></div>'
+    rows = "".join(
+        f'<tr><td>{html.escape(p["name"])}</td><td>{html.escape(p["sample_column"])}</td>'
+        f'<td>{len(p["analyte_columns"])}</td><td>{p["uses"]}</td>'
+        f'<td><form method="post" action="/cgi-bin/profile_editor.py">'
+        f'<input type="hidden" name="action" value="delete">'
+        f'<input type="hidden" name="signature" value="{p["signature"]}">'
+        f'<button type="submit">Delete</button></form></td></tr>'
+        for p in profiles
+    )
+    return (f'<div class="card"><h2>Saved profiles</h2><table>'
+            f'<tr><th>Name</th><th>Sample column</th><th>Analytes</th><th>Uses</th><th></th></tr>'
+            f'{rows}</table></div>')
+
+
+def save_profile(form, store):
+    """Save the submitted mapping; return the notice to show.
+
+    Raises FileNotFoundError for an unknown upload and ValueError for an
+    invalid mapping.
+    """
+    data_key = form.getfirst("data_key", "").strip()
+    summary = load_temp_summary(data_key)
+    headers = summary.get("headers")
+    if not headers:
+        raise ValueError("This upload predates column profiles; upload the workbook again")
+
+    def column(index):
+        try:
+            return headers[int(index)]
+        except (TypeError, ValueError, IndexError):
+            raise ValueError(f"Unknown column {index!r}") from None
+
+    sample = form.getfirst("sample_column")
+    if sample is None:
+        raise ValueError("Choose the sample ID column")
+    sample_column = column(sample)
+    indexes = sorted({int(i) for i in form.getlist("analyte") if i.isdigit()})
+    analyte_columns = [column(i) for i in indexes if column(i) != sample_column]
+    analyte_names = {column(i): form.getfirst(f"name_{i}", "") for i in indexes}
+    name = form.getfirst("name", "").strip()
+    # Saving bumps the store's generation, so the parse cache does not
+    # reuse an analysis made with the old mapping
+    store.save(headers, sample_column, analyte_columns, analyte_names, name)
+    return f"Saved profile {name}. Upload the workbook again to apply it."
+
+
+def handle_request(form):
+    """Show or save the mapping of an upload, or list/delete saved profiles."""
+    store = ProfileStore()
+    action = form.getfirst("action", "")
+    if action == "delete":
+        signature = form.getfirst("signature", "")
+        notice = "Profile deleted." if store.delete(signature) else "No such profile."
+        return _render(render_profile_list(store.list()), notice)
+    if action == "save":
+        try:
+            notice = save_profile(form, store)
+        except FileNotFoundError as exc:
+            return _render("", str(exc), error=True)
+        except ValueError as exc:
+            return _render(render_profile_list(store.list()), str(exc), error=True)
+        return _render(render_profile_list(store.list()), notice)
+
+    data_key = form.getfirst("data_key", "").strip()
+    if not data_key:
+        return _render(render_profile_list(store.list()))
+    try:
+        summary = load_temp_summary(data_key)
+    except FileNotFoundError as exc:
+        return _render("", str(exc), error=True)
+    if not summary.get("headers"):
+        return _render("", "This upload predates column profiles; upload the workbook again.", error=True)
+    profile = store.get(summary["header_signature"])
+    return _render(render_editor(data_key, summary, profile))
+
+
+def main():
+    cgitb.enable()
+    form = cgi.FieldStorage()
+    body = handle_request(form)
+    print("Content-type: text/html\n")
+    print(body)
+
+
+if __name__ == "__main__":
+    main()
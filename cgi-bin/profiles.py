@@ -0,0 +1,200 @@
+"""
+Saved column-mapping profiles for recurring workbook layouts.
+
+Instruments and LIMS exports produce the same header row every time, so
+once the columns of a layout have been mapped correctly there is no need to
+guess them again. A profile records, for one layout:
+
+  * the sample (specimen id) column
+  * the analyte columns, in order
+  * optionally, the portal's name for each analyte column
+
+Profiles are keyed by a signature of the header row: the SHA-256 of the
+column names, trimmed, case-folded and with runs of whitespace collapsed,
+ignoring the ``Unnamed: n`` placeholders pandas gives blank header cells.
+``parse_excel`` looks the signature up before falling back to the keyword
+heuristics, and profiles are saved from ``profile_editor.py``.
+
+Every save and delete bumps the store's ``generation``, which the parse
+cache includes in its key, so no upload reuses an analysis made with a
+mapping that has since changed.
+
+The database location is set with ``CAP_PROFILE_DB`` (default
+``data/cap_profiles.sqlite3`` in the project directory, since unlike jobs
+and checkpoints profiles are meant to be kept; the server does not serve
+that directory and git ignores it).
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PROFILE_DB = os.environ.get(
+    "CAP_PROFILE_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data",
+                 "cap_profiles.sqlite3"),
+)
+
+_UNNAMED_RE = re.compile(r"^unnamed: \d+$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    signature TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    sample_column TEXT NOT NULL,
+    analyte_columns TEXT NOT NULL,
+    analyte_names TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    last_used REAL,
+    uses INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0);
+"""
+
+
+def normalize_header(name):
+    """Return the form of a column name used in signatures and matching."""
+    return " ".join(str(name).split()).casefold()
+
+
+def header_signature(columns):
+    """Return the signature of a header row (see module docstring)."""
+    names = [normalize_header(c) for c in columns]
+    names = [name for name in names if not _UNNAMED_RE.match(name)]
+    return hashlib.sha256("\x1f".join(names).encode("utf-8")).hexdigest()
+
+
+class ProfileStore:
+    """Column-mapping profiles stored in a SQLite database."""
+
+    def __init__(self, path=PROFILE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _bump_generation(conn):
+        conn.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+
+    def generation(self):
+        """Return a counter that changes whenever a profile is saved or deleted."""
+        with self._connect() as conn:
+            return conn.execute("SELECT value FROM generation WHERE id = 0").fetchone()[0]
+
+    @staticmethod
+    def _profile(row):
+        profile = dict(row)
+        for field in ("headers", "analyte_columns", "analyte_names"):
+            profile[field] = json.loads(profile[field])
+        return profile
+
+    def lookup(self, columns):
+        """Return the profile for this header row, mapped onto its columns.
+
+        The saved column names are matched to ``columns`` by their
+        normalized form, so the result names the columns exactly as they
+        appear in this workbook. Returns None for an unknown layout. Each
+        hit is counted in the profile's ``uses``.
+        """
+        signature = header_signature(columns)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM profiles WHERE signature = ?", (signature,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE profiles SET uses = uses + 1, last_used = ? WHERE signature = ?",
+                (time.time(), signature),
+            )
+        profile = self._profile(row)
+        actual = {normalize_header(c): c for c in columns}
+        try:
+            profile["sample_column"] = actual[normalize_header(profile["sample_column"])]
+            names = profile["analyte_names"]
+            profile["analyte_columns"] = [
+                actual[normalize_header(c)] for c in profile["analyte_columns"]
+            ]
+            profile["analyte_names"] = {
+                actual[normalize_header(c)]: name for c, name in names.items()
+            }
+        except KeyError:
+            # Only possible with duplicate names that normalize alike
+            return None
+        return profile
+
+    def save(self, columns, sample_column, analyte_columns, analyte_names=None, name=None):
+        """Save (or replace) the profile for this header row; return its signature.
+
+        Raises ValueError if a mapped column is not in ``columns``.
+        """
+        known = {normalize_header(c) for c in columns}
+        analyte_names = {
+            column: portal_name.strip()
+            for column, portal_name in (analyte_names or {}).items()
+            if portal_name and portal_name.strip() and portal_name.strip() != column
+        }
+        for column in (sample_column, *analyte_columns, *analyte_names):
+            if normalize_header(column) not in known:
+                raise ValueError(f"Column {column!r} is not in the header row")
+        if not analyte_columns:
+            raise ValueError("A profile needs at least one analyte column")
+        signature = header_signature(columns)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO profiles (signature, name, headers, sample_column, analyte_columns,"
+                " analyte_names, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (signature) DO UPDATE SET name = excluded.name,"
+                " headers = excluded.headers, sample_column = excluded.sample_column,"
+                " analyte_columns = excluded.analyte_columns,"
+                " analyte_names = excluded.analyte_names, updated = excluded.updated",
+                (signature, name or f"Layout {signature[:8]}", json.dumps([str(c) for c in columns]),
+                 sample_column, json.dumps(list(analyte_columns)), json.dumps(analyte_names),
+                 now, now),
+            )
+            self._bump_generation(conn)
+        return signature
+
+    def get(self, signature):
+        """Return a profile by signature, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM profiles WHERE signature = ?", (signature,)
+            ).fetchone()
+        return self._profile(row) if row is not None else None
+
+    def list(self):
+        """Return every profile, most used first."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM profiles ORDER BY uses DESC, name").fetchall()
+        return [self._profile(row) for row in rows]
+
+    def delete(self, signature):
+        """Delete a profile; return True if it existed."""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM profiles WHERE signature = ?", (signature,))
+            if cursor.rowcount:
+                self._bump_generation(conn)
+        return cursor.rowcount > 0
@@ -0,0 +1,310 @@
+"""
+Compact long-format results: the specimen/analyte/value cells to enter.
+
+A workbook is wide -- one row per specimen, one column per analyte, plus
+units, qualifiers and whatever else the export carries -- but only its
+non-blank analyte cells are ever entered on the portal. A ``ResultSet``
+holds just those cells as parallel arrays:
+
+  * ``specimens``      -- the distinct specimen ids with results, in
+                          workbook order
+  * ``analytes``       -- the distinct analyte names (the portal name where
+                          a column-mapping profile gives one), interned
+  * ``specimen_index`` -- per result, its position in ``specimens``
+  * ``analyte_index``  -- per result, its position in ``analytes``
+  * ``numbers``        -- per result, the value as float64 (0 for text)
+  * ``kinds``          -- per result, ``FLOAT``, ``INT`` or ``TEXT``
+  * ``text``           -- the values of the ``TEXT`` results, in order
+
+Results are ordered by specimen, then analyte, so each specimen's results
+are one contiguous slice. Numbers are kept as numbers: a typical numeric
+result costs 9 bytes rather than a fixed-width unicode string several times
+its length, and only cells that are not plain numbers (``"<5.0"``, dates,
+integers too large for a float) are kept as text. ``iter_specimens``
+converts values to the text the automator types (``str(value)``, which
+NumPy's formatting of float64 matches) one chunk at a time. A specimen
+listed on several rows is merged, the later row winning for an analyte
+both give -- the same outcome as typing the rows in turn. Rows without a
+specimen id and specimens without any value are left out.
+
+``upload.analyze_data`` builds the set from the blank masks of its quality
+checks, the store keeps it as ``res_<n>.npy`` arrays instead of the
+workbook's columns, and the automator reads it one specimen at a time, so
+memory per upload scales with the number of results rather than rows x
+columns.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+FIELDS = ("specimens", "analytes", "specimen_index", "analyte_index", "numbers", "kinds", "text")
+
+# Values of ``kinds``
+FLOAT = 0
+INT = 1
+TEXT = 2
+
+# Integers beyond this lose precision as float64 and are kept as text
+MAX_EXACT_INT = 2 ** 53
+
+# Cell types stored as numbers when read from object columns
+FLOAT_TYPES = frozenset((float, np.float64))
+INT_TYPES = frozenset((int, np.int64))
+
+# Results converted to Python objects at a time by iter_specimens
+CHUNK_SIZE = 8192
+
+
+def _series(values):
+    """Return ``values`` as a Series with a default integer index."""
+    if isinstance(values, pd.Series):
+        # A new Series over the same array: pandas would otherwise deep-copy
+        # the frame's attrs into every Series derived from the column
+        return pd.Series(values.array, copy=False)
+    if isinstance(values, list):
+        # np.asarray would coerce a mixed list to one type
+        return pd.Series(values, dtype=object)
+    return pd.Series(np.asarray(values))
+
+
+def _text(series):
+    """Return the cells of ``series`` as a unicode array of ``str(value)``."""
+    return series.astype(str).to_numpy(dtype=str)
+
+
+def _has_type(values, types):
+    """Return a boolean array, True where ``type(value)`` is one of ``types``."""
+    return np.fromiter(map(types.__contains__, map(type, values)), bool, len(values))
+
+
+def _encode(series):
+    """Return ``(numbers, kinds, text)`` for the cells of ``series``.
+
+    float64 and integer columns are converted as whole arrays and other
+    NumPy dtypes are kept as text. In object columns (mixed workbook
+    columns) each cell's type decides: whatever is not a float64 or an
+    exact integer is kept as ``str(value)``.
+    """
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype == np.float64:
+        return series.to_numpy(), np.full(len(series), FLOAT, dtype=np.uint8), _text(series[:0])
+    if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+        values = series.to_numpy()
+        kinds = np.where(np.abs(values.astype(np.float64)) > MAX_EXACT_INT, TEXT, INT).astype(np.uint8)
+        numbers = np.where(kinds == INT, values, 0).astype(np.float64)
+        return numbers, kinds, _text(series[kinds == TEXT])
+    if isinstance(dtype, np.dtype) and dtype != object:
+        # float32, bool, datetime64 ...: str() of the column's own scalars
+        return (np.zeros(len(series), dtype=np.float64),
+                np.full(len(series), TEXT, dtype=np.uint8), _text(series))
+    values = series.to_numpy(dtype=object)
+    is_float = _has_type(values, FLOAT_TYPES)
+    is_int = _has_type(values, INT_TYPES)
+    numbers = np.zeros(len(values), dtype=np.float64)
+    numbers[is_float] = values[is_float].astype(np.float64)
+    if is_int.any():
+        ints = values[is_int]
+        exact = np.fromiter((-MAX_EXACT_INT <= v <= MAX_EXACT_INT for v in ints), bool, len(ints))
+        is_int[np.flatnonzero(is_int)[~exact]] = False
+        numbers[is_int] = values[is_int].astype(np.float64)
+    kinds = np.full(len(values), TEXT, dtype=np.uint8)
+    kinds[is_float] = FLOAT
+    kinds[is_int] = INT
+    return numbers, kinds, _text(series[kinds == TEXT])
+
+
+def present_mask(values):
+    """Return a boolean array, True for cells that are neither NaN/None nor blank text."""
+    series = _series(values)
+    present = series.notna().to_numpy(copy=True)
+    if pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return present
+    # Numbers are never blank, so only the other cells need their text checked
+    numeric = _has_type(series.to_numpy(dtype=object), FLOAT_TYPES | INT_TYPES)
+    rows = np.flatnonzero(present & ~numeric)
+    present[rows] = series.iloc[rows].astype(str).str.strip().ne("").to_numpy()
+    return present
+
+
+def _index_array(positions, size):
+    """Return ``positions`` in the smallest unsigned dtype that holds ``size``."""
+    return np.asarray(positions).astype(np.min_scalar_type(max(size - 1, 0)))
+
+
+class ResultSet:
+    """Specimen/analyte/value results as parallel arrays (see module docstring)."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, specimens, analytes, specimen_index, analyte_index, numbers, kinds, text):
+        self.specimens = specimens
+        self.analytes = tuple(sys.intern(str(analyte)) for analyte in analytes)
+        self.specimen_index = specimen_index
+        self.analyte_index = analyte_index
+        self.numbers = numbers
+        self.kinds = kinds
+        self.text = text
+
+    @classmethod
+    def empty(cls):
+        return cls(np.array([], dtype=str), (), np.array([], dtype=np.uint8),
+                   np.array([], dtype=np.uint8), np.array([], dtype=np.float64),
+                   np.array([], dtype=np.uint8), np.array([], dtype=str))
+
+    @classmethod
+    def from_columns(cls, columns, sample_column, analyte_columns, analyte_names=None,
+                     present=None):
+        """Build the results of a wide table.
+
+        ``columns`` maps column names to values: a DataFrame, the store's
+        column reader or a dict of lists. ``analyte_names`` gives portal
+        names for analyte columns; ``present`` may give the non-blank mask
+        of each analyte column when the caller has already computed it.
+        """
+        if sample_column is None or sample_column not in columns or not analyte_columns:
+            return cls.empty()
+        analyte_names = analyte_names or {}
+        present = present or {}
+        sample = _series(columns[sample_column])
+        has_specimen = present_mask(sample)
+        codes = np.full(len(sample), -1, dtype=np.int64)
+        specimen_codes, specimen_ids = pd.factorize(_text(sample[has_specimen]))
+        codes[has_specimen] = specimen_codes
+
+        names = list(dict.fromkeys(analyte_names.get(c, c) for c in analyte_columns))
+        rows, analytes, numbers, kinds, text = [], [], [], [], []
+        for column in analyte_columns:
+            series = _series(columns[column])
+            mask = present.get(column)
+            mask = present_mask(series) if mask is None else np.asarray(mask)
+            column_rows = np.flatnonzero(mask & has_specimen)
+            rows.append(column_rows)
+            analytes.append(np.full(len(column_rows), names.index(analyte_names.get(column, column))))
+            column_numbers, column_kinds, column_text = _encode(series.iloc[column_rows])
+            numbers.append(column_numbers)
+            kinds.append(column_kinds)
+            text.append(column_text)
+        rows = np.concatenate(rows)
+        if not len(rows):
+            return cls.empty()
+        analytes = np.concatenate(analytes)
+        specimen_codes = codes[rows]
+        numbers = np.concatenate(numbers)
+        kinds = np.concatenate(kinds)
+        text = np.concatenate(text)
+        # Position of each TEXT result's value in ``text``, to reorder it below
+        text_rank = np.full(len(kinds), -1, dtype=np.int64)
+        text_rank[kinds == TEXT] = np.arange(len(text))
+
+        # By specimen, then analyte, then row; the last row of each
+        # (specimen, analyte) pair is the one kept. Rows are concatenated
+        # column by column, so with unique specimen ids a stable sort by
+        # specimen alone gives that order.
+        duplicates = (len(specimen_ids) < has_specimen.sum()
+                      or len(names) < len(analyte_columns))
+        if duplicates:
+            order = np.lexsort((rows, analytes, specimen_codes))
+        else:
+            order = np.argsort(specimen_codes, kind="stable")
+        specimen_codes, analytes = specimen_codes[order], analytes[order]
+        numbers, kinds, text_rank = numbers[order], kinds[order], text_rank[order]
+        if duplicates:
+            keep = np.ones(len(order), dtype=bool)
+            keep[:-1] = (specimen_codes[1:] != specimen_codes[:-1]) | (analytes[1:] != analytes[:-1])
+            specimen_codes, analytes = specimen_codes[keep], analytes[keep]
+            numbers, kinds, text_rank = numbers[keep], kinds[keep], text_rank[keep]
+
+        # factorize numbers specimens in workbook order, so np.unique keeps it
+        used, specimen_index = np.unique(specimen_codes, return_inverse=True)
+        return cls(
+            np.asarray(specimen_ids, dtype=str)[used],
+            names,
+            _index_array(specimen_index, len(used)),
+            _index_array(analytes, len(names)),
+            numbers,
+            kinds,
+            text[text_rank[kinds == TEXT]],
+        )
+
+    @classmethod
+    def from_records(cls, records, sample_column, analyte_columns, analyte_names=None):
+        """Build the results of a list of row dicts."""
+        columns = {
+            column: [record.get(column) for record in records]
+            for column in (sample_column, *analyte_columns)
+        }
+        return cls.from_columns(columns, sample_column, analyte_columns, analyte_names)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a set from the mapping written by ``arrays`` (e.g. memory-mapped)."""
+        return cls(arrays["specimens"], np.asarray(arrays["analytes"]).tolist(),
+                   arrays["specimen_index"], arrays["analyte_index"], arrays["numbers"],
+                   arrays["kinds"], arrays["text"])
+
+    def arrays(self):
+        """Return ``{field: array}`` for storage; nothing needs pickling."""
+        return {
+            "specimens": np.asarray(self.specimens, dtype=str),
+            "analytes": np.asarray(self.analytes, dtype=str),
+            "specimen_index": np.asarray(self.specimen_index),
+            "analyte_index": np.asarray(self.analyte_index),
+            "numbers": np.asarray(self.numbers, dtype=np.float64),
+            "kinds": np.asarray(self.kinds, dtype=np.uint8),
+            "text": np.asarray(self.text, dtype=str),
+        }
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def specimen_count(self):
+        return len(self.specimens)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arrays (the interned names are not counted)."""
+        return sum(np.asarray(getattr(self, field)).nbytes for field in FIELDS if field != "analytes")
+
+    def _values(self, begin, end, text_start):
+        """Return the results ``begin:end`` as the text to enter (a list of str)."""
+        kinds = np.asarray(self.kinds[begin:end])
+        numbers = np.asarray(self.numbers[begin:end])
+        values = np.empty(end - begin, dtype=object)
+        floats = kinds == FLOAT
+        values[floats] = numbers[floats].astype(str).tolist()
+        ints = kinds == INT
+        values[ints] = numbers[ints].astype(np.int64).astype(str).tolist()
+        texts = np.flatnonzero(kinds == TEXT)
+        values[texts] = self.text[text_start:text_start + len(texts)].tolist()
+        return values.tolist(), text_start + len(texts)
+
+    def iter_specimens(self):
+        """Yield ``(specimen_id, {analyte: value})`` for each specimen, in order.
+
+        Results are converted to text ``CHUNK_SIZE`` at a time (whole
+        specimens per chunk), so iterating a large set does not materialise
+        it all at once.
+        """
+        index = np.asarray(self.specimen_index)
+        if not len(index):
+            return
+        starts = np.flatnonzero(np.concatenate(([True], index[1:] != index[:-1])))
+        bounds = np.append(starts, len(index))
+        analytes = np.array(self.analytes, dtype=object)
+        first = 0
+        text_start = 0
+        while first < len(starts):
+            # Whole specimens, at least one, up to CHUNK_SIZE results
+            last = max(first + 1, np.searchsorted(bounds, bounds[first] + CHUNK_SIZE, "right") - 1)
+            begin, end = int(bounds[first]), int(bounds[last])
+            # Analyte names are shared references, not copies
+            names = analytes[self.analyte_index[begin:end]].tolist()
+            values, text_start = self._values(begin, end, text_start)
+            specimens = self.specimens[index[starts[first:last]]].tolist()
+            offsets = (bounds[first:last + 1] - begin).tolist()
+            for specimen_id, start, stop in zip(specimens, offsets, offsets[1:]):
+                yield specimen_id, dict(zip(names[start:stop], values[start:stop]))
+            first = last
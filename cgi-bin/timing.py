@@ -0,0 +1,152 @@
+"""
+Per-stage timing of requests and automation runs.
+
+Code marks a hot-path stage with ``stage(name)``, as a context manager or
+decorator. Each measurement goes to two places:
+
+  * the timings of the request being handled, if ``request_timings()`` is
+    active, which the server sends back as a ``Server-Timing`` header
+  * a process-wide latency histogram per stage (``metrics``), served by the
+    long-lived server at ``/metrics`` and by the worker with
+    ``--metrics-port``
+
+Stage names are dotted, e.g. ``upload.parse`` or ``automation.login``.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Histogram bucket upper bounds in seconds (plus an implicit +Inf)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_current = ContextVar("cap_request_timings", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus style)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Metrics:
+    """Thread-safe set of per-stage histograms."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Return ``{stage: {count, sum, buckets}}`` for every stage seen."""
+        with self._lock:
+            return {name: h.snapshot() for name, h in sorted(self._histograms.items())}
+
+    def render_prometheus(self):
+        """Return the histograms in the Prometheus text exposition format."""
+        lines = [
+            "# HELP cap_stage_seconds Time spent in each request/automation stage.",
+            "# TYPE cap_stage_seconds histogram",
+        ]
+        for name, data in self.snapshot().items():
+            for bound, count in data["buckets"]:
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f'cap_stage_seconds_bucket{{stage="{name}",le="{le}"}} {count}')
+            lines.append(f'cap_stage_seconds_sum{{stage="{name}"}} {data["sum"]:.6f}')
+            lines.append(f'cap_stage_seconds_count{{stage="{name}"}} {data["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every request handled in this process
+metrics = Metrics()
+
+
+class RequestTimings:
+    """Stage durations recorded while handling one request."""
+
+    def __init__(self):
+        self.stages = []
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def server_timing(self):
+        """Return the ``Server-Timing`` header value (durations in ms).
+
+        Repeated stages (e.g. one per specimen) are summed into one entry.
+        """
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+@contextmanager
+def request_timings():
+    """Collect the stages timed inside this block; yields ``RequestTimings``."""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record(name, seconds):
+    """Record an already measured duration for ``name``."""
+    metrics.observe(name, seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+class stage:
+    """Time a block or function as stage ``name``.
+
+    Usable as ``with stage("upload.parse"):`` or as ``@stage("...")``.
+    The duration is recorded even if the block raises.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(self.name):
+                return func(*args, **kwargs)
+        return wrapper
@@ -6,7 +6,8 @@ The script uses the `pandas` library to read the uploaded Excel file and attempt
 to automatically detect the column containing specimen/sample identifiers and
 columns containing analyte values. Columns with names containing
 "unit", "qualifier" or "unnamed" (case-insensitive) are ignored when
-inferring analyte columns.
+inferring analyte columns. Workbooks whose header row matches a saved
+column-mapping profile (see ``profiles``) use that mapping instead.
 
 The script outputs a simple HTML page showing:
   * Total record count (rows)
@@ -16,34 +17,58 @@ The script outputs a simple HTML page showing:
   * Warnings for missing or non‑numeric values
   * Duplicate specimen/analyte combinations
 
+Issues are grouped by type and analyte with a few examples each (see
+``issue_report``); the full list is stored with the upload and paged
+through with ``issues.py``.
+
 After reviewing the summary, the user can enter a kit number and proceed to
-the automation step. The Excel data is stored on the server in a temporary
-file referenced by a generated key so that subsequent steps can access it
-without persisting logs to disk. The data file is removed when the Python
-process ends (e.g. after the session completes).
+the automation step. The results to enter are stored on the server in a
+temporary store entry (see ``datastore``) referenced by a generated key so
+that subsequent steps can read just the arrays they need without
+persisting logs to disk. Entries expire after a configurable time and the
+store is capped in size, with the least recently used entries evicted
+first.
 """
 
-import cgi
 import html
 import cgitb
-import json
-import os
-import sys
-import tempfile
+import logging
+import re
+from collections import Counter
 from io import BytesIO
 
+import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
+
+from datastore import store
+from intake import UploadFieldStorage, UploadTooLarge, upload_size
+from issue_report import group_issues, issues_frame, render_issue_groups
+from parse_cache import content_hash, parse_cache
+from profiles import ProfileStore, header_signature
+from results import ResultSet
+from timing import request_timings, stage
 
-# enable debugging
-cgitb.enable()
+logger = logging.getLogger(__name__)
+
+# Words of a column name: "PatientID" -> Patient, ID; "Lipid Panel" -> Lipid, Panel
+_WORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
 
 
 def guess_sample_column(columns):
-    """Attempt to identify the sample/specimen identifier column."""
-    lower = [c.lower() for c in columns]
-    for i, name in enumerate(lower):
-        if any(k in name for k in ("sample", "specimen", "id")):
-            return columns[i]
+    """Attempt to identify the sample/specimen identifier column.
+
+    A column naming a sample or specimen wins; failing that, one with "ID"
+    as a word of its own (``Patient ID``, ``AccessionID``), not just the
+    letters, which also occur in names like ``Lipid`` or ``Triglycerides``.
+    """
+    for col in columns:
+        lower = str(col).lower()
+        if "sample" in lower or "specimen" in lower:
+            return col
+    for col in columns:
+        if "id" in (word.lower() for word in _WORD_RE.findall(str(col))):
+            return col
     # fallback to first column
     return columns[0] if columns else None
 
@@ -61,124 +86,391 @@ def guess_analyte_columns(columns, sample_col):
     return analytes
 
 
-def parse_excel(file_bytes):
-    """Read the uploaded Excel file into a pandas DataFrame."""
+def infer_columns(columns):
+    """Return ``(sample_col, analyte_cols)`` inferred from a header row."""
+    sample_col = guess_sample_column(columns)
+    return sample_col, guess_analyte_columns(columns, sample_col)
+
+
+_profile_store = None
+
+
+def _profiles():
+    global _profile_store
+    if _profile_store is None:
+        _profile_store = ProfileStore()
+    return _profile_store
+
+
+def find_profile(columns):
+    """Return the saved profile for this header row, or None.
+
+    A profile database that cannot be opened is logged and treated as
+    empty, so uploads fall back to inference.
+    """
+    try:
+        return _profiles().lookup(columns)
+    except Exception:
+        logger.exception("Could not read column-mapping profiles")
+        return None
+
+
+def profile_generation():
+    """Return the profile store's generation, or None if it cannot be read."""
+    try:
+        return _profiles().generation()
+    except Exception:
+        logger.exception("Could not read column-mapping profiles")
+        return None
+
+
+def resolve_columns(columns):
+    """Return the column mapping for a header row, as ``DataFrame.attrs``.
+
+    Known layouts map straight to their saved profile; anything else is
+    inferred with ``infer_columns``.
+    """
+    profile = find_profile(columns)
+    if profile is not None:
+        sample_col = profile["sample_column"]
+        analyte_cols = profile["analyte_columns"]
+    else:
+        sample_col, analyte_cols = infer_columns(columns)
+    return {
+        "headers": [str(c) for c in columns],
+        "header_signature": header_signature(columns),
+        "sample_column": sample_col,
+        "analyte_columns": analyte_cols,
+        "analyte_names": profile["analyte_names"] if profile else {},
+        "profile": profile["name"] if profile else None,
+    }
+
+
+def column_mapping(df):
+    """Return ``(sample_col, analyte_cols)`` of a parsed sheet.
+
+    Uses the mapping ``parse_excel`` recorded in ``df.attrs``, inferring
+    one for frames that have none.
+    """
+    if "sample_column" in df.attrs:
+        return df.attrs["sample_column"], df.attrs["analyte_columns"]
+    return infer_columns(list(df.columns))
+
+
+# python-calamine is an optional, much faster reader for both .xlsx and .xls;
+# pandas supports it as an engine from 2.2 onwards.
+try:
+    import python_calamine  # noqa: F401
+    HAVE_CALAMINE = tuple(int(part) for part in pd.__version__.split(".")[:2]) >= (2, 2)
+except ImportError:
+    HAVE_CALAMINE = False
+
+XLSX_MAGIC = b"PK\x03\x04"
+XLS_MAGIC = b"\xd0\xcf\x11\xe0"
+
+
+def _excel_engine(source):
+    """Choose the fastest available pandas engine for the workbook format."""
+    if HAVE_CALAMINE:
+        return "calamine"
+    if hasattr(source, "read"):
+        magic = source.read(4)
+        source.seek(0)
+    else:
+        with open(source, "rb") as f:
+            magic = f.read(4)
+    if magic == XLSX_MAGIC:
+        # Read by _read_xlsx with a read-only, streaming openpyxl workbook
+        return "openpyxl"
+    if magic == XLS_MAGIC:
+        return "xlrd"
+    # let pandas decide (e.g. .ods)
+    return None
+
+
+def _pandas_row(values):
+    """Convert openpyxl cell values the way pandas' openpyxl reader does.
+
+    Blank cells become ``""``, whole floats become ints and error cells
+    (which ``values_only`` gives as their ``#N/A``-style text) become NaN.
+    """
+    from openpyxl.cell.cell import ERROR_CODES
+
+    row = []
+    for value in values:
+        if value is None:
+            value = ""
+        elif type(value) is float:
+            if value.is_integer():
+                value = int(value)
+        elif type(value) is str and value in ERROR_CODES:
+            value = np.nan
+        row.append(value)
+    return row
+
+
+def _read_xlsx(source):
+    """Read the first sheet of an .xlsx keeping only its mapped columns.
+
+    One read-only openpyxl pass: the header row is resolved to the sample
+    and analyte columns, then only those cells of each row are converted
+    and handed to pandas' own parser, so the frame matches what
+    ``read_excel(usecols=...)`` returns. openpyxl still parses every cell
+    of the sheet XML; what is skipped is pandas' per-cell work on the other
+    columns. Returns ``(df, mapping)``, with no mapping for an empty header.
+    """
+    from openpyxl import load_workbook
+
+    book = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = book.worksheets[0]
+        # As pandas does: the stored dimensions may be wrong
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = _pandas_row(next(rows, ()))
+        while header and header[-1] == "":
+            header.pop()
+        if not header:
+            return pd.DataFrame(), None
+        columns = list(TextParser([header], header=0, skip_blank_lines=False).read().columns)
+        mapping = resolve_columns(columns)
+        wanted = {mapping["sample_column"], *mapping["analyte_columns"]}
+        usecols = [i for i, col in enumerate(columns) if col in wanted]
+        data = []
+        last_with_data = -1
+        for number, row in enumerate(rows):
+            width = len(row)
+            picked = _pandas_row([row[i] if i < width else None for i in usecols])
+            # Trailing blank rows are dropped, judged on the whole row
+            if (any(value != "" for value in picked)
+                    or any(value is not None and value != "" for value in row)):
+                last_with_data = number
+            data.append(picked)
+    finally:
+        book.close()
+    del data[last_with_data + 1:]
+    names = [columns[i] for i in usecols]
+    df = TextParser(data, names=names, header=None, skip_blank_lines=False).read()
+    return df, mapping
+
+
+def parse_excel(source):
+    """Read the uploaded Excel file into a pandas DataFrame.
+
+    ``source`` is a path or a seekable binary file object (such as the
+    spooled upload from ``intake``); raw bytes are still accepted.
+
+    The header row is read first to find the sample and analyte columns
+    (from a saved profile, or inferred), and only those columns are
+    loaded; unit, qualifier and unnamed columns are never converted. With
+    calamine (or xlrd for ``.xls``) that is ``read_excel(usecols=...)``
+    after a header-only read. Without calamine, ``.xlsx`` files are read in
+    one openpyxl pass (see ``_read_xlsx``); openpyxl still parses the XML
+    of every cell, so on wide sheets this saves a fraction of the parse
+    time, not most of it. The mapping is kept in ``df.attrs`` (see
+    ``resolve_columns``).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
     try:
-        df = pd.read_excel(BytesIO(file_bytes))
+        engine = _excel_engine(source)
+        if engine == "openpyxl":
+            df, mapping = _read_xlsx(source)
+            if mapping is None:
+                return df
+        else:
+            header = pd.read_excel(source, nrows=0, engine=engine)
+            columns = list(header.columns)
+            if not columns:
+                return header
+            mapping = resolve_columns(columns)
+            wanted = {mapping["sample_column"], *mapping["analyte_columns"]}
+            usecols = [i for i, col in enumerate(columns) if col in wanted]
+            if hasattr(source, "seek"):
+                source.seek(0)
+            df = pd.read_excel(source, usecols=usecols, engine=engine)
     except Exception as exc:
         raise RuntimeError(f"Failed to parse Excel file: {exc}") from exc
+    df.attrs.update(mapping)
     return df
 
 
+def _parses_as_float(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _classify_cells(values):
+    """Return ``(missing, non_numeric)`` boolean arrays for one column.
+
+    Follows the per-cell rules of the quality checks: NaN/None and blank
+    strings are missing, and any other cell that
+    ``float(str(value).strip())`` rejects is non-numeric.
+    """
+    missing = values.isna().to_numpy(copy=True)
+    non_numeric = np.zeros(len(values), dtype=bool)
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return missing, ~missing
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return missing, non_numeric
+    unresolved = ~missing & pd.to_numeric(values, errors="coerce").isna().to_numpy()
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind == "boolean" or kind.startswith("mixed"):
+        # to_numeric turns True/False into 1/0, but float("True") fails
+        unresolved |= ~missing & values.map(type).eq(bool).to_numpy()
+    rows = np.flatnonzero(unresolved)
+    if not len(rows):
+        return missing, non_numeric
+    # Only the cells pandas could not convert are examined as stripped text
+    text = values.iloc[rows].astype(str).str.strip()
+    blank = text.eq("").to_numpy()
+    missing[rows[blank]] = True
+    rows, text = rows[~blank], text[~blank]
+    # to_numeric rejects a few spellings float() accepts ("nan", "1_000"),
+    # so the distinct leftovers are confirmed with float() itself
+    leftover = pd.to_numeric(text, errors="coerce").isna().to_numpy()
+    rows, text = rows[leftover], text[leftover]
+    rejected = [v for v in text.unique() if not _parses_as_float(v)]
+    non_numeric[rows[text.isin(rejected).to_numpy()]] = True
+    return missing, non_numeric
+
+
 def analyze_data(df):
-    """Compute summary statistics and data quality issues."""
-    columns = list(df.columns)
-    sample_col = guess_sample_column(columns)
-    analyte_cols = guess_analyte_columns(columns, sample_col)
+    """Compute summary statistics, data quality issues and the results to enter.
+
+    Each analyte column is checked with whole-column operations; Python
+    only touches the cells that are actually reported as issues. The
+    non-blank analyte cells are returned as a ``ResultSet``, built from the
+    same blank masks.
+    """
+    sample_col, analyte_cols = column_mapping(df)
 
     summary = {
         "total_records": len(df),
         "analytes_found": len(analyte_cols),
         "specimens": df[sample_col].nunique() if sample_col in df else 0,
         "analyte_list": analyte_cols,
+        "sample_column": sample_col,
+        "column_profile": df.attrs.get("profile"),
     }
 
     issues = []
-    # Track duplicates by (specimen, analyte)
-    duplicates = {}
+    # Duplicate (specimen, analyte) pairs are reported after all cell issues
+    duplicates = []
+    present = {}
     for analyte in analyte_cols:
-        for idx, value in df[[sample_col, analyte]].itertuples(index=False):
-            specimen = idx
-            val = value
-            key = (specimen, analyte)
-            # Check missing
-            if pd.isna(val) or (isinstance(val, str) and val.strip() == ""):
-                issues.append({
-                    "type": "missing",
-                    "specimen": specimen,
-                    "analyte": analyte,
-                    "value": val,
-                })
-                continue
-            # Check non-numeric
-            try:
-                float(str(val).strip())
-            except Exception:
-                issues.append({
-                    "type": "non_numeric",
-                    "specimen": specimen,
-                    "analyte": analyte,
-                    "value": val,
-                })
-                continue
-            # Check duplicates
-            if key in duplicates:
-                duplicates[key] += 1
-            else:
-                duplicates[key] = 1
-    # Add duplicate issues
-    for (specimen, analyte), count in duplicates.items():
-        if count > 1:
+        specimens = df[sample_col]
+        values = df[analyte]
+        missing, non_numeric = _classify_cells(values)
+        flagged = missing | non_numeric
+        present[analyte] = ~missing
+
+        rows = np.flatnonzero(flagged)
+        for is_missing, specimen, val in zip(
+            missing[rows],
+            specimens.iloc[rows].tolist(),
+            values.iloc[rows].tolist(),
+        ):
             issues.append({
+                "type": "missing" if is_missing else "non_numeric",
+                "specimen": specimen,
+                "analyte": analyte,
+                "value": val,
+            })
+
+        # Check duplicates among the remaining numeric values
+        numeric_specimens = specimens[~flagged]
+        repeated = numeric_specimens[numeric_specimens.duplicated(keep=False)]
+        if repeated.empty:
+            continue
+        # dropna=False: a repeated blank specimen id is a duplicate too, and
+        # is reported as it appears in the sheet rather than as NaN
+        counts = repeated.groupby(repeated, sort=False, dropna=False).size()
+        blank = repeated[repeated.isna()]
+        keys = [blank.iloc[0] if pd.isna(key) else key for key in counts.index.tolist()]
+        for specimen, count in zip(keys, counts.tolist()):
+            duplicates.append({
                 "type": "duplicate",
                 "specimen": specimen,
                 "analyte": analyte,
                 "count": count,
             })
+    issues.extend(duplicates)
+
+    results = ResultSet.from_columns(df, sample_col, analyte_cols,
+                                     df.attrs.get("analyte_names"), present)
+    return summary, issues, sample_col, analyte_cols, results
+
+
+def build_summary_index(df, summary, issues, sample_col, analyte_cols, content_hash=None,
+                        results=None):
+    """Return the small summary sidecar stored next to each data entry."""
+    return {
+        "record_count": len(df),
+        "result_count": len(results) if results is not None else None,
+        "result_specimen_count": results.specimen_count if results is not None else None,
+        "specimen_count": summary["specimens"],
+        "analyte_count": len(analyte_cols),
+        "sample_column": sample_col,
+        "analyte_columns": analyte_cols,
+        "analyte_names": df.attrs.get("analyte_names", {}),
+        "columns": list(df.columns),
+        "headers": df.attrs.get("headers", [str(c) for c in df.columns]),
+        "header_signature": df.attrs.get("header_signature"),
+        "column_profile": df.attrs.get("profile"),
+        "issue_totals": dict(Counter(issue["type"] for issue in issues)),
+        "issue_groups": [
+            {"type": group["type"], "analyte": group["analyte"], "count": group["count"]}
+            for group in group_issues(issues, sample_size=0)
+        ],
+        "content_hash": content_hash,
+    }
 
-    return summary, issues, sample_col, analyte_cols
 
+def store_temp_data(df, sample_col, analyte_cols, summary, issues,
+                    content_hash=None, results=None, **extra):
+    """Persist the upload's results and return a key for later retrieval.
 
-def store_temp_data(data):
-    """Persist data in a temporary file and return a key for later retrieval."""
-    temp_dir = tempfile.gettempdir()
-    fd, path = tempfile.mkstemp(prefix="cap_data_", suffix=".json", dir=temp_dir)
-    os.close(fd)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f)
-    # Use filename as key
-    key = os.path.basename(path)
-    return key
+    Only the ``ResultSet`` (from ``analyze_data``, or built from ``df``) is
+    written, not the workbook's columns; ``extra`` fields (e.g. the kit
+    number) are stored alongside it, a summary index is written as a
+    sidecar for ``load_temp_summary``, and the issue list is kept for
+    ``load_temp_issues``.
+    """
+    analyte_names = df.attrs.get("analyte_names", {})
+    if results is None:
+        results = ResultSet.from_columns(df, sample_col, analyte_cols, analyte_names)
+    meta = dict(extra, sample_column=sample_col, analyte_columns=analyte_cols,
+                analyte_names=analyte_names, record_count=len(df))
+    index = build_summary_index(df, summary, issues, sample_col, analyte_cols, content_hash,
+                                results)
+    return store.put(meta, results, summary=index, issues=issues_frame(issues))
 
 
 def load_temp_data(key):
-    temp_dir = tempfile.gettempdir()
-    path = os.path.join(temp_dir, key)
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Data key {key} not found")
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
+    """Load stored data: the stored fields plus its ``results``.
 
+    The result arrays are memory-mapped, so only the pages the automator
+    reads are brought into memory. Raises FileNotFoundError for unknown or
+    expired keys.
+    """
+    return store.get(key)
 
-def main():
-    form = cgi.FieldStorage()
-    # If Excel file uploaded, parse and display summary
-    if "excel_file" in form:
-        file_item = form["excel_file"]
-        if not file_item.file:
-            print("Content-type: text/html\n")
-            print("<h1>No file uploaded</h1>")
-            return
-        file_bytes = file_item.file.read()
-        try:
-            df = parse_excel(file_bytes)
-        except Exception as exc:
-            print("Content-type: text/html\n")
-            # Escape error message using html.escape instead of the removed cgi.escape
-            print(f"<h1>Error reading Excel file</h1><p>{html.escape(str(exc))}</p>")
-            return
-        summary, issues, sample_col, analyte_cols = analyze_data(df)
-        # Store data for subsequent steps (encoded as JSON with data, sample_col, analytes)
-        data = {
-            "sample_column": sample_col,
-            "analyte_columns": analyte_cols,
-            "records": df.to_dict(orient="records"),
-        }
-        key = store_temp_data(data)
-        # Build HTML page
-        print("Content-type: text/html\n")
-        print("""
+
+def load_temp_summary(key):
+    """Load only the summary index of stored data (see build_summary_index)."""
+    return store.get_summary(key)
+
+
+def load_temp_issues(key):
+    """Load the stored issue list: a lazy mapping of field name to array."""
+    return store.get_issues(key)
+
+
+RESULTS_PAGE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -186,26 +478,30 @@ def main():
 <meta name="viewport" content="width=device-width, initial-scale=1.0">
 <title>Excel Analysis Results</title>
 <style>
-    body { font-family: Arial, sans-serif; background-color: #f5f9fc; margin: 0; padding: 0; }
-    header { background-color: #2f59a6; color: #fff; padding: 20px; }
-    h1 { margin: 0; font-size: 26px; }
-    main { max-width: 900px; margin: 0 auto; padding: 30px; }
-    .stats { display: flex; gap: 20px; margin-bottom: 20px; }
-    .stat-card { flex: 1; background: #fff; border-radius: 8px; padding: 20px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); text-align: center; }
-    .stat-card h3 { margin: 0; font-size: 18px; color: #6b7280; }
-    .stat-card p { font-size: 28px; margin: 10px 0 0; color: #111827; }
-    .analytes { margin-top: 20px; }
-    .analytes h3 { margin-bottom: 10px; }
-    .analytes .tag { display: inline-block; margin: 4px; padding: 6px 10px; background: #e5e7eb; border-radius: 6px; font-size: 14px; }
-    .issues { margin-top: 20px; }
-    .issues h3 { margin-bottom: 10px; }
-    .issue { background: #fff; border-left: 4px solid #f59e0b; padding: 10px 15px; margin-bottom: 8px; border-radius: 4px; }
-    .issue.non_numeric { border-left-color: #ef4444; }
-    .issue.duplicate { border-left-color: #6b7280; }
-    form { margin-top: 30px; background: #fff; padding: 20px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }
-    input[type="text"] { width: 100%; padding: 10px; margin-top: 5px; border-radius: 4px; border: 1px solid #d1d5db; }
-    button { margin-top: 15px; padding: 10px 20px; background-color: #2563eb; color: #fff; border: none; border-radius: 4px; cursor: pointer; }
-    button:hover { background-color: #1e40af; }
+    body {{ font-family: Arial, sans-serif; background-color: #f5f9fc; margin: 0; padding: 0; }}
+    header {{ background-color: #2f59a6; color: #fff; padding: 20px; }}
+    h1 {{ margin: 0; font-size: 26px; }}
+    main {{ max-width: 900px; margin: 0 auto; padding: 30px; }}
+    .stats {{ display: flex; gap: 20px; margin-bottom: 20px; }}
+    .stat-card {{ flex: 1; background: #fff; border-radius: 8px; padding: 20px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); text-align: center; }}
+    .stat-card h3 {{ margin: 0; font-size: 18px; color: #6b7280; }}
+    .stat-card p {{ font-size: 28px; margin: 10px 0 0; color: #111827; }}
+    .analytes {{ margin-top: 20px; }}
+    .analytes h3 {{ margin-bottom: 10px; }}
+    .mapping {{ color: #6b7280; font-size: 14px; }}
+    .analytes .tag {{ display: inline-block; margin: 4px; padding: 6px 10px; background: #e5e7eb; border-radius: 6px; font-size: 14px; }}
+    .issues {{ margin-top: 20px; }}
+    .issues h3 {{ margin-bottom: 10px; }}
+    .issue {{ background: #fff; border-left: 4px solid #f59e0b; padding: 10px 15px; margin-bottom: 8px; border-radius: 4px; }}
+    .issue.non_numeric {{ border-left-color: #ef4444; }}
+    .issue.duplicate {{ border-left-color: #6b7280; }}
+    .issue-group {{ margin-bottom: 10px; }}
+    .issue-group summary {{ cursor: pointer; padding: 6px 0; }}
+    .issue-more {{ margin: 4px 0 8px 15px; color: #6b7280; font-size: 14px; }}
+    form {{ margin-top: 30px; background: #fff; padding: 20px; border-radius: 8px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }}
+    input[type="text"] {{ width: 100%; padding: 10px; margin-top: 5px; border-radius: 4px; border: 1px solid #d1d5db; }}
+    button {{ margin-top: 15px; padding: 10px 20px; background-color: #2563eb; color: #fff; border: none; border-radius: 4px; cursor: pointer; }}
+    button:hover {{ background-color: #1e40af; }}
 </style>
 </head>
 <body>
@@ -230,6 +526,7 @@ def main():
     <div class="analytes">
         <h3>Detected Analytes</h3>
         {analyte_tags}
+        <p class="mapping">{mapping_html}</p>
     </div>
     <div class="issues">
         <h3>Data Quality Issues</h3>
@@ -244,27 +541,109 @@ def main():
 </main>
 </body>
 </html>
-""".format(
-            total_records=summary["total_records"],
-            analytes_found=summary["analytes_found"],
-            specimens=summary["specimens"],
-            analyte_tags="".join(
-                f'<span class="tag">{html.escape(a)}</span>' for a in summary["analyte_list"]
-            ),
-            issues_html="".join(
-                f'<div class="issue {issue["type"]}"><strong>{issue["type"].replace("_", " ").title()}</strong>: Specimen {html.escape(str(issue["specimen"]))}, Analyte {html.escape(issue["analyte"])}'
-                + (f', Value: {html.escape(str(issue.get("value", "")))}' if "value" in issue else '')
-                + (f', Count: {issue.get("count")}' if "count" in issue else '')
-                + '</div>'
-                for issue in issues
-            ) or '<p>No issues detected.</p>',
-            data_key=key
-        ))
+"""
+
+
+def render_mapping_note(summary, data_key):
+    """Say where the column mapping came from, linking to the profile editor."""
+    sample = html.escape(str(summary.get("sample_column")))
+    link = f'/cgi-bin/profile_editor.py?data_key={html.escape(data_key)}'
+    if summary.get("column_profile"):
+        return (f'Sample column {sample}; columns mapped with the saved profile '
+                f'<strong>{html.escape(summary["column_profile"])}</strong> '
+                f'(<a href="{link}">edit</a>).')
+    return (f'Sample column {sample}; columns inferred from the header row. '
+            f'<a href="{link}">Review and save this layout</a> to skip guessing next time.')
+
+
+def render_results_page(summary, issues, data_key):
+    """Render the analysis summary page shown after a successful upload."""
+    return RESULTS_PAGE.format(
+        total_records=summary["total_records"],
+        analytes_found=summary["analytes_found"],
+        specimens=summary["specimens"],
+        analyte_tags="".join(
+            f'<span class="tag">{html.escape(str(a))}</span>' for a in summary["analyte_list"]
+        ),
+        mapping_html=render_mapping_note(summary, data_key),
+        issues_html=render_issue_groups(group_issues(issues), data_key),
+        data_key=data_key
+    )
+
+
+class WorkbookError(ValueError):
+    """The uploaded file could not be read as an Excel workbook."""
+
+
+def process_upload(file_obj):
+    """Parse, analyse and store an uploaded workbook.
+
+    Returns ``(analysis, key)``: the ``CachedAnalysis`` of the workbook and
+    the store key of its data. Repeat uploads of the same workbook reuse
+    the earlier analysis while the saved profiles are unchanged. Raises
+    WorkbookError if it cannot be parsed.
+    """
+    with stage("upload.hash"):
+        digest = content_hash(file_obj)
+    # Read before parsing: a profile saved meanwhile then only makes the
+    # next upload parse again, never hides the new mapping
+    cache_key = f"{digest}:{profile_generation()}"
+    analysis = parse_cache.get(cache_key)
+    if analysis is None:
+        try:
+            # Parse straight from the spooled upload rather than a bytes copy
+            with stage("upload.parse"):
+                df = parse_excel(file_obj)
+        except Exception as exc:
+            raise WorkbookError(str(exc)) from exc
+        with stage("upload.analyze"):
+            summary, issues, sample_col, analyte_cols, results = analyze_data(df)
+        analysis = parse_cache.put(cache_key, df, summary, issues, sample_col, analyte_cols,
+                                   results)
+    # Store data for subsequent steps (columnar, with sample_col and analytes)
+    with stage("upload.store"):
+        key = store_temp_data(analysis.df, analysis.sample_col, analysis.analyte_cols,
+                              analysis.summary, analysis.issues, digest, analysis.results)
+    return analysis, key
+
+
+def handle_request(form):
+    """Process a submitted form and return the HTML response body.
+
+    This is shared by the CGI entry point below and the long-lived server
+    in ``server.py``, so it must not write to stdout itself.
+    """
+    # If Excel file uploaded, parse and display summary
+    if "excel_file" in form:
+        file_item = form["excel_file"]
+        if not file_item.file or not upload_size(file_item.file):
+            return "<h1>No file uploaded</h1>"
+        try:
+            analysis, key = process_upload(file_item.file)
+        except WorkbookError as exc:
+            # Escape error message using html.escape instead of the removed cgi.escape
+            return f"<h1>Error reading Excel file</h1><p>{html.escape(str(exc))}</p>"
+        with stage("upload.render"):
+            return render_results_page(analysis.summary, analysis.issues, key)
     # else if data_key provided and kit number: not handled here
-    else:
-        print("Content-type: text/html\n")
-        print("<h1>Invalid request</h1>")
+    return "<h1>Invalid request</h1>"
+
+
+def main():
+    # enable debugging
+    cgitb.enable()
+    with request_timings() as timings:
+        try:
+            with stage("upload.intake"):
+                form = UploadFieldStorage()
+        except UploadTooLarge as exc:
+            body = f"<h1>File too large</h1><p>{html.escape(str(exc))}</p>"
+        else:
+            body = handle_request(form)
+    print("Content-type: text/html")
+    print(f"Server-Timing: {timings.server_timing()}\n")
+    print(body)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
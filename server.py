@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Long-lived application server for the CAP Data Entry Automation app.
+
+Running the app under ``python3 -m http.server --cgi`` starts a fresh Python
+process for every request, so pandas (and selenium, via ``cap_automation``)
+is imported again before any work is done. This server imports the CGI
+modules once and serves the same routes from a fixed pool of worker threads,
+so several technicians can upload at once without paying a process start
+each time:
+
+  * ``/`` (``index.html``) and files under ``/static/`` -- nothing else in
+    the project directory (configuration, databases, sources) is served
+  * ``/cgi-bin/upload.py``     -- Excel upload and analysis
+  * ``/cgi-bin/automation.py`` -- kit number entry / automation job submission
+  * ``/cgi-bin/job_status.py``  -- automation job progress page
+  * ``/cgi-bin/issues.py``      -- paged full issue list of one upload
+  * ``/cgi-bin/profile_editor.py`` -- saved column-mapping profiles
+  * ``/status/store`` and ``/status/parse-cache`` -- JSON usage counters
+  * ``/status/entry?key=...`` -- JSON summary index of one stored upload
+  * ``/status/job?job_id=...`` -- JSON progress of one automation job
+  * ``/status/issues?data_key=...`` -- JSON page of one upload's issues
+  * ``/api/analyze`` and ``/api/issues`` -- JSON/NDJSON API (see ``api``)
+  * ``/metrics``              -- per-stage latency histograms (Prometheus
+                                 text; ``?format=json`` for JSON)
+
+Every response carries a ``Server-Timing`` header with the time spent in
+each stage of that request (see ``timing``).
+
+Automation jobs themselves run in a separate ``worker.py`` process.
+
+Usage::
+
+    python3 server.py [--host 127.0.0.1] [--port 8080] [--workers 8]
+
+The module also exposes ``application`` so it can be run under any WSGI
+server (e.g. ``gunicorn server:application``).
+"""
+
+import argparse
+import html
+import json
+import logging
+import mimetypes
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CGI_DIR = os.path.join(BASE_DIR, "cgi-bin")
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+INDEX_FILE = os.path.join(BASE_DIR, "index.html")
+
+# The CGI scripts import each other as top-level modules, exactly as they do
+# when launched by http.server, so cgi-bin has to come first on the path.
+sys.path.insert(0, CGI_DIR)
+
+import api  # noqa: E402
+import automation  # noqa: E402
+import issues  # noqa: E402
+import job_status  # noqa: E402
+import profile_editor  # noqa: E402
+import upload  # noqa: E402
+from datastore import store  # noqa: E402
+from intake import UploadFieldStorage, UploadTooLarge  # noqa: E402
+from parse_cache import parse_cache  # noqa: E402
+from timing import metrics, request_timings, stage  # noqa: E402
+
+try:
+    # Keep the selenium-backed automator loaded when its dependencies exist.
+    import cap_automation  # noqa: E402,F401
+except ImportError:
+    cap_automation = None
+
+DEFAULT_WORKERS = int(os.environ.get("CAP_SERVER_WORKERS", "8"))
+
+ROUTES = {
+    "/cgi-bin/upload.py": upload.handle_request,
+    "/cgi-bin/automation.py": automation.handle_request,
+    "/cgi-bin/job_status.py": job_status.handle_request,
+    "/cgi-bin/issues.py": issues.handle_request,
+    "/cgi-bin/profile_editor.py": profile_editor.handle_request,
+}
+
+# Machine-readable endpoints; each takes the parsed form and returns
+# ``(status, content_type, chunks)``, which may be streamed
+API_ROUTES = {
+    "/api/analyze": api.analyze_response,
+    "/api/issues": api.issues_response,
+}
+
+# JSON endpoints; each takes the parsed query string
+STATUS_ROUTES = {
+    "/status/store": lambda params: store.stats(),
+    "/status/parse-cache": lambda params: parse_cache.stats(),
+    "/status/entry": lambda params: upload.load_temp_summary(params.get("key", [""])[0]),
+    "/status/job": lambda params: job_status.job_payload(params.get("job_id", [""])[0]),
+    "/status/issues": issues.issues_payload,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_form(environ):
+    """Build the same form object the CGI scripts get, from a WSGI environ."""
+    return UploadFieldStorage(fp=environ["wsgi.input"], environ=environ)
+
+
+def _static_file(path):
+    """Return the file a static path maps to, or None if it is not servable.
+
+    Only ``index.html`` and files under ``static/`` are; the rest of the
+    project directory holds credentials (``cap_config.json``), databases
+    and sources.
+    """
+    if path in ("", "/", "/index.html"):
+        return INDEX_FILE
+    if not path.startswith("/static/"):
+        return None
+    full_path = os.path.realpath(os.path.join(STATIC_DIR, path[len("/static/"):]))
+    if not full_path.startswith(os.path.realpath(STATIC_DIR) + os.sep):
+        return None
+    return full_path
+
+
+def _serve_static(path):
+    """Serve ``index.html`` or a file under ``static/``; 404 for anything else."""
+    full_path = _static_file(path)
+    if full_path is None or not os.path.isfile(full_path):
+        return b"<h1>Not found</h1>", "404 Not Found", [("Content-Type", "text/html")]
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    with open(full_path, "rb") as f:
+        body = f.read()
+    return body, "200 OK", [
+        ("Content-Type", content_type),
+        ("Content-Length", str(len(body))),
+    ]
+
+
+def application(environ, start_response):
+    """WSGI entry point; adds a ``Server-Timing`` header to every response.
+
+    Streamed bodies are passed through as iterables; their timing covers
+    the work done before the first chunk.
+    """
+    path = environ.get("PATH_INFO", "/")
+    with request_timings() as timings:
+        with stage("request"):
+            body, status, headers = _dispatch(path, environ)
+    headers.append(("Server-Timing", timings.server_timing()))
+    start_response(status, headers)
+    return [body] if isinstance(body, bytes) else body
+
+
+def _metrics_response(params):
+    if params.get("format", [""])[0] == "json":
+        return json.dumps(metrics.snapshot()).encode("utf-8"), "application/json"
+    return metrics.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+
+
+def _dispatch(path, environ):
+    """Route a request; return ``(body, status, headers)``."""
+    if path == "/metrics":
+        body, content_type = _metrics_response(parse_qs(environ.get("QUERY_STRING", "")))
+        return body, "200 OK", [
+            ("Content-Type", content_type),
+            ("Content-Length", str(len(body))),
+        ]
+    if path in STATUS_ROUTES:
+        params = parse_qs(environ.get("QUERY_STRING", ""))
+        try:
+            payload, status = STATUS_ROUTES[path](params), "200 OK"
+        except FileNotFoundError as exc:
+            payload, status = {"error": str(exc)}, "404 Not Found"
+        body = json.dumps(payload).encode("utf-8")
+        return body, status, [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+        ]
+    handler = ROUTES.get(path)
+    api_handler = API_ROUTES.get(path)
+    if handler is None and api_handler is None:
+        return _serve_static(path)
+    try:
+        with stage("upload.intake"):
+            form = _parse_form(environ)
+    except UploadTooLarge as exc:
+        if api_handler is not None:
+            status, content_type, chunks = api.error_response("413 Payload Too Large", str(exc))
+            return b"".join(chunks), status, [("Content-Type", content_type)]
+        body = f"<h1>File too large</h1><p>{html.escape(str(exc))}</p>".encode("utf-8")
+        return body, "413 Payload Too Large", [
+            ("Content-Type", "text/html"),
+            ("Content-Length", str(len(body))),
+        ]
+    if api_handler is not None:
+        status, content_type, chunks = api_handler(form)
+        return chunks, status, [("Content-Type", content_type)]
+    body = handler(form).encode("utf-8")
+    return body, "200 OK", [
+        ("Content-Type", "text/html; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+    ]
+
+
+class PooledWSGIServer(WSGIServer):
+    """WSGIServer that hands each accepted connection to a fixed thread pool."""
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS):
+        # Created first: a failed bind calls server_close() from __init__
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="cap-worker"
+        )
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def make_server(host, port, workers=DEFAULT_WORKERS):
+    """Create a pooled WSGI server bound to ``host:port`` serving the app."""
+    server = PooledWSGIServer((host, port), WSGIRequestHandler, workers=workers)
+    server.set_app(application)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the CAP app without CGI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="number of request worker threads")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args.host, args.port, args.workers)
+    store.start_sweeper()
+    logger.info("Serving on http://%s:%d/ with %d workers", args.host, args.port, args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Tests for the browser-free portal backend against ``benchmarks/mock_portal.py``."""
+
+import os
+import sys
+import unittest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, "cgi-bin"))
+sys.path.insert(0, os.path.join(BASE_DIR, "benchmarks"))
+
+from cap_http import CAPPortalHTTPClient, PortalPage  # noqa: E402
+from mock_portal import MockPortal, start_portal  # noqa: E402
+
+
+class FailAfterLoginPortal(MockPortal):
+    """Mock portal whose first page load after a successful login fails with a 503."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_next_get = False
+
+    def __call__(self, environ, start_response):
+        if environ["REQUEST_METHOD"] == "GET" and self.fail_next_get:
+            self.fail_next_get = False
+            return self._page(start_response, "<h1>Service Unavailable</h1>",
+                              "503 Service Unavailable")
+        return super().__call__(environ, start_response)
+
+    def _login(self, environ, start_response):
+        response = super()._login(environ, start_response)
+        self.fail_next_get = True
+        return response
+
+
+class LoginRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.portal = FailAfterLoginPortal(specimens=2, analytes=2)
+        self.server, self.url = start_portal(self.portal)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_retry_after_session_was_set_sees_dashboard(self):
+        client = CAPPortalHTTPClient(self.url, "user", "secret", retry_backoff=0)
+        client.setup_driver()
+        self.addCleanup(client.close)
+        self.assertTrue(client.login())
+        self.assertIn("dashboard", client.page.classes)
+        self.assertFalse(self.portal.fail_next_get)
+
+
+class PortalPageTest(unittest.TestCase):
+    def test_textarea_is_posted(self):
+        page = PortalPage("http://portal/", """
+            <form id="f" method="post" action="/submit">
+              <input type="hidden" name="kit" value="K1">
+              <textarea name="comment">
+line one
+&amp; two</textarea>
+              <input type="submit" value="Submit Data">
+            </form>""")
+        form = page.find_form(form_id="f")
+        self.assertEqual(form.payload(button="Submit Data"),
+                         [("kit", "K1"), ("comment", "line one\n& two")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+"""Tests for the spreadsheet checks in ``upload.analyze_data``."""
+
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_DIR, "cgi-bin"))
+
+from upload import analyze_data  # noqa: E402
+
+
+class DuplicateTest(unittest.TestCase):
+    def test_repeated_blank_specimen_ids_are_duplicates(self):
+        df = pd.DataFrame({
+            "Sample ID": pd.Series(["S1", None, "S1", None, "S2"], dtype=object),
+            "GLU": [1.0, 2.0, 3.0, 4.0, 5.0],
+        })
+        duplicates = [issue for issue in analyze_data(df)[1] if issue["type"] == "duplicate"]
+        self.assertEqual(duplicates, [
+            {"type": "duplicate", "specimen": "S1", "analyte": "GLU", "count": 2},
+            {"type": "duplicate", "specimen": None, "analyte": "GLU", "count": 2},
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Background worker that runs queued CAP portal automation jobs.
+
+The web step (``cgi-bin/automation.py``) only records a job in the SQLite
+queue from ``cgi-bin/jobs.py``. This process claims queued jobs one at a
+time, loads the stored upload, runs ``perform_cap_automation`` and reports
+progress per specimen so the status page can show it. Several workers may
+run at once, and ``--threads`` runs several jobs (kits) concurrently in
+one worker; each job is claimed by exactly one thread. However many
+threads and workers ask, at most ``max_kits_per_account`` kits run at once
+per portal account (the slots are leased in the job database).
+
+Each automation phase is timed (see ``timing``): a job's per-phase totals
+are logged when it finishes, and ``--metrics-port`` serves the latency
+histograms at ``/metrics`` in the same format as the web server.
+
+Browsers are kept open and logged in between jobs (see ``SessionPool`` in
+``cap_automation``) and are launched when the worker starts, so a day of
+kits pays for Chrome startup and portal login once rather than per kit.
+
+Usage::
+
+    python3 worker.py [--threads 4] [--poll-interval 2] [--once] [--metrics-port 9101]
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CGI_DIR = os.path.join(BASE_DIR, "cgi-bin")
+
+# Same module layout as server.py: the cgi-bin modules import each other
+# as top-level modules.
+sys.path.insert(0, CGI_DIR)
+
+from cap_automation import (  # noqa: E402
+    AutomationConfig,
+    get_session_pool,
+    perform_cap_automation,
+    summarize_kit_results,
+)
+from jobs import HEARTBEAT_SECONDS, JobQueue  # noqa: E402
+from timing import metrics, request_timings  # noqa: E402
+from upload import load_temp_data  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def heartbeat(queue, job_id, worker_id, interval=HEARTBEAT_SECONDS):
+    """Keep a claimed job from looking stalled while it runs.
+
+    Chrome startup, login and the kit search report no progress, so a
+    daemon thread refreshes the job every ``interval`` seconds until the
+    block exits. It stops early, with a warning, if the job was taken away
+    from this worker.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            if not queue.heartbeat(job_id, worker_id):
+                logger.warning("Job %s is no longer held by %s", job_id, worker_id)
+                return
+
+    thread = threading.Thread(target=beat, name=f"cap-heartbeat-{job_id[:8]}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(queue, job):
+    """Run one claimed job to completion, record and return its result."""
+    job_id = job["id"]
+    worker_id = job["worker"]
+    logger.info("Running job %s for kit %s", job_id, job["kit_number"])
+    start = time.monotonic()
+    with request_timings() as timings, heartbeat(queue, job_id, worker_id):
+        try:
+            data = load_temp_data(job["data_key"])
+            success, message = perform_cap_automation(
+                job["kit_number"],
+                data,
+                progress=lambda done, errors: queue.update_progress(job_id, worker_id, done, errors),
+                data_key=job["data_key"],
+            )
+        except Exception as exc:
+            logger.exception("Job %s failed", job_id)
+            success, message = False, f"Automation error: {exc}"
+    if queue.finish(job_id, worker_id, success, message):
+        logger.info("Job %s finished: %s", job_id, message)
+    else:
+        logger.warning("Job %s was requeued while running; its result was not recorded: %s",
+                       job_id, message)
+    logger.info("Job %s timings (ms): %s", job_id, timings.server_timing())
+    return {
+        "kit_number": job["kit_number"],
+        "success": success,
+        "message": message,
+        "seconds": round(time.monotonic() - start, 2),
+    }
+
+
+def warm_sessions():
+    """Pre-launch the pooled browsers if automation is configured."""
+    config = AutomationConfig()
+    if not config.is_configured() or int(config.config.get("session_pool_size", 2)) <= 0:
+        return
+    try:
+        count = get_session_pool(config.config, config.config.get("backend", "selenium")).warm()
+        logger.info("Started %d browser session(s)", count)
+    except Exception:
+        logger.exception("Could not pre-launch browser sessions")
+
+
+def work(queue, worker_id, poll_interval, once, results):
+    """Claim and run jobs until the queue is empty (``once``) or forever."""
+    while True:
+        requeued = queue.requeue_stale()
+        if requeued:
+            logger.warning("Requeued %d stalled job(s)", requeued)
+        job = queue.claim(worker_id)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        results.append(run_job(queue, job))
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve this worker's stage histograms at ``/metrics`` from a daemon thread."""
+    from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    def app(environ, start_response):
+        if environ.get("PATH_INFO") != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found\n"]
+        body = metrics.render_prometheus().encode("utf-8")
+        start_response("200 OK", [
+            ("Content-Type", "text/plain; version=0.0.4"),
+            ("Content-Length", str(len(body))),
+        ])
+        return [body]
+
+    server = make_server(host, port, app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="cap-metrics", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued CAP automation jobs.")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="seconds to wait when the queue is empty")
+    parser.add_argument("--once", action="store_true",
+                        help="exit once the queue is empty")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="number of jobs to run concurrently")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve stage latency histograms on this port")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    queue = JobQueue()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    if not args.once:
+        warm_sessions()
+    results = []
+    start = time.monotonic()
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(queue, f"{worker_id}:{n}", args.poll_interval, args.once, results),
+            name=f"cap-worker-{n}",
+        )
+        for n in range(max(1, args.threads))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if results:
+        report = summarize_kit_results(results, time.monotonic() - start)
+        logger.info("Ran %d kit(s) in %.1fs: %d succeeded, %d failed",
+                    report["kits"], report["seconds"], report["succeeded"], report["failed"])
+        for result in report["results"]:
+            logger.info("  %s: %s (%.1fs)", result["kit_number"], result["message"], result["seconds"])
+
+
+if __name__ == "__main__":
+    main()